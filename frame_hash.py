@@ -0,0 +1,25 @@
+# Perceptual difference hash (dHash) of the frames. The imager puts the hash in
+# the frame metadata, the orchestrator compares the hashes to reuse the detection
+# results for the look-alike frames (and hashes the frames that come w/o it).
+# This file should be copied alongside shared_settings.py when creating the docker
+# container for each service that produces or consumes the frame hashes.
+import cv2
+import numpy as np
+
+HASH_size = 16 # the hash is HASH_size x HASH_size bits (the signs of the horizontal gradients)
+
+# Calculate the dHash of the BGR (or grayscale) frame, returns it as the hex string.
+# The frames that look alike have the hashes w/ small Hamming distance between them.
+def frame_dhash(img):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (HASH_size + 1, HASH_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return np.packbits(bits).tobytes().hex()
+
+# Calculate the dHash of the JPEG image data decoded at the reduced scale (same as
+# the imager uses for the published frames), None if can't decode
+def jpeg_dhash(img_data):
+    gray = cv2.imdecode(np.frombuffer(img_data, dtype="uint8"), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if gray is None:
+        return None
+    return frame_dhash(gray)
@@ -0,0 +1,226 @@
+# Shared memory frame ring for passing images from the imager to the consumers
+# (orchestrator, UI, image collector) w/o going through the base64 JSON files.
+# This file should be copied alongside shared_settings.py when creating the docker
+# container for each service that produces or consumes the images.
+# The ring is a memory mapped file (under the channel folder of the IPC_DIR, so
+# it works across the containers sharing the volume). Layout:
+#  ring header: magic, version, flags, slot count, slot size, latest published seq
+#  slot header: seq (seqlock counter), time, iteration, data size, metadata size
+#  slot body:   metadata JSON (channel ID/name, ...) followed by the image data
+# The writer makes the slot seq odd while updating the slot and even when done,
+# then publishes the seq in the ring header. The readers check that the slot seq
+# is the same before and after accessing the data to detect torn/overwritten frames.
+# The writer touches the ring file after publishing each frame (the memory writes do not
+# generate the file change events), so the readers can wait for the frames w/ inotify.
+import os
+import sys
+import mmap
+import json
+import time
+import struct
+
+RING_magic = b'WMFR'
+RING_version = 1
+RING_hdr_fmt = '<4sIIIIQ'   # magic, version, flags, slots, slot size, latest seq
+RING_hdr_size = 64
+RING_flags_off = struct.calcsize('<4sI')    # offset of the flags field in the header
+RING_latest_off = struct.calcsize('<4sIIII') # offset of the latest seq field in the header
+RING_slot_hdr_fmt = '<QdQII' # seq, time, iteration, data size, metadata size
+RING_slot_hdr_size = 64
+RING_flag_retired = 0x1     # the ring file was replaced (e.g. grown), readers should reopen
+RING_def_slots = 4          # default number of slots in the ring
+RING_min_slot_size = 1 << 20 # smallest slot we create (1MB)
+
+# Calculate the slot size suitable for the JPEG images of the given dimensions
+def ring_slot_size(width, height):
+    size = RING_slot_hdr_size + 4096 + width * height
+    size = max(size, RING_min_slot_size)
+    return (size + 4095) & ~4095
+
+# Mark the ring file (if any) as retired, so the readers drop it and reopen
+def ring_retire(path):
+    try:
+        with open(path, "r+b") as f:
+            f.seek(RING_flags_off)
+            f.write(struct.pack('<I', RING_flag_retired))
+    except:
+        pass
+
+# Frame view returned to the ring readers. The data is a memoryview into the
+# shared memory (no copying), is_valid() tells if it was overwritten since.
+class FrameView:
+    def __init__(self, mm, slot_off, seq, f_time, f_iter, meta, data):
+        self.mm = mm
+        self.slot_off = slot_off
+        self.seq = seq # frame sequence number (the slot seqlock value is seq * 2)
+        self.time = f_time
+        self.iter = f_iter
+        self.meta = meta
+        self.data = data
+
+    # Check that the frame has not been touched by the writer since it was read
+    def is_valid(self):
+        try:
+            seq, = struct.unpack_from('<Q', self.mm, self.slot_off)
+        except:
+            return False
+        return seq == self.seq * 2
+
+    # Make a copy of the frame data that stays valid after the slot is reused,
+    # returns None if the frame was overwritten before the copy completed.
+    def copy_data(self):
+        data = bytes(self.data)
+        return data if self.is_valid() else None
+
+# Writer side (single writer per ring, the imager channel runner)
+class FrameRingWriter:
+    def __init__(self, path, slot_size, slots=RING_def_slots):
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.seq = 0
+        self.mm = None
+        self.create()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.mm is not None:
+            try: self.mm.close()
+            except: pass
+            self.mm = None
+
+    # Create (or replace) the ring file and map it
+    def create(self):
+        if self.mm is None:
+            ring_retire(self.path)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.truncate(RING_hdr_size + self.slots * self.slot_size)
+            f.write(struct.pack(RING_hdr_fmt, RING_magic, RING_version, 0, self.slots, self.slot_size, 0))
+        with open(tmp_path, "r+b") as f:
+            mm = mmap.mmap(f.fileno(), 0)
+        old_mm = self.mm
+        os.rename(tmp_path, self.path)
+        self.mm = mm
+        # tell the readers of the old ring to reopen
+        if old_mm is not None:
+            struct.pack_into('<I', old_mm, RING_flags_off, RING_flag_retired)
+            try: old_mm.close()
+            except: pass
+
+    # Publish a frame, returns its sequence number
+    def publish(self, data, iteration, meta=None, f_time=None):
+        meta_bytes = json.dumps(meta if meta is not None else {}).encode()
+        need = RING_slot_hdr_size + len(meta_bytes) + len(data)
+        if need > self.slot_size:
+            self.slot_size = (need * 2 + 4095) & ~4095
+            print(f"{sys._getframe().f_code.co_name}: growing {self.path} slot size to {self.slot_size}")
+            self.create()
+        f_time = time.time() if f_time is None else f_time
+        self.seq += 1
+        slot_off = RING_hdr_size + (self.seq % self.slots) * self.slot_size
+        mm = self.mm
+        # seqlock: odd while writing, even when done
+        struct.pack_into('<Q', mm, slot_off, self.seq * 2 - 1)
+        body_off = slot_off + RING_slot_hdr_size
+        mm[body_off:body_off + len(meta_bytes)] = meta_bytes
+        data_off = body_off + len(meta_bytes)
+        mm[data_off:data_off + len(data)] = data
+        struct.pack_into(RING_slot_hdr_fmt, mm, slot_off, self.seq * 2 - 1, f_time, iteration, len(data), len(meta_bytes))
+        struct.pack_into('<Q', mm, slot_off, self.seq * 2)
+        struct.pack_into('<Q', mm, RING_latest_off, self.seq)
+        # wake up the readers watching the file
+        try: os.utime(self.path)
+        except: pass
+        return self.seq
+
+# Reader side (any number of readers)
+class FrameRingReader:
+    def __init__(self, path):
+        self.path = path
+        self.mm = None
+        self.ino = None
+        self.slots = 0
+        self.slot_size = 0
+        self.last_seq = 0 # sequence number of the last frame returned by read_next()
+
+    def __del__(self):
+        self.close()
+
+    # Unmap the ring (the mapping stays around until all the frame views are released)
+    def close(self):
+        if self.mm is not None:
+            try: self.mm.close()
+            except: pass
+            self.mm = None
+        self.last_seq = 0
+
+    # Map the ring file, return False if not available (yet)
+    def open(self):
+        self.close()
+        try:
+            with open(self.path, "rb") as f:
+                ino = os.fstat(f.fileno()).st_ino
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            return False
+        magic, version, flags, slots, slot_size, _ = struct.unpack_from(RING_hdr_fmt, mm, 0)
+        if magic != RING_magic or version != RING_version or slots == 0:
+            print(f"{sys._getframe().f_code.co_name}: {self.path} is not a valid frame ring")
+            mm.close()
+            return False
+        self.mm = mm
+        self.ino = ino
+        self.slots = slots
+        self.slot_size = slot_size
+        return True
+
+    # Check if the mapped ring is still the one the writer works with (the imager
+    # might have restarted or recreated the channel folder)
+    def is_stale(self):
+        if self.mm is None or struct.unpack_from('<I', self.mm, RING_flags_off)[0] & RING_flag_retired:
+            return True
+        try:
+            return os.stat(self.path).st_ino != self.ino
+        except:
+            return True
+
+    # Get the latest frame if its sequence number is above after_seq, None otherwise
+    def read_latest(self, after_seq=0, retries=3):
+        if self.mm is None or struct.unpack_from('<I', self.mm, RING_flags_off)[0] & RING_flag_retired:
+            if not self.open():
+                return None
+            after_seq = 0
+        for _ in range(retries):
+            latest, = struct.unpack_from('<Q', self.mm, RING_latest_off)
+            if latest == 0 or latest <= after_seq:
+                # nothing new, make sure we are not looking at a dead ring
+                if self.is_stale() and self.open():
+                    after_seq = 0
+                    continue
+                return None
+            slot_off = RING_hdr_size + (latest % self.slots) * self.slot_size
+            seq, f_time, f_iter, data_size, meta_size = struct.unpack_from(RING_slot_hdr_fmt, self.mm, slot_off)
+            if seq != latest * 2:
+                time.sleep(0.001)
+                continue # being written or already reused
+            body_off = slot_off + RING_slot_hdr_size
+            try:
+                meta = json.loads(bytes(self.mm[body_off:body_off + meta_size]))
+            except:
+                continue
+            data_off = body_off + meta_size
+            data = memoryview(self.mm)[data_off:data_off + data_size]
+            frame = FrameView(self.mm, slot_off, latest, f_time, f_iter, meta, data)
+            if frame.is_valid():
+                return frame
+        return None
+
+    # Get the latest frame not returned by this reader yet (None if nothing new)
+    def read_next(self):
+        frame = self.read_latest(self.last_seq)
+        if frame is not None:
+            self.last_seq = frame.seq
+        return frame
@@ -0,0 +1,111 @@
+# This is a development tool for the project. It compares the memory and
+# CPU used by the imager w/ the "fork" (process per channel) and "threads"
+# (single process capture engine) engines. For each engine and channel count
+# it generates a sources.json w/ synthetic file:// channels in a temporary
+# DATA_DIR, runs the imager there for a while and reports the total PSS
+# (proportional set size, so the memory shared by the forked processes is
+# not counted multiple times) and the CPU usage of the imager process tree.
+# Usage: python imager/bench_capture_engine.py [seconds] [channel counts...]
+import os
+import sys
+import json
+import time
+import signal
+import tempfile
+import subprocess
+import numpy as np
+import cv2
+
+# Pull in shared variables (file names, JSON object names, ...)
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.abspath("."))
+from shared_settings import *
+
+IMAGER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "imager.py")
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+# Get the list of the pids in the process tree starting at pid
+def process_tree(pid):
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", "r") as f:
+            for child in f.read().split():
+                pids += process_tree(int(child))
+    except:
+        pass
+    return pids
+
+# Get PSS (in KB) of the process
+def process_pss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1])
+    except:
+        pass
+    return 0
+
+# Get CPU time (user + system, seconds) used by the process
+def process_cpu_sec(pid):
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLK_TCK
+    except:
+        return 0.0
+
+# Create the data folders w/ synthetic image and the sources config for the channel count
+def make_config(data_dir, engine, channels):
+    cfg_dir = f"{data_dir}/{CFG_dir}"
+    os.makedirs(cfg_dir, exist_ok=True)
+    img_file = f"{data_dir}/synthetic.jpg"
+    img = np.random.randint(0, 255, (1080, 1920, 3), dtype=np.uint8)
+    cv2.imwrite(img_file, img)
+    cfg = {
+        CFG_version_key: 1,
+        CFG_engine_key: engine,
+        CFG_channels_key: [
+            {
+                CFG_chan_id_key: f"chan{idx}",
+                CFG_chan_name_key: f"Channel {idx}",
+                CFG_chan_url_key: f"file://{img_file}",
+                CFG_chan_upd_int_key: 1,
+            } for idx in range(channels)
+        ]
+    }
+    with open(f"{cfg_dir}/{CFG_imager}", "w") as f:
+        json.dump(cfg, f)
+
+# Run the imager w/ the engine and channel count, return (PSS MB, CPU %)
+def bench(engine, channels, seconds):
+    with tempfile.TemporaryDirectory() as data_dir:
+        make_config(data_dir, engine, channels)
+        env = dict(os.environ, DATA_DIR=data_dir, IPC_DIR=f"{data_dir}/ipc")
+        proc = subprocess.Popen([sys.executable, "-u", IMAGER_SCRIPT], env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            time.sleep(5) # let all the channels start
+            pids = process_tree(proc.pid)
+            start_cpu = sum([process_cpu_sec(p) for p in pids])
+            start_time = time.time()
+            time.sleep(seconds)
+            pids = process_tree(proc.pid)
+            cpu = sum([process_cpu_sec(p) for p in pids]) - start_cpu
+            cpu_perc = cpu / (time.time() - start_time) * 100.0
+            pss_mb = sum([process_pss_kb(p) for p in pids]) / 1024.0
+        finally:
+            for p in reversed(process_tree(proc.pid)):
+                try: os.kill(p, signal.SIGKILL)
+                except: pass
+            proc.wait()
+    return pss_mb, cpu_perc
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 30.0
+    counts = [int(c) for c in sys.argv[2:]] if len(sys.argv) > 2 else [10, 50, 100]
+    print(f"{'engine':<10}{'channels':>10}{'PSS MB':>10}{'cpu %':>10}")
+    for channels in counts:
+        for engine in [IMG_engine_fork, IMG_engine_threads]:
+            pss_mb, cpu_perc = bench(engine, channels, seconds)
+            print(f"{engine:<10}{channels:>10}{pss_mb:>10.1f}{cpu_perc:>10.1f}")
@@ -0,0 +1,100 @@
+# This is a development tool for the project. It generates a corpus of
+# synthetic clean and corrupted (smeared, grey blocks) 1080p frames, runs
+# the corrupt frame detector (see frame_check.py) on them, reports the time
+# it takes per frame and the detection rates for a range of the thresholds
+# to help tuning the rtsp_bf_score channel setting. The clean frames include
+# the hard cases (flat sky, dark areas). Optionally, the real frames (JPEGs
+# from a folder, e.g. collected by image_collector.py) are added as clean ones.
+# Usage: python imager/bench_frame_check.py [count] [save_dir] [real_frames_dir]
+import os
+import sys
+import time
+import glob
+import numpy as np
+import cv2
+
+# Pull in shared variables (file names, JSON object names, ...)
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.abspath("."))
+from shared_settings import *
+from frame_check import *
+
+FRAME_h, FRAME_w = 1080, 1920
+MB_size = 16 # macroblock size, the corruption is aligned to it
+
+# Generate a synthetic "natural" frame: smooth gradients, textured shapes, noise,
+# a flat sky and a dark area in some of them
+def gen_clean(rng):
+    low = rng.integers(0, 255, (9, 16, 3), dtype=np.uint8)
+    img = cv2.resize(low, (FRAME_w, FRAME_h), interpolation=cv2.INTER_CUBIC)
+    for _ in range(rng.integers(5, 30)):
+        color = [int(c) for c in rng.integers(0, 255, 3)]
+        x, y = int(rng.integers(0, FRAME_w)), int(rng.integers(0, FRAME_h))
+        if rng.random() < 0.5:
+            cv2.circle(img, (x, y), int(rng.integers(10, 200)), color, -1)
+        else:
+            cv2.rectangle(img, (x, y), (x + int(rng.integers(10, 400)), y + int(rng.integers(10, 300))), color, -1)
+    texture = rng.normal(0, rng.uniform(2, 12), img.shape)
+    img = np.clip(img.astype(np.float32) + texture, 0, 255).astype(np.uint8)
+    if rng.random() < 0.3: # flat sky at the top
+        img[:int(FRAME_h * rng.uniform(0.2, 0.5))] = [int(c) for c in rng.integers(150, 255, 3)]
+    if rng.random() < 0.3: # dark ground at the bottom
+        img[-int(FRAME_h * rng.uniform(0.2, 0.5)):] = int(rng.integers(0, 20))
+    return img
+
+# Smear the frame from a random macroblock row down to the bottom
+def gen_smeared(rng, img):
+    img = img.copy()
+    row = int(rng.integers(FRAME_h // (2 * MB_size), FRAME_h // MB_size - 4)) * MB_size
+    img[row:] = img[row - 1]
+    return img
+
+# Fill a random run of macroblocks (to the end of the frame) w/ grey
+def gen_grey(rng, img):
+    img = img.copy()
+    mb_w, mb_h = FRAME_w // MB_size, FRAME_h // MB_size
+    start = int(rng.integers(mb_w * mb_h // 3, mb_w * mb_h * 5 // 6))
+    mb_row, mb_col = start // mb_w, start % mb_w
+    img[mb_row * MB_size:(mb_row + 1) * MB_size, mb_col * MB_size:] = 128
+    img[(mb_row + 1) * MB_size:] = 128
+    return img
+
+# Load the real frames to use as clean ones
+def load_real(dir, count):
+    frames = []
+    for f in sorted(glob.glob(f"{dir}/**/*.jpg", recursive=True))[:count]:
+        img = cv2.imread(f)
+        if img is not None:
+            frames.append(cv2.resize(img, (FRAME_w, FRAME_h)))
+    return frames
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    save_dir = sys.argv[2] if len(sys.argv) > 2 else None
+    real_dir = sys.argv[3] if len(sys.argv) > 3 else None
+    rng = np.random.default_rng(12345)
+    clean = [gen_clean(rng) for _ in range(count)]
+    if real_dir is not None:
+        clean += load_real(real_dir, count)
+    corpus = [('clean', img) for img in clean]
+    corpus += [('smeared', gen_smeared(rng, img)) for img in clean]
+    corpus += [('grey', gen_grey(rng, img)) for img in clean]
+    if save_dir is not None:
+        for idx, (kind, img) in enumerate(corpus):
+            os.makedirs(f"{save_dir}/{kind}", exist_ok=True)
+            cv2.imwrite(f"{save_dir}/{kind}/{idx:04}.png", img)
+
+    scores = {'clean': [], 'smeared': [], 'grey': []}
+    elapsed = 0.0
+    for kind, img in corpus:
+        start = time.perf_counter()
+        score, _, _ = frame_corruption_score(img)
+        elapsed += time.perf_counter() - start
+        scores[kind].append(score)
+    print(f"{len(corpus)} frames {FRAME_w}x{FRAME_h}, {elapsed * 1000.0 / len(corpus):.3f} ms per frame")
+    for kind, s in scores.items():
+        print(f"{kind:<8} score min {min(s):.3f} median {float(np.median(s)):.3f} max {max(s):.3f}")
+    print(f"{'thresh':>8}{'clean bad %':>14}{'smeared bad %':>15}{'grey bad %':>12}")
+    for thresh in [0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.4, 0.5]:
+        rates = [np.mean(np.array(scores[k]) > thresh) * 100.0 for k in ['clean', 'smeared', 'grey']]
+        print(f"{thresh:>8.2f}{rates[0]:>14.1f}{rates[1]:>15.1f}{rates[2]:>12.1f}")
@@ -0,0 +1,63 @@
+# This is a development tool for the project. It measures the CPU
+# the imager spends on an RTSP channel in each of the decode modes
+# (see CFG_chan_rtsp_decode_key). For each mode it runs the background
+# grabber on the stream for a while, pulling a frame every upd_int
+# seconds the same way the imager does, and reports the CPU time used.
+# Usage: python imager/bench_rtsp_decode.py <rtsp_url> [seconds] [upd_int]
+import os
+import sys
+import time
+import resource
+
+# Reduce FFMPG log level to "fatal" only
+os.environ['OPENCV_FFMPEG_LOGLEVEL'] = '8'
+
+# Pull in shared variables (file names, JSON object names, ...)
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.abspath("."))
+from shared_settings import *
+from rtsp_grabber import *
+
+# Get the CPU time (user + system) used by the process so far (all threads)
+def cpu_time():
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    return ru.ru_utime + ru.ru_stime
+
+# Run the grabber in the given decode mode, return (cpu %, grabbed fps, published frames)
+def bench_mode(url, decode_mode, seconds, upd_int):
+    grabber = RtspGrabber(url, decode_mode)
+    # let it connect and settle before measuring
+    frame_no, img = grabber.read(0, RTSP_read_timeout * 2)
+    if img is None:
+        grabber.stop()
+        return None
+    start_cpu = cpu_time()
+    start_time = time.time()
+    start_frame_no = grabber.frame_no
+    published = 0
+    while time.time() - start_time < seconds:
+        frame_no, img = grabber.read(frame_no)
+        if img is not None:
+            published += 1
+        time.sleep(upd_int)
+    elapsed = time.time() - start_time
+    cpu = (cpu_time() - start_cpu) / elapsed * 100.0
+    fps = (grabber.frame_no - start_frame_no) / elapsed
+    grabber.stop()
+    return cpu, fps, published
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: python {sys.argv[0]} <rtsp_url> [seconds] [upd_int]")
+        exit(1)
+    url = sys.argv[1]
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 30.0
+    upd_int = float(sys.argv[3]) if len(sys.argv) > 3 else CFG_DEF_upd_int
+    print(f"{'mode':<12}{'cpu %':>8}{'grab fps':>10}{'published':>11}")
+    for mode in RTSP_decode_opts.keys():
+        res = bench_mode(url, mode, seconds, upd_int)
+        if res is None:
+            print(f"{mode:<12}{'failed to get frames':>29}")
+            continue
+        cpu, fps, published = res
+        print(f"{mode:<12}{cpu:>8.1f}{fps:>10.1f}{published:>11}")
@@ -0,0 +1,142 @@
+# Single process capture engine (alternative to forking a process for each channel).
+# The channels are scheduled by an asyncio event loop running in its own thread.
+# The snapshot URLs are fetched w/ the asyncio HTTP client, the blocking work (RTSP,
+# files, image decoding/encoding) runs in a bounded thread pool. Each channel runs
+# its own task, so an error in one channel does not affect the others. The hangs are
+# detected by the manager through the channel runner timestamps kept in memory.
+# The blocking calls can't be interrupted, so the pool threads stuck in the stopped
+# channels' updates are abandoned (they release the channel's capture objects if they
+# ever return). Once too many of the pool threads are stuck, the pool is replaced.
+# The channel runner objects are the imager's ChannelDownloadRunner instances.
+import os
+import sys
+import time
+import asyncio
+import threading
+import aiohttp
+from concurrent.futures import ThreadPoolExecutor
+
+# Pull in shared variables (file names, JSON object names, ...)
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.abspath("."))
+from shared_settings import *
+
+ENGINE_max_stuck_frac = 0.5 # fraction of the pool threads stuck in the abandoned updates before replacing the pool
+
+class CaptureEngine:
+    def __init__(self, workers=CFG_DEF_engine_workers):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="capture")
+        self.loop = asyncio.new_event_loop()
+        self.http = None  # aiohttp client session (created in the event loop)
+        self.tasks = {}   # channel tasks (concurrent.futures.Future), keyed by channel ID
+        self.runners = {} # channel runners of the tasks, keyed by channel ID
+        self.abandoned = [] # stopped channel runners w/ the update still running in the pool
+        self.thread = threading.Thread(target=self.loop.run_forever, name="capture-loop", daemon=True)
+        self.thread.start()
+        print(f"Started capture engine w/ {workers} workers, pid: {os.getpid()}")
+
+    def __del__(self):
+        self.stop()
+
+    # Stop all the channels and the event loop
+    def stop(self):
+        if self.loop is None:
+            return
+        for chan_id in list(self.tasks.keys()):
+            self.stop_channel(chan_id)
+        if self.http is not None:
+            asyncio.run_coroutine_threadsafe(self.http.close(), self.loop).result(timeout=5)
+            self.http = None
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.loop = None
+
+    # Start the channel runner task
+    def start_channel(self, c_runner, iteration):
+        self.stop_channel(c_runner.chan_id)
+        c_runner.busy_since = 0.0
+        c_runner.last_loop_time = time.time()
+        self.tasks[c_runner.chan_id] = asyncio.run_coroutine_threadsafe(self.channel_task(c_runner, iteration), self.loop)
+        self.runners[c_runner.chan_id] = c_runner
+        print(f"Started downloader task for channel: {c_runner.chan_id}")
+
+    # Stop the channel runner task (a blocking call stuck in the thread pool is
+    # abandoned, it will free the worker when/if it returns)
+    def stop_channel(self, chan_id):
+        task = self.tasks.pop(chan_id, None)
+        if task is not None:
+            task.cancel()
+        c_runner = self.runners.pop(chan_id, None)
+        if c_runner is not None and c_runner.updating:
+            self.abandoned.append(c_runner)
+            self.check_stuck()
+
+    # Replace the thread pool if too many of its threads are stuck in the abandoned channel
+    # updates (the stuck threads are left to finish in the old pool)
+    def check_stuck(self):
+        self.abandoned = [r for r in self.abandoned if r.updating]
+        if len(self.abandoned) < max(1, int(self.workers * ENGINE_max_stuck_frac)):
+            return
+        print(f"{sys._getframe().f_code.co_name}: {len(self.abandoned)} capture threads are stuck, replacing the thread pool")
+        old_executor = self.executor
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="capture")
+        old_executor.shutdown(wait=False) # the queued updates still run on its threads that are not stuck
+        self.abandoned = []
+
+    # Check if the channel task is running
+    def is_channel_running(self, chan_id):
+        task = self.tasks.get(chan_id)
+        return task is not None and not task.done()
+
+    # Fetch the snapshot from HTTP/s URL, returns None if not modified since the last fetch
+    async def fetch_http(self, c_runner, url):
+        if self.http is None:
+            connector = aiohttp.TCPConnector(ssl=False, limit=self.workers * 4, keepalive_timeout=60)
+            self.http = aiohttp.ClientSession(connector=connector)
+        timeout = aiohttp.ClientTimeout(total=c_runner.http_timeout, connect=min(IMG_http_connect_timeout, c_runner.http_timeout))
+        async with self.http.get(url, headers=c_runner.http_validators, timeout=timeout) as response:
+            if response.status == 304: # not modified
+                return None
+            response.raise_for_status() # Check for HTTP errors
+            c_runner.http_save_validators(response.headers)
+            return await response.read()
+
+    # Handle one update of the channel, returns the result for the next update
+    async def channel_update(self, c_runner, iteration, prev_res):
+        url = c_runner.ch[CFG_chan_url_key]
+        content = None
+        # the MJPEG streams are read by the channel's own grabber thread
+        if (url.lower().startswith("http://") or url.lower().startswith("https://")) and c_runner.http_mode == IMG_http_snapshot:
+            if c_runner.is_off():
+                return True
+            try:
+                content = await self.fetch_http(c_runner, url)
+            except Exception as e:
+                print(f"{sys._getframe().f_code.co_name}: {c_runner.chan_id}: error, {e}")
+                return False
+            if content is None:
+                return True # not modified, nothing to do
+        return await self.loop.run_in_executor(self.executor, c_runner.engine_update, iteration, prev_res, content)
+
+    # Channel task, calls the channel runner every IMG_poll_int_ms
+    async def channel_task(self, c_runner, iteration):
+        prev_res = True # assume success when starting
+        while True:
+            start_time_ms = int(time.time() * 1000)
+            c_runner.last_loop_time = start_time_ms / 1000.0
+            if iteration % c_runner.upd_int == 0:
+                c_runner.busy_since = c_runner.last_loop_time
+                try:
+                    prev_res = await self.channel_update(c_runner, iteration, prev_res)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"{sys._getframe().f_code.co_name}: {c_runner.chan_id}: unexpected error, {e}")
+                    prev_res = False
+                c_runner.busy_since = 0.0
+            iteration += 1
+            end_time_ms = int(time.time() * 1000)
+            if start_time_ms + IMG_poll_int_ms > end_time_ms:
+                await asyncio.sleep((start_time_ms + IMG_poll_int_ms - end_time_ms) / 1000.0)
@@ -0,0 +1,97 @@
+# Corrupt frame detection and quality scoring for the channel frames. The frames
+# broken by the lost stream data typically show one of the two patterns:
+#  - smearing: the last decoded row of pixels is stretched down (vertically the
+#    rows repeat, but each row still has the horizontal detail of the image)
+#  - grey blocks: the macroblocks w/ no data are filled w/ flat grey color
+# The checks run on a downscaled copy of the whole frame (int16 math, no per-row
+# Python loops), so they take a fraction of a millisecond even for 1080p frames.
+# The quality score (for picking the best of several frames and for skipping the
+# poor ones) combines the sharpness, the exposure and the corruption score.
+import cv2
+import numpy as np
+
+CHECK_width = 240        # width of the downscaled frame used for the checks
+CHECK_smear_ratio = 0.15 # row is smeared if its vertical diff is below this fraction of the horizontal one
+CHECK_smear_min_hdiff = 2.0 # min horizontal diff for the row to be considered for smearing (ignore flat areas)
+CHECK_grid = (9, 16)     # rows, columns of the cells for the grey block check
+CHECK_grey_max_std = 2.0 # max std of the flat grey cell
+CHECK_grey_max_dist = 16 # max distance of the flat grey cell mean from 128
+CHECK_grey_max_chroma = 6 # max difference between the color channel means of the grey cell
+
+# Calculate the corruption score of the BGR (or grayscale) frame. Returns tuple w/
+# the score (0.0-1.0, the fraction of the frame that looks broken), the smeared
+# fraction (longest run of the smeared rows) and the grey blocks fraction.
+def frame_corruption_score(img):
+    gh, gw = CHECK_grid
+    h, w = img.shape[:2]
+    # nearest neighbor keeps the pixel values intact (no smoothing of the noise)
+    w_small = min(w, CHECK_width)
+    h_small = max(1, h * w_small // w)
+    small = cv2.resize(img, (w_small, h_small), interpolation=cv2.INTER_NEAREST)
+    if h_small < gh or w_small < gw:
+        return 0.0, 0.0, 0.0
+    if small.ndim == 3:
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+    else:
+        gray = small.astype(np.int16)
+
+    # smearing, rows w/ almost no vertical change while having horizontal detail
+    vdiff = np.abs(gray[1:, :] - gray[:-1, :]).mean(axis=1)
+    hdiff = np.abs(gray[1:, 1:] - gray[1:, :-1]).mean(axis=1)
+    smeared = (vdiff < hdiff * CHECK_smear_ratio) & (hdiff > CHECK_smear_min_hdiff)
+    # longest run of the smeared rows
+    padded = np.concatenate(([0], smeared.astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(padded))
+    smear_frac = float((edges[1::2] - edges[0::2]).max()) / h_small if len(edges) > 0 else 0.0
+
+    # grey blocks, cells w/ flat colorless grey (area resize gives the cell means)
+    gray_f = gray.astype(np.float32)
+    mean = cv2.resize(gray_f, (gw, gh), interpolation=cv2.INTER_AREA)
+    std = np.sqrt(np.maximum(cv2.resize(gray_f * gray_f, (gw, gh), interpolation=cv2.INTER_AREA) - mean * mean, 0))
+    grey = (std < CHECK_grey_max_std) & (np.abs(mean - 128) < CHECK_grey_max_dist)
+    if small.ndim == 3:
+        chan_means = cv2.resize(small, (gw, gh), interpolation=cv2.INTER_AREA).astype(np.int16)
+        grey &= (chan_means.max(axis=2) - chan_means.min(axis=2)) < CHECK_grey_max_chroma
+    grey_frac = float(grey.mean())
+
+    score = max(smear_frac, grey_frac)
+    return round(score, 4), round(smear_frac, 4), round(grey_frac, 4)
+
+QUALITY_width = 320      # width of the downscaled frame used for the quality scoring
+QUALITY_sharp_ref = 100.0 # Laplacian variance of the frame considered fully sharp
+QUALITY_dark = 8         # pixels at or below are considered underexposed (clipped)
+QUALITY_bright = 247     # pixels at or above are considered overexposed (clipped)
+
+# Calculate the average difference (0.0-1.0) between 5 rows of pixels at the bottom
+# 10% of the frame (the original corrupt frame check, kept for the channels that
+# set rtsp_bf_thresh). The corruption caused by missing some of the stream data
+# is, typically, stretching of some pattern down to the bottom of the image, that
+# usually results in more similarities (~10% difference) between the rows than
+# in the normal image (50% difference).
+def frame_rows_diff(img):
+    step = int(img.shape[0] / 100)
+    step = step if step > 0 and step < 20 else 10
+    # rows -1, -(1 + step), ..., each compared to the previous one (same uint8 math as before)
+    rows = img[[-1] + list(range(-1 - step, -step * 6, -step))]
+    sum_diff = float(np.abs(rows[:-1] - rows[1:]).sum(dtype=np.int64))
+    avg_diff_per_pixel = sum_diff / (img.shape[1] * 4)
+    return avg_diff_per_pixel / (3 * 255)
+
+# Calculate the quality score of the BGR (or grayscale) frame, the corruption score
+# (see above) of the frame can be passed in to account for it. Returns tuple w/ the
+# score (0.0-1.0, higher is better), the sharpness (Laplacian variance) and the
+# fraction of the clipped (under or overexposed) pixels.
+def frame_quality_score(img, corrupt = 0.0):
+    h, w = img.shape[:2]
+    if w > QUALITY_width:
+        size = (QUALITY_width, max(1, h * QUALITY_width // w))
+        # (fast) linear resize to twice the size first, area resize of the full frame is slow
+        if w > QUALITY_width * 2:
+            img = cv2.resize(img, (size[0] * 2, size[1] * 2), interpolation=cv2.INTER_LINEAR)
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_16S).var())
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
+    clipped = float(hist[:QUALITY_dark + 1].sum() + hist[QUALITY_bright:].sum()) / gray.size
+    score = min(1.0, sharpness / QUALITY_sharp_ref) * (1.0 - clipped) * (1.0 - corrupt)
+    return round(score, 4), round(sharpness, 1), round(clipped, 4)
@@ -0,0 +1,147 @@
+# HTTP/s helpers for the imager. Keeps a pooled keep-alive session for each host
+# (so the snapshots do not pay for the TCP/TLS handshake every time) and handles
+# the MJPEG (multipart/x-mixed-replace) streams, holding the connection open in
+# a background thread and keeping only the latest JPEG part.
+import os
+import sys
+import time
+import threading
+import requests
+from urllib.parse import urlsplit
+
+# Pull in shared variables (file names, JSON object names, ...)
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.abspath("."))
+from shared_settings import *
+
+# How long to wait before reconnecting after the MJPEG stream failed (seconds)
+MJPEG_reconnect_delay = 2.0
+# Max size of the MJPEG part we are willing to buffer (bytes)
+MJPEG_max_part_size = 16 << 20
+
+# HTTP sessions (instances of requests.Session), keyed by scheme://host:port
+SESSIONS = {}
+SESSIONS_lock = threading.Lock()
+
+# Get the pooled session for the host of the URL
+def http_session(url):
+    parts = urlsplit(url)
+    key = f"{parts.scheme}://{parts.netloc}"
+    with SESSIONS_lock:
+        session = SESSIONS.get(key)
+        if session is None:
+            session = requests.Session()
+            session.verify = False
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+            session.mount(f"{parts.scheme}://", adapter)
+            SESSIONS[key] = session
+    return session
+
+# Get the requests timeout tuple (connect, read) for the channel timeout
+def http_timeout(timeout):
+    return (min(IMG_http_connect_timeout, timeout), timeout)
+
+# Get the multipart boundary from the content type header (None if not multipart)
+def mjpeg_boundary(content_type):
+    if not content_type.lower().startswith("multipart/"):
+        return None
+    for param in content_type.split(';')[1:]:
+        name, _, value = param.strip().partition('=')
+        if name.lower() == 'boundary' and len(value) > 0:
+            value = value.strip('"')
+            # some cameras put the leading dashes in the header value too
+            return value[2:] if value.startswith('--') else value
+    return None
+
+# Iterate over the parts of the multipart stream yielding the part bodies
+def mjpeg_iter_parts(response, boundary):
+    delim = b'--' + boundary.encode()
+    buf = bytearray()
+    for chunk in response.iter_content(chunk_size=65536):
+        buf += chunk
+        while True:
+            start = buf.find(delim)
+            if start < 0:
+                del buf[:max(0, len(buf) - len(delim))]
+                break
+            hdr_end = buf.find(b'\r\n\r\n', start)
+            if hdr_end < 0:
+                del buf[:start]
+                break
+            length = None
+            for line in bytes(buf[start + len(delim):hdr_end]).split(b'\r\n'):
+                name, _, value = line.partition(b':')
+                if name.strip().lower() == b'content-length':
+                    try: length = int(value.strip())
+                    except ValueError: pass
+            body_start = hdr_end + 4
+            if length is not None:
+                if len(buf) < body_start + length:
+                    del buf[:start]
+                    break
+                body_end = body_start + length
+            else:
+                body_end = buf.find(delim, body_start)
+                if body_end < 0:
+                    del buf[:start]
+                    break
+            yield bytes(buf[body_start:body_end]).rstrip(b'\r\n')
+            del buf[:body_end]
+        if len(buf) > MJPEG_max_part_size:
+            raise Exception(f"error, MJPEG part exceeds {MJPEG_max_part_size} bytes")
+
+class MjpegGrabber:
+    def __init__(self, url, timeout=IMG_DEF_http_timeout):
+        self.url = url
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.frame_no = 0   # number of the last received part
+        self.frame = None   # the last received part data
+        self.error = None   # last error seen by the grabber thread
+        self.running = True
+        self.thread = threading.Thread(target=self.grab_loop, name="mjpeg-grab", daemon=True)
+        self.thread.start()
+
+    def __del__(self):
+        self.stop()
+
+    # Stop the grabber thread (it exits when the next part arrives or the read times out)
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=self.timeout)
+            self.thread = None
+
+    # Grabber thread, keeps the stream connection open and stores the latest part
+    def grab_loop(self):
+        while self.running:
+            try:
+                with http_session(self.url).get(self.url, stream=True, timeout=http_timeout(self.timeout)) as response:
+                    response.raise_for_status() # Check for HTTP errors
+                    boundary = mjpeg_boundary(response.headers.get('Content-Type', ''))
+                    if boundary is None:
+                        raise Exception(f"error, not a multipart stream: {response.headers.get('Content-Type')}")
+                    for part in mjpeg_iter_parts(response, boundary):
+                        if not self.running:
+                            break
+                        with self.cond:
+                            self.frame_no += 1
+                            self.frame = part
+                            self.error = None
+                            self.cond.notify_all()
+                    if self.running:
+                        raise Exception("error, stream ended")
+            except Exception as e:
+                self.error = f"error, MJPEG {self.url}: {e}"
+                print(f"{sys._getframe().f_code.co_name}: {self.error}, reconnecting...")
+                time.sleep(MJPEG_reconnect_delay)
+
+    # Get the latest part received after after_frame_no, wait for the next part
+    # if needed. Returns tuple w/ the frame number and the part data (None if
+    # there was no new part within the timeout).
+    def read(self, after_frame_no=0, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.frame_no > after_frame_no, timeout):
+                return self.frame_no, None
+            return self.frame_no, self.frame
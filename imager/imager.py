@@ -1,14 +1,16 @@
 # Pulls images from the channels. It forks creating aa separate process for
 # each properly configured channel. Requires a unix system.
+# Alternatively (CFG_engine_key set to "threads" in the config), all the channels
+# are handled in this process by the capture engine (see capture_engine.py).
 import os
 import sys
 import shutil
-import requests
 import json
 import time
 import base64
 import signal
 import imghdr
+import threading
 import cv2
 import numpy as np
 from pathlib import Path
@@ -21,6 +23,13 @@ os.environ['OPENCV_FFMPEG_LOGLEVEL'] = '8'
 sys.path.append(os.path.dirname(__file__))
 sys.path.append(os.path.abspath("."))
 from shared_settings import *
+from frame_ring import *
+from frame_hash import *
+from rtsp_grabber import *
+from http_client import *
+from motion import *
+from frame_check import *
+from capture_engine import *
 
 # Figure the path to the data folders depending on where we run
 DATA_DIR = ''
@@ -40,6 +49,8 @@ IMGR_CONFIG = f"{CFGDIR}/{CFG_imager}"
 CFG = {}
 # Channel runners (instances of ChannelDownloadRunner)
 CRUN = {}
+# Single process capture engine (instance of CaptureEngine, None when forking runners)
+ENGINE = None
 # Am I the manager process?
 MANAGER = True
 
@@ -54,6 +65,40 @@ def is_pid_running(pid):
             return False
     return True
 
+# Pass JPEGs of the configured size through if their estimated quality is not above the configured by more than this
+JPEG_passthru_q_margin = 5
+# Sum of the standard JPEG luminance quantization table values (ITU T.81 Annex K, quality 50)
+JPEG_std_lum_qt_sum = 3688
+
+# Parse JPEG headers, returns (width, height, estimated quality) or None if not a baseline/progressive JPEG
+def jpeg_info(data):
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    quality = None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF: # fill byte
+            i += 1
+            continue
+        seg_len = (data[i + 2] << 8) | data[i + 3]
+        if marker == 0xDB and quality is None: # DQT, estimate quality from the first (luminance) table
+            precision = data[i + 4] >> 4
+            qt = data[i + 5:i + 5 + 64 * (precision + 1)]
+            qt_sum = sum(qt) if precision == 0 else sum([(qt[j] << 8) | qt[j + 1] for j in range(0, 128, 2)])
+            scale = qt_sum * 100.0 / JPEG_std_lum_qt_sum
+            quality = int(round((200.0 - scale) / 2.0 if scale <= 100.0 else 5000.0 / scale))
+        elif 0xC0 <= marker <= 0xCF and marker not in [0xC4, 0xC8, 0xCC]: # SOFn
+            height = (data[i + 5] << 8) | data[i + 6]
+            width = (data[i + 7] << 8) | data[i + 8]
+            return width, height, quality
+        elif marker == 0xDA: # start of scan w/o frame header
+            return None
+        i += 2 + seg_len
+    return None
+
 # write json to a file using atomic rename
 def json_atomic_write(js, json_tmp_file_pname, json_file_pname):
     res = False
@@ -79,29 +124,102 @@ class ChannelDownloadRunner:
         self.img_w = ch[CFG_chan_img_w_key]
         self.img_q = ch[CFG_chan_img_q_key]
         self.rtsp_bf_retries = ch[CFG_chan_rtsp_bf_retries_key]
-        self.rtsp_bf_thresh = ch[CFG_chan_rtsp_bf_thesh_key]
+        self.rtsp_bf_thresh = ch.get(CFG_chan_rtsp_bf_thesh_key)
+        self.rtsp_bf_score = ch[CFG_chan_rtsp_bf_score_key]
+        self.frame_ipc = ch[CFG_chan_frame_ipc_key]
+        self.rtsp_mode = ch[CFG_chan_rtsp_mode_key]
+        self.rtsp_decode = ch[CFG_chan_rtsp_decode_key]
         self.pid = -1
         self.rtsp_cap = None
+        self.rtsp_grabber = None # background RTSP grabber (created in the runner process)
+        self.http_mode = ch[CFG_chan_http_mode_key]
+        self.http_timeout = ch[CFG_chan_http_timeout_key]
+        self.http_validators = {} # conditional request headers for the next snapshot request
+        self.mjpeg_grabber = None # background MJPEG stream reader (created in the runner process)
+        self.mjpeg_frame_no = 0   # number of the last MJPEG part we took
+        self.motion_thresh = ch[CFG_chan_motion_thresh_key]
+        self.motion_keepalive = ch[CFG_chan_motion_keepalive_key]
+        self.best_of = max(1, ch[CFG_chan_best_of_key]) # frames to grab for each update (publishing the best)
+        self.motion = MotionDetector() # background model for the change detection
+        self.last_publish_time = 0.0   # when the last image was published
+        self.frame_meta = {} # metadata collected while getting the current frame
+        self.frame_gray = None # reduced scale grayscale copy of the current frame (if it was decoded)
+        self.ring = None # frame ring writer (created in the runner process)
         self.iteration_file = f"{IMGDIR}/{self.chan_id}/iteration.txt"
         self.last_reported_iteration = -1
         self.idle_counter = 0
+        self.threaded = False    # True if running in the capture engine (not forked)
+        self.busy_since = 0.0    # capture engine: when the current update started (0 if idle)
+        self.last_loop_time = 0.0 # capture engine: when the channel loop was last called
+        self.update_lock = threading.Lock() # capture engine: protects updating and stopped
+        self.updating = False    # capture engine: the channel update is running in a pool thread
+        self.stopped = False     # capture engine: the runner was stopped (no more updates)
 
     def __del__(self):
-        if self.rtsp_cap != None:
-            self.rtsp_cap.release()
-            self.rtsp_cap = None
+        self.stop()
+
+    # Stop the channel runner (terminates the downloader process, stops the grabbers). In the
+    # capture engine the pool thread running the channel update owns the capture objects, so
+    # if the update is in progress (maybe stuck in the decoder), they are left for it to
+    # release when (if ever) it returns.
+    def stop(self):
+        with self.update_lock:
+            self.stopped = True
+            updating = self.updating
+        if not updating:
+            self.release_capture()
         if MANAGER and self.pid > 0 and is_pid_running(self.pid):
             os.kill(self.pid, signal.SIGTERM)
             for i in range(10):
-                _, status = os.waitpid(self.pid, os.WNOHANG)
-                if os.WIFEXITED(status) or os.WIFSIGNALED(status):
+                try:
+                    pid, status = os.waitpid(self.pid, os.WNOHANG)
+                except ChildProcessError:
+                    self.pid = -1 # already reaped
+                    break
+                # (0, 0) while the child is still running
+                if pid == self.pid and (os.WIFEXITED(status) or os.WIFSIGNALED(status)):
                     self.pid = -1
-                    break    
+                    break
                 time.sleep(0.5)
             if self.pid > 0:
+                # stuck (e.g. in the native decoder code), kill and reap it
                 os.kill(self.pid, signal.SIGKILL)
+                try: os.waitpid(self.pid, 0)
+                except ChildProcessError: pass
                 self.pid = -1
 
+    # Release the frame ring and the capture objects, stop the grabbers
+    def release_capture(self):
+        if self.ring != None:
+            self.ring.close()
+            self.ring = None
+        if self.rtsp_grabber != None:
+            self.rtsp_grabber.stop()
+            self.rtsp_grabber = None
+        if self.mjpeg_grabber != None:
+            self.mjpeg_grabber.stop()
+            self.mjpeg_grabber = None
+        if self.rtsp_cap != None:
+            self.rtsp_cap.release()
+            self.rtsp_cap = None
+
+    # Run the channel update in the capture engine thread pool (see channel_loop()). Does
+    # nothing once the runner is stopped, and if it was stopped during the update releases
+    # the capture objects the stop() left to this thread.
+    def engine_update(self, iteration, prev_res, content):
+        with self.update_lock:
+            if self.stopped:
+                return prev_res
+            self.updating = True
+        try:
+            return self.channel_loop(iteration, prev_res, content)
+        finally:
+            with self.update_lock:
+                self.updating = False
+                stopped = self.stopped
+            if stopped:
+                self.release_capture()
+
     # Check if the instance process is running
     def is_running(self):
         if self.pid > 0:
@@ -116,60 +234,140 @@ class ChannelDownloadRunner:
         print(f"Received SIGTERM, exiting downloader with pid: {os.getpid()}")
         exit(0)
 
-    # process and post the image for the consumers
-    def post_image(self, img, img_file_pathname):
-        img_file_pathname_tmp = f"{img_file_pathname}.tmp.jpg"
-        resized_img = cv2.resize(img, (self.img_w, self.img_h))
-        ret = cv2.imwrite(img_file_pathname_tmp, resized_img, [cv2.IMWRITE_JPEG_QUALITY, self.img_q])
+    # process the image for posting to the consumers, returns the JPEG data (keeps
+    # the reduced scale grayscale copy for the scoring, so it is not decoded again)
+    def post_image(self, img):
+        if img.shape[1] != self.img_w or img.shape[0] != self.img_h:
+            img = cv2.resize(img, (self.img_w, self.img_h))
+        small = cv2.resize(img, (max(1, self.img_w // 4), max(1, self.img_h // 4)), interpolation=cv2.INTER_AREA)
+        self.frame_gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        ret, jpg = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, self.img_q])
         if not ret:
-            raise Exception(f"error, unable to write image to {img_file_pathname_tmp}")
-        os.rename(img_file_pathname_tmp, img_file_pathname)
+            raise Exception(f"error, unable to encode image for {self.chan_id}")
+        return jpg.tobytes()
+
+    # process the encoded image (from file or HTTP/s source) for posting to the consumers,
+    # passes JPEGs already matching the config through and decodes the large ones at reduced scale
+    def post_encoded_image(self, src, content):
+        decode_flag = cv2.IMREAD_COLOR
+        info = jpeg_info(content)
+        if info is not None:
+            width, height, quality = info
+            if width == self.img_w and height == self.img_h and (quality is None or quality <= self.img_q + JPEG_passthru_q_margin):
+                return bytes(content)
+            for scale, flag in [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)]:
+                if width >= self.img_w * scale and height >= self.img_h * scale:
+                    decode_flag = flag
+                    break
+        image_bytes = np.frombuffer(content, dtype="uint8")
+        img = cv2.imdecode(image_bytes, decode_flag)
+        if img is None:
+            raise Exception(f"error, cv2.imdecode() failed for {src}")
+        return self.post_image(img)
 
     # handle a file URL
-    def get_file(self, url, img_file_pathname):
+    def get_file(self, url):
         src_file = url[len("file://"):]
         if not os.path.isfile(src_file):
             raise Exception(f"error, {src_file} is not a file")
-        img = cv2.imread(src_file)
-        if img is None:
-            raise Exception(f"error, cv2.imread() failed to read {src_file}")
-        self.post_image(img, img_file_pathname)
-
-    # handle an HTTP or HTTPs URL
-    def get_http(self, url, img_file_pathname):
-        response = requests.get(url, verify=False, stream=True, timeout=10)
-        response.raise_for_status() # Check for HTTP errors
-        image_bytes = np.asarray(bytearray(response.content), dtype="uint8")
-        img = cv2.imdecode(image_bytes, cv2.IMREAD_COLOR)
-        if img is None:
-            raise Exception(f"error, cv2.imdecode() failed for {url}")
-        self.post_image(img, img_file_pathname)
-
-    # Detect corrupt RTSP frames by checking for repeating rows of pixels at the bottom
+        try:
+            content = Path(src_file).read_bytes()
+        except Exception as e:
+            raise Exception(f"error, unable to read {src_file}: {e}")
+        return self.post_encoded_image(src_file, content)
+
+    # Save the validators of the snapshot response for making the next request conditional
+    def http_save_validators(self, headers):
+        self.http_validators = {}
+        if 'ETag' in headers:
+            self.http_validators['If-None-Match'] = headers['ETag']
+        if 'Last-Modified' in headers:
+            self.http_validators['If-Modified-Since'] = headers['Last-Modified']
+
+    # handle an HTTP or HTTPs URL (content is passed in if already downloaded),
+    # returns None if the snapshot has not changed since the last request
+    def get_http(self, url, content=None):
+        if self.http_mode == IMG_http_mjpeg:
+            return self.get_mjpeg(url)
+        if content is None:
+            response = http_session(url).get(url, headers=self.http_validators, timeout=http_timeout(self.http_timeout))
+            if response.status_code == 304: # not modified
+                return None
+            response.raise_for_status() # Check for HTTP errors
+            self.http_save_validators(response.headers)
+            content = response.content
+        return self.post_encoded_image(url, content)
+
+    # handle an HTTP or HTTPs URL serving MJPEG stream (takes the latest part received)
+    def get_mjpeg(self, url):
+        if self.mjpeg_grabber == None:
+            self.mjpeg_grabber = MjpegGrabber(url, self.http_timeout)
+        best = None
+        for kk in range(self.best_of):
+            self.mjpeg_frame_no, content = self.mjpeg_grabber.read(self.mjpeg_frame_no)
+            if content is None:
+                err = self.mjpeg_grabber.error
+                raise Exception(err if err else f"error, MJPEG no data from {url} for {self.http_timeout}sec")
+            if self.best_of <= 1:
+                return self.post_encoded_image(url, content)
+            gray = cv2.imdecode(np.frombuffer(content, dtype="uint8"), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+            if gray is not None:
+                best = self.keep_best(best, gray, content)
+        if best is None:
+            raise Exception(f"error, MJPEG unable to decode images from {url}")
+        self.frame_meta = best[2]
+        self.frame_gray = best[3]
+        return self.post_encoded_image(url, best[1])
+
+    # Detect corrupt RTSP frames (smearing or grey blocks, see frame_check.py),
+    # the corruption score is kept for the frame metadata. The legacy bottom rows
+    # similarity check only runs if the channel still sets its threshold.
     def is_frame_corrupt(self, img):
-        num_pixels = img.shape[1]
-        sum_diff = 0.0
-        step = int(img.shape[0] / 100)
-        step = step if step > 0 and step < 20 else 10
-        # copare 5 rows at the bottom 10% of the image to each other
-        last_row = img[-1, :]
-        for i in range(1 + step, step * 6, step):
-            current_row = img[-i, :]
-            diff = np.sum(np.abs(last_row - current_row))
-            sum_diff += diff
-            last_row = current_row
-        avg_diff_per_pixel = sum_diff / (num_pixels * 4)
-        perc_diff = avg_diff_per_pixel / (3 * 255)
-        # the corruption caused by missing some of the stream data is, typically, stretching
-        # of some pattern down to the bottom of the image, that usually results in more
-        # similaratities (~10% difference) between rows of pixels than the normal image
-        # (50% diffrence).
-        return  perc_diff < self.rtsp_bf_thresh
+        self.frame_meta[IMG_corrupt_key] = frame_corruption_score(img)[0]
+        if self.frame_meta[IMG_corrupt_key] > self.rtsp_bf_score:
+            return True
+        return self.rtsp_bf_thresh is not None and frame_rows_diff(img) < self.rtsp_bf_thresh
+
+    # Pick the better quality frame of the best so far and the new one (when grabbing
+    # best_of frames for the update). The best is a tuple w/ the quality score, the
+    # frame (img, unless the frame to keep is passed in), its metadata and the image
+    # the score was calculated on.
+    def keep_best(self, best, img, frame = None):
+        frame = img if frame is None else frame
+        if self.best_of <= 1:
+            return (None, frame, self.frame_meta, img)
+        meta = dict(self.frame_meta)
+        meta[IMG_quality_key] = frame_quality_score(img, meta.get(IMG_corrupt_key, 0.0))[0]
+        if best is None or meta[IMG_quality_key] > best[0]:
+            return (meta[IMG_quality_key], frame, meta, img)
+        return best
+
+    # handle an RTSP URL using the background grabber thread (the stream is kept
+    # drained, so we just take the latest frame, or wait for the next one if bad)
+    def get_rtsp_grabber(self, url):
+        if self.rtsp_grabber == None:
+            self.rtsp_grabber = RtspGrabber(url, self.rtsp_decode)
+        frame_no = 0
+        best = None
+        for kk in range(self.best_of):
+            for ii in range(self.rtsp_bf_retries):
+                frame_no, img = self.rtsp_grabber.read(frame_no)
+                if img is None:
+                    err = self.rtsp_grabber.error
+                    raise Exception(err if err else f"error, RSTP no frames from {url} for {RTSP_read_timeout}sec")
+                if not self.is_frame_corrupt(img):
+                    break
+                print(f"retrying frame attempt {ii} frame:{frame_no}")
+            best = self.keep_best(best, img)
+        self.frame_meta = best[2]
+        return self.post_image(best[1])
 
     # handle an RTSP URL
-    def get_rtsp(self, url, img_file_pathname):
+    def get_rtsp(self, url):
+        if self.rtsp_mode == IMG_rtsp_grabber:
+            return self.get_rtsp_grabber(url)
         if self.rtsp_cap == None:
-            self.rtsp_cap = cv2.VideoCapture(url, cv2.CAP_FFMPEG)
+            self.rtsp_cap = rtsp_open(url, self.rtsp_decode)
             #self.rtsp_cap(cv2.CAP_PROP_BUFFERSIZE, 3) # might work for some backends
         if not self.rtsp_cap.isOpened():
             self.rtsp_cap.release()
@@ -178,49 +376,92 @@ class ChannelDownloadRunner:
         fps = self.rtsp_cap.get(cv2.CAP_PROP_FPS)
         fps = fps if fps >= 5 and fps <= 60 else 30
         self.rtsp_cap.set(cv2.CAP_PROP_POS_AVI_RATIO, 1.0) # rewind to the end
-        for ii in range(self.rtsp_bf_retries):
-            time.sleep(1.0 / fps)
-            ret, img = self.rtsp_cap.read()
-            if not ret or img is None:
-                raise Exception(f"error, RSTP cannot read from {url}")
-            if not self.is_frame_corrupt(img):
-                break
-            print(f"retrying frame attempt {ii} fps:{fps}")
-        self.post_image(img, img_file_pathname)
-
-    # This loop runs in the child process only
-    def channel_loop(self, iteration, prev_res = True):
+        best = None
+        for kk in range(self.best_of):
+            for ii in range(self.rtsp_bf_retries):
+                time.sleep(1.0 / fps)
+                ret, img = self.rtsp_cap.read()
+                if not ret or img is None:
+                    raise Exception(f"error, RSTP cannot read from {url}")
+                if not self.is_frame_corrupt(img):
+                    break
+                print(f"retrying frame attempt {ii} fps:{fps}")
+            best = self.keep_best(best, img)
+        self.frame_meta = best[2]
+        return self.post_image(best[1])
+
+    # Publish the image for the consumers (through the frame ring or the image.json file)
+    def publish_image(self, img_data, iteration, meta = None):
+        js = {}
+        js[IMG_chan_key] = self.chan_id # Channel ID from channel config
+        js[IMG_name_key] = self.ch[CFG_chan_name_key] # Verbal description of the channel
+        if meta is not None:
+            js.update(meta) # extra frame metadata (change score, motion boxes, ...)
+        f_time = time.time() # will use epoch time as we will likely report differential
+        if self.frame_ipc == IMG_ipc_ring:
+            ring_file_pname = f"{IMGDIR}/{self.chan_id}/{IMG_ring_file_name}"
+            try:
+                if self.ring is None:
+                    self.ring = FrameRingWriter(ring_file_pname, ring_slot_size(self.img_w, self.img_h))
+                self.ring.publish(img_data, iteration, js, f_time)
+            except Exception as e:
+                print(f"{sys._getframe().f_code.co_name}: unable to publish to {ring_file_pname}: {e}")
+                self.ring = None
+                return False
+            return True
+        # Store the raw image for debugging/visualization purposes
+        img_file_pathname = f"{IMGDIR}/{self.chan_id}/{IMG_file_name}"
+        img_file_pathname_tmp = f"{img_file_pathname}.tmp.jpg"
+        try:
+            Path(img_file_pathname_tmp).write_bytes(img_data)
+            os.rename(img_file_pathname_tmp, img_file_pathname)
+        except:
+            print(f"{sys._getframe().f_code.co_name}: unable to write {img_file_pathname}")
+        # Construct image JSON file
+        json_file_pname = f"{IMGDIR}/{self.chan_id}/{IMG_json_file_name}"
+        json_tmp_file_pname = f"{json_file_pname}.tmp"
+        js[IMG_data_key] = base64.b64encode(img_data).decode() # Image data
+        js[IMG_time_key] = f_time
+        js[IMG_iter_key] = iteration # might be useful for tracking changes
+        # write file and replace by atomic renaming (requires Unix)
+        return json_atomic_write(js, json_tmp_file_pname, json_file_pname)
+
+    # Check if the channel is disabled by the responder due to no services being enabled on it
+    def is_off(self):
+        off_file_pathname = f"{IMGDIR}/{self.chan_id}/{IMG_off_file_name}"
+        return os.path.exists(off_file_pathname)
+
+    # This loop runs in the child process only (or in the capture engine thread pool,
+    # w/ the content of the HTTP/s channel image already downloaded)
+    def channel_loop(self, iteration, prev_res = True, content = None):
         if iteration % self.upd_int != 0:
             return prev_res
+        self.frame_meta = {}
+        self.frame_gray = None
 
         ch = self.ch
-        chan_id = self.chan_id
         url = ch[CFG_chan_url_key]
-        name = ch[CFG_chan_name_key]
-        img_file = IMG_file_name # assume JPEG, but the resolution and type should come from the config (and coversion made if necessary)
-        json_file = IMG_json_file_name # where to store image and metadata
 
         # Check if the channel is disabled by the responder due to no services being enabled on it
-        off_file_pathname = f"{IMGDIR}/{chan_id}/{IMG_off_file_name}"
-        if os.path.exists(off_file_pathname):
+        if self.is_off():
             return True
 
-        # Write the current iteration to a file to watch for hangs
-        try:
-            with open(f"{self.iteration_file}.tmp", "w") as f:
-                f.write(str(iteration))
-            os.rename(f"{self.iteration_file}.tmp", self.iteration_file)
-        except: pass
+        # Write the current iteration to a file to watch for hangs (the capture engine tracks it in memory)
+        if not self.threaded:
+            try:
+                with open(f"{self.iteration_file}.tmp", "w") as f:
+                    f.write(str(iteration))
+                os.rename(f"{self.iteration_file}.tmp", self.iteration_file)
+            except: pass
 
         # Download raw
-        img_file_pathname = f"{IMGDIR}/{chan_id}/{img_file}"
         try:
             if url.lower().startswith("file://"):
-                self.get_file(url, img_file_pathname)
+                img_data = self.get_file(url)
             elif url.lower().startswith("http://") or url.lower().startswith("https://"):
-                self.get_http(url, img_file_pathname)
+                img_data = self.get_http(url, content)
             elif url.lower().startswith("rtsp://"):
-                self.get_rtsp(url, img_file_pathname)
+                img_data = self.get_rtsp(url)
             else:
                 raise Exception(f"error, unable to handle {url}")
 
@@ -228,23 +469,36 @@ class ChannelDownloadRunner:
             print(f"{sys._getframe().f_code.co_name}: {e}")
             return False
 
-        # Make sure we downloaded an image
-        file_type = imghdr.what(img_file_pathname)
+        # Nothing new from the source (not modified), keep the last published image
+        if img_data is None:
+            return True
+
+        # Make sure we have an image
+        file_type = imghdr.what(None, h=img_data)
         if not file_type in ['gif', 'jpeg', 'png', 'webp']: # for now just pass through what LLAMA 3.2 Vision supports
             print(f"{sys._getframe().f_code.co_name}: only 'gif', 'jpeg', 'png' and 'webp' are allowed, got '{file_type}' from {url}")
             return False
 
-        # Construct image JSON file
-        json_file_pname = f"{IMGDIR}/{ch[CFG_chan_id_key]}/{json_file}"
-        json_tmp_file_pname = f"{json_file_pname}.tmp"
-        js = {}
-        js[IMG_chan_key] = chan_id # Channel ID from channel config
-        js[IMG_name_key] = name # Verbal description of the channel
-        js[IMG_data_key] = base64.b64encode(Path(img_file_pathname).read_bytes()).decode() # Image data
-        js[IMG_time_key] = time.time() # will use epoch time as we will likely report differential
-        js[IMG_iter_key] = iteration # might be useful for tracking changes
-        # write file and replace by atomic renaming (requires Unix)
-        res = json_atomic_write(js, json_tmp_file_pname, json_file_pname)
+        # Score the image quality (unless done when picking the best frame), detect changes
+        # against the channel background, skip publishing the images w/ too little change
+        # (unless it's time for the keep-alive image), hash the image for the consumers
+        # to tell the look-alike images. All work on the reduced scale image, it is only
+        # decoded here if the frame was passed through w/o decoding.
+        meta = self.frame_meta
+        gray = self.frame_gray
+        if gray is None:
+            gray = cv2.imdecode(np.frombuffer(img_data, dtype="uint8"), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        if gray is not None:
+            if not IMG_quality_key in meta:
+                meta[IMG_quality_key] = frame_quality_score(gray, meta.get(IMG_corrupt_key, 0.0))[0]
+            meta[IMG_change_key], meta[IMG_motion_key] = self.motion.update(gray)
+            meta[IMG_phash_key] = frame_dhash(gray)
+            if meta[IMG_change_key] < self.motion_thresh and time.time() - self.last_publish_time < self.motion_keepalive:
+                return True
+
+        res = self.publish_image(img_data, iteration, meta)
+        if res:
+            self.last_publish_time = time.time()
 
         if res and not prev_res:
             print(f"{ch[CFG_chan_name_key]}: recovered from error")
@@ -295,32 +549,76 @@ def read_config():
         return None
     if not CFG_channels_key in new_cfg.keys():
        new_cfg[CFG_channels_key] = []
+    new_cfg[CFG_engine_key] = new_cfg.get(CFG_engine_key, IMG_engine_fork)
+    new_cfg[CFG_engine_workers_key] = new_cfg.get(CFG_engine_workers_key, CFG_DEF_engine_workers)
     # Set some defaults if the config is missing the relevant optional keys
     for ch in new_cfg[CFG_channels_key]:
         ch[CFG_chan_img_h_key] = ch.get(CFG_chan_img_h_key, 720)
         ch[CFG_chan_img_w_key] = ch.get(CFG_chan_img_w_key, 1280)
         ch[CFG_chan_img_q_key] = ch.get(CFG_chan_img_q_key, 50)
         ch[CFG_chan_rtsp_bf_retries_key] = ch.get(CFG_chan_rtsp_bf_retries_key, 5)
-        ch[CFG_chan_rtsp_bf_thesh_key] = ch.get(CFG_chan_rtsp_bf_thesh_key, 0.20)
+        ch[CFG_chan_rtsp_bf_score_key] = ch.get(CFG_chan_rtsp_bf_score_key, 0.10)
+        ch[CFG_chan_http_mode_key] = ch.get(CFG_chan_http_mode_key, IMG_http_snapshot)
+        ch[CFG_chan_http_timeout_key] = ch.get(CFG_chan_http_timeout_key, IMG_DEF_http_timeout)
+        ch[CFG_chan_frame_ipc_key] = ch.get(CFG_chan_frame_ipc_key, IMG_ipc_ring)
+        ch[CFG_chan_motion_thresh_key] = ch.get(CFG_chan_motion_thresh_key, 0.0)
+        ch[CFG_chan_motion_keepalive_key] = ch.get(CFG_chan_motion_keepalive_key, 60)
+        ch[CFG_chan_best_of_key] = ch.get(CFG_chan_best_of_key, 1)
+        ch[CFG_chan_rtsp_mode_key] = ch.get(CFG_chan_rtsp_mode_key, IMG_rtsp_grabber)
+        ch[CFG_chan_rtsp_decode_key] = ch.get(CFG_chan_rtsp_decode_key, IMG_rtsp_decode_all)
 
     return new_cfg
 
-# Read and apply config if new, return False if no changes
+# Remove the image data left by the channel runner (keeps the channel folder and
+# the off file), the consumers still holding the frame ring are told to reopen it
+def cleanup_channel_dir(chan_id):
+    ring_file_pname = f"{IMGDIR}/{chan_id}/{IMG_ring_file_name}"
+    ring_retire(ring_file_pname)
+    for name in [IMG_ring_file_name, IMG_file_name, IMG_json_file_name]:
+        try:
+            os.remove(f"{IMGDIR}/{chan_id}/{name}")
+        except FileNotFoundError: pass
+        except Exception as e:
+            print(f"{sys._getframe().f_code.co_name}: unable to remove \"{IMGDIR}/{chan_id}/{name}\": {e}")
+
+# Stop the channel runner and remove it from the runners list
+def stop_channel_runner(chan_id):
+    c_runner = CRUN.pop(chan_id, None)
+    if c_runner is None:
+        return
+    if ENGINE is not None:
+        ENGINE.stop_channel(chan_id)
+    c_runner.stop()
+
+# Read and apply config if new, return False if no changes. The channels that did
+# not change keep running untouched, only the changed, removed and new ones are
+# stopped/started (all are restarted only if the capture engine config changes).
 def read_and_apply_config():
     global CFG
     global CRUN
+    global ENGINE
 
     new_cfg = read_config()
     if not new_cfg:
         return False
+    old_cfg = CFG
     CFG = new_cfg
 
-    # Destroy the runner instances (kills all the downloader processes)
-    for c_runner in CRUN:
-        del c_runner
-
-    # Remove all the old image folder (if there) and create a new empty one for the new config
-    shutil.rmtree(IMGDIR, ignore_errors=True)
+    # Restart the capture engine (and so all the channels) if its settings changed
+    if old_cfg.get(CFG_engine_key) != CFG[CFG_engine_key] or \
+       old_cfg.get(CFG_engine_workers_key) != CFG[CFG_engine_workers_key]:
+        for chan_id in list(CRUN.keys()):
+            stop_channel_runner(chan_id)
+        if ENGINE is not None:
+            ENGINE.stop()
+            ENGINE = None
+        if CFG[CFG_engine_key] == IMG_engine_threads:
+            try:
+                workers = max(1, int(CFG[CFG_engine_workers_key]))
+            except ValueError:
+                print(f"{sys._getframe().f_code.co_name}: cannot convert {CFG_engine_workers_key} to int \"{CFG[CFG_engine_workers_key]}\"")
+                workers = CFG_DEF_engine_workers
+            ENGINE = CaptureEngine(workers)
     os.makedirs(IMGDIR, exist_ok=True)
 
     # Check and cleanup the channel entries, keep only valid ones that we are going to work with
@@ -328,7 +626,7 @@ def read_and_apply_config():
     CFG[CFG_channels_key] = []
     if not isinstance(orig_channels, list):
         print(f"{sys._getframe().f_code.co_name}: malformed config, \"{CFG_channels_key}\" is not a list")
-        return True
+        orig_channels = []
     channels = []
     for idx, ch in enumerate(orig_channels):
         # Check for the required fields in the channel object
@@ -341,6 +639,9 @@ def read_and_apply_config():
         elif not CFG_chan_name_key in ch.keys():
             print(f"{sys._getframe().f_code.co_name}: malformed config, no \"{CFG_chan_name_key}\" key in channels entry {idx}")
             continue
+        elif any(c[CFG_chan_id_key] == ch[CFG_chan_id_key] for c in channels):
+            print(f"{sys._getframe().f_code.co_name}: malformed config, duplicate \"{CFG_chan_id_key}\" in channels entry {idx}")
+            continue
         # Check update interval value
         if not CFG_chan_upd_int_key in ch.keys():
             ch[CFG_chan_upd_int_key] = CFG_DEF_upd_int
@@ -349,18 +650,66 @@ def read_and_apply_config():
         except ValueError:
             print(f"{sys._getframe().f_code.co_name}: cannot convert {CFG_chan_upd_int_key} to int \"{ch[CFG_chan_upd_int_key]}\" in channels entry {idx}")
             continue
+        channels.append(ch)
+
+    # Stop the runners of the removed and changed channels
+    new_ids = set(ch[CFG_chan_id_key] for ch in channels)
+    for chan_id in list(CRUN.keys()):
+        if chan_id not in new_ids:
+            print(f"{sys._getframe().f_code.co_name}: channel {chan_id} removed, stopping")
+            stop_channel_runner(chan_id)
+            cleanup_channel_dir(chan_id)
+            shutil.rmtree(f"{IMGDIR}/{chan_id}", ignore_errors=True)
+    for ch in channels:
+        chan_id = ch[CFG_chan_id_key]
+        if chan_id in CRUN and CRUN[chan_id].ch != ch:
+            print(f"{sys._getframe().f_code.co_name}: channel {chan_id} changed, restarting")
+            stop_channel_runner(chan_id)
+            cleanup_channel_dir(chan_id)
+
+    # Remove the folders of the channels that are no longer configured (e.g. left from
+    # the previous run)
+    try:
+        for entry in os.scandir(IMGDIR):
+            if entry.is_dir() and entry.name not in new_ids:
+                shutil.rmtree(entry.path, ignore_errors=True)
+    except Exception as e:
+        print(f"{sys._getframe().f_code.co_name}: unable to scan \"{IMGDIR}\": {e}")
+
+    # Create the runners for the new (and changed) channels
+    for ch in channels:
         chan_id = ch[CFG_chan_id_key]
+        if chan_id in CRUN:
+            continue
+        if old_cfg.get(CFG_channels_key) is None: # first config, drop what's left from the previous run
+            shutil.rmtree(f"{IMGDIR}/{chan_id}", ignore_errors=True)
         try:
-            os.mkdir(f"{IMGDIR}/{chan_id}")
+            os.makedirs(f"{IMGDIR}/{chan_id}", exist_ok=True)
         except:
             print(f"{sys._getframe().f_code.co_name}: unable to create \"{IMGDIR}/{chan_id}\" folder")
             continue
         CRUN[chan_id] = ChannelDownloadRunner(ch)
-        channels.append(ch)
+        CRUN[chan_id].threaded = ENGINE is not None
 
-    CFG[CFG_channels_key] = channels
+    CFG[CFG_channels_key] = [ch for ch in channels if ch[CFG_chan_id_key] in CRUN]
     return True
 
+# Start and watch the channels in the capture engine (called from the main loop)
+def engine_loop(iteration, channels):
+    now = time.time()
+    for idx, ch in enumerate(channels):
+        chan_id = ch[CFG_chan_id_key]
+        c_runner = CRUN[chan_id]
+        if not ENGINE.is_channel_running(chan_id):
+            ENGINE.start_channel(c_runner, iteration + idx) # offset iteration by idx to help spread downloads
+        elif (c_runner.busy_since > 0 and now - c_runner.busy_since > IMG_hang_timeout) or \
+             now - c_runner.last_loop_time > IMG_hang_timeout:
+            print(f"{sys._getframe().f_code.co_name}: imager task for {chan_id} hung, restarting...")
+            stop_channel_runner(chan_id)
+            CRUN[chan_id] = ChannelDownloadRunner(ch)
+            CRUN[chan_id].threaded = True
+    return
+
 # Main loop (see below, called once in IMG_poll_int_ms)
 def main_loop(iteration):
     global CFG
@@ -370,6 +719,9 @@ def main_loop(iteration):
     if CFG_channels_key not in CFG:
         return
     channels = CFG[CFG_channels_key]
+    if ENGINE is not None:
+        engine_loop(iteration, channels)
+        return
     for idx, ch in enumerate(channels):
         chan_id = ch[CFG_chan_id_key]
         c_runner = CRUN[chan_id]
@@ -382,9 +734,9 @@ def main_loop(iteration):
             except: iteration = 0
             if c_runner.last_reported_iteration == iteration:
                 c_runner.idle_counter += 1
-                if c_runner.idle_counter > 30: # give it 30sec max
+                if c_runner.idle_counter > IMG_hang_timeout: # give it 30sec max
                     print(f"{sys._getframe().f_code.co_name}: imager thread for {chan_id} hung, terminating...")
-                    del c_runner
+                    stop_channel_runner(chan_id)
                     CRUN[chan_id] = ChannelDownloadRunner(ch)
             else:
                 c_runner.idle_counter = 0
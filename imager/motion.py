@@ -0,0 +1,46 @@
+# Change/motion detection for the imager channels. Keeps a downscaled grayscale
+# background model (running average) of the channel images, and for each new
+# image calculates the change score (fraction of the pixels that differ from
+# the background) and the bounding boxes of the changed areas.
+import cv2
+import numpy as np
+
+MOTION_width = 160        # width of the downscaled image used for the background model
+MOTION_alpha = 0.05       # background model update rate
+MOTION_pix_thresh = 25    # min pixel difference (0-255) from the background to count as changed
+MOTION_min_box_area = 0.002 # min area of the motion box (fraction of the image) to report
+
+class MotionDetector:
+    def __init__(self):
+        self.bg = None # background model (float32 downscaled grayscale image)
+
+    # Downscale and prepare the grayscale image for comparing to the background
+    def prepare(self, gray):
+        h, w = gray.shape[:2]
+        if w > MOTION_width:
+            gray = cv2.resize(gray, (MOTION_width, max(1, int(h * MOTION_width / w))), interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    # Update the background w/ the grayscale image, returns tuple w/ the change score
+    # (0.0-1.0) and the list of motion boxes [x, y, w, h] (fractions of the image size)
+    def update(self, gray):
+        small = self.prepare(gray)
+        if self.bg is None or self.bg.shape != small.shape:
+            self.bg = small.astype(np.float32)
+            return 1.0, [[0.0, 0.0, 1.0, 1.0]]
+        diff = cv2.absdiff(small, cv2.convertScaleAbs(self.bg))
+        cv2.accumulateWeighted(small, self.bg, MOTION_alpha)
+        mask = (diff > MOTION_pix_thresh).astype(np.uint8)
+        score = float(mask.mean())
+        if score == 0.0:
+            return 0.0, []
+        mask = cv2.dilate(mask, None, iterations=2)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        h, w = mask.shape
+        boxes = []
+        for c in contours:
+            x, y, bw, bh = cv2.boundingRect(c)
+            if bw * bh >= MOTION_min_box_area * w * h:
+                boxes.append([round(x / w, 3), round(y / h, 3), round(bw / w, 3), round(bh / h, 3)])
+        return round(score, 4), boxes
+
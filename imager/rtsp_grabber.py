@@ -0,0 +1,128 @@
+# RTSP stream grabber. Runs a background thread that keeps the stream drained by
+# calling grab() continuously, so the latest frame is available at any moment
+# w/o seeking (live streams ignore it) or reading through the buffered frames.
+# Only the frame that is actually requested gets retrieved (converted to BGR).
+# The decoder can be told to skip work (see RTSP_decode_opts) for the channels
+# that publish much less often than the camera frame rate.
+import os
+import sys
+import time
+import threading
+import cv2
+
+# Pull in shared variables (file names, JSON object names, ...)
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.abspath("."))
+from shared_settings import *
+
+# How long to wait for the stream to produce a frame before giving up (seconds)
+RTSP_read_timeout = 5.0
+# How long to wait before reconnecting after the stream failed (seconds)
+RTSP_reconnect_delay = 2.0
+
+# FFMPEG capture options for the decode modes (CFG_chan_rtsp_decode_key values).
+# OpenCV uses TCP for RTSP only when no capture options are given, so keep it explicitly.
+RTSP_decode_opts = {
+    IMG_rtsp_decode_all: "rtsp_transport;tcp",
+    # decode key frames only (one frame per GOP, typically every 1-4 sec)
+    IMG_rtsp_decode_key: "rtsp_transport;tcp|skip_frame;nokey",
+    # skip decoding the non-reference frames and the loop filter
+    IMG_rtsp_decode_nonref: "rtsp_transport;tcp|skip_frame;nonref|skip_loop_filter;all",
+    # decode at half resolution (only some decoders support it, e.g. MJPEG, MPEG4)
+    IMG_rtsp_decode_lowres: "rtsp_transport;tcp|lowres;1",
+}
+
+# The options are passed to OpenCV through the environment, serialize opening the streams
+RTSP_open_lock = threading.Lock()
+
+# Open the RTSP stream w/ the decoder options for the decode mode
+def rtsp_open(url, decode_mode=IMG_rtsp_decode_all):
+    opts = RTSP_decode_opts.get(decode_mode, RTSP_decode_opts[IMG_rtsp_decode_all])
+    with RTSP_open_lock:
+        prev_opts = os.environ.get('OPENCV_FFMPEG_CAPTURE_OPTIONS')
+        os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS'] = opts
+        try:
+            cap = cv2.VideoCapture(url, cv2.CAP_FFMPEG)
+        finally:
+            if prev_opts is None:
+                del os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS']
+            else:
+                os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS'] = prev_opts
+    return cap
+
+class RtspGrabber:
+    def __init__(self, url, decode_mode=IMG_rtsp_decode_all):
+        self.url = url
+        self.decode_mode = decode_mode
+        self.cap = None
+        self.cond = threading.Condition()
+        self.frame_no = 0     # number of the last grabbed frame
+        self.grab_time = 0.0  # when the last frame was grabbed
+        self.want_after = -1  # frame number a reader is waiting to get a frame after (-1 if none)
+        self.img = None       # the last retrieved frame image
+        self.img_no = 0       # frame number of the last retrieved frame image
+        self.error = None     # last error seen by the grabber thread
+        self.running = True
+        self.thread = threading.Thread(target=self.grab_loop, name="rtsp-grab", daemon=True)
+        self.thread.start()
+
+    def __del__(self):
+        self.stop()
+
+    # Stop the grabber thread (it releases the stream when exiting)
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=RTSP_read_timeout)
+            self.thread = None
+
+    # Open the stream, returns False if failed
+    def open(self):
+        self.cap = rtsp_open(self.url, self.decode_mode)
+        if not self.cap.isOpened():
+            self.cap.release()
+            self.cap = None
+            return False
+        return True
+
+    # Grabber thread, keeps pulling the frames from the stream and retrieves
+    # the frame image only when a reader is waiting for it
+    def grab_loop(self):
+        while self.running:
+            if self.cap is None and not self.open():
+                self.error = f"error, RTSP cannot open {self.url}"
+                time.sleep(RTSP_reconnect_delay)
+                continue
+            ret = self.cap.grab()
+            if not ret:
+                self.error = f"error, RSTP cannot read from {self.url}"
+                print(f"{sys._getframe().f_code.co_name}: {self.error}, reconnecting...")
+                self.cap.release()
+                self.cap = None
+                time.sleep(RTSP_reconnect_delay)
+                continue
+            with self.cond:
+                self.frame_no += 1
+                self.grab_time = time.time()
+                self.error = None
+                if self.want_after >= 0 and self.frame_no > self.want_after:
+                    ret, img = self.cap.retrieve()
+                    self.img = img if ret else None
+                    self.img_no = self.frame_no
+                    self.want_after = -1
+                    self.cond.notify_all()
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    # Get the frame grabbed after the frame number after_frame_no (i.e. the
+    # next frame coming from the stream). Returns tuple w/ the frame number
+    # and the image (the image is None if unable to get the frame).
+    def read(self, after_frame_no=0, timeout=RTSP_read_timeout):
+        with self.cond:
+            after_frame_no = max(after_frame_no, self.frame_no)
+            self.want_after = after_frame_no
+            if not self.cond.wait_for(lambda: self.img_no > after_frame_no, timeout):
+                self.want_after = -1
+                return self.frame_no, None
+            return self.img_no, self.img
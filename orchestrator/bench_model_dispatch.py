@@ -0,0 +1,77 @@
+# This is a development tool for the project. It measures the detection
+# throughput of the model endpoint configured in model.json (or given on
+# the command line) when sending the requests one at a time (the way the
+# orchestrator used to do it) vs keeping several requests in flight through
+# the model dispatcher (see model_dispatcher.py). The servers batching the
+# concurrent requests (e.g. vLLM) should show the detections per second
+# going up w/ the number of requests in flight. With several endpoint URLs in
+# model.json the requests are balanced across them (the in flight count is per
+# endpoint), the sequential run only uses the first one.
+# Usage: python orchestrator/bench_model_dispatch.py <image.jpg> [requests] [in flight counts...]
+import os
+import sys
+import json
+import time
+import base64
+from pathlib import Path
+from dotenv import load_dotenv
+
+# Pull in shared variables (file names, JSON object names, ...) and the the model interface classes
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.abspath("."))
+from shared_settings import *
+from model_interfaces import *
+from model_dispatcher import *
+
+# Figure the path to the data folders depending on where we run
+DATA_DIR = ''
+if not os.path.exists('/.dockerenv'):
+    load_dotenv('./.env')
+DATA_DIR = os.getenv('DATA_DIR', DATA_DIR)
+MODEL_CONFIG = f"{DATA_DIR}/{CFG_dir}/{CFG_model}"
+
+# Create the model interfaces (one for each endpoint URL) the same way the orchestrator does
+def load_models():
+    with open(MODEL_CONFIG, "r") as file:
+        cfg = json.load(file)
+    params = {}
+    if CFG_obj_model_name_key in cfg.keys():
+        params['model_to_use'] = cfg[CFG_obj_model_name_key]
+    if CFG_obj_model_tkn_key in cfg.keys():
+        params['api_key'] = cfg[CFG_obj_model_tkn_key]
+    urls = cfg.get(CFG_obj_model_url_key)
+    models = []
+    for url in (urls if isinstance(urls, list) else [urls]):
+        if url is not None:
+            params['api_base'] = url
+        models.append(MODELS[cfg.get(CFG_obj_model_key, 'ollama-simple')](**params))
+    return models
+
+# Create the model interface for the first endpoint
+def load_model():
+    return load_models()[0]
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: python {sys.argv[0]} <image.jpg> [requests] [in flight counts...]")
+        exit(1)
+    img_base64 = base64.b64encode(Path(sys.argv[1]).read_bytes()).decode()
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    inflight_list = [int(x) for x in sys.argv[3:]] if len(sys.argv) > 3 else [2, 4, 8, 16]
+    models = load_models()
+    model = models[0]
+    requests = [(img_base64, "a person", f"camera {idx}") for idx in range(count)]
+
+    start = time.time()
+    for r in requests:
+        model.locate(*r)
+    elapsed = time.time() - start
+    print(f"sequential: {count} requests in {elapsed:.2f}sec, {count / elapsed:.2f} detections/sec")
+    for inflight in inflight_list:
+        dispatcher = ModelDispatcher(models, inflight)
+        start = time.time()
+        results = dispatcher.locate_all(requests)
+        elapsed = time.time() - start
+        errors = sum(1 for r in results if isinstance(r, Exception))
+        print(f"{inflight} in flight ({len(models)} endpoints): {count} requests in {elapsed:.2f}sec, {count / elapsed:.2f} detections/sec, {errors} errors")
+        dispatcher.stop()
@@ -0,0 +1,104 @@
+# This is a development tool for the project. It reports how the object
+# prefilters (see prefilter.py) do on the labeled dataset collected by the
+# "dataset" service (and labeled in the UI), so the operators can tune the
+# prefilter thresholds w/o missing the objects. For each object w/ the
+# prefilter in objects.json (or for all the objects w/ the prefilter given
+# on the command line) it prints the recall (the fraction of the positive
+# images the prefilter fires on), the fraction of the negative images it
+# fires on (the model calls still made) and the thresholds for the typical
+# recall targets. Note, the "blob" prefilter has no imager motion boxes for
+# the dataset images, so it falls back to the background subtraction over
+# the channel images in the dataset order (much sparser than the live frames).
+# Usage: python orchestrator/bench_prefilter.py [dataset_dir] [prefilter]
+import os
+import sys
+import glob
+import json
+import time
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+# Pull in shared variables (file names, JSON object names, ...) and the prefilters
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.abspath("."))
+from shared_settings import *
+from prefilter import *
+
+# Figure the path to the data folders depending on where we run
+DATA_DIR = ''
+if not os.path.exists('/.dockerenv'):
+    load_dotenv('./.env')
+DATA_DIR = os.getenv('DATA_DIR', DATA_DIR)
+OBJ_CONFIG = f"{DATA_DIR}/{CFG_dir}/{CFG_objects}"
+
+# Recall targets to report the thresholds for
+BENCH_recall_targets = [1.0, 0.99, 0.95, 0.9]
+
+# Get the labeled images of the object, returns the list of the (channel, image path,
+# positive) tuples (the image folders w/ the "skip" file are left out)
+def labeled_images(dataset_dir, obj_id):
+    images = []
+    for chan_dir in sorted(glob.glob(f"{dataset_dir}/*")):
+        chan = os.path.basename(chan_dir)
+        # the object folder and its copies queued for labeling (<obj_id>.N.M.TIMESTAMP)
+        for obj_dir in sorted(glob.glob(f"{chan_dir}/{obj_id}") + glob.glob(f"{chan_dir}/{obj_id}.*")):
+            if not os.path.isdir(obj_dir):
+                continue
+            for idx in sorted([int(f) for f in os.listdir(obj_dir) if f.isdigit()]):
+                img_dir = f"{obj_dir}/{idx}"
+                if os.path.exists(f"{img_dir}/skip") or not os.path.exists(f"{img_dir}/{IMG_file_name}"):
+                    continue
+                images.append((chan, f"{img_dir}/{IMG_file_name}", not os.path.exists(f"{img_dir}/no")))
+    return images
+
+# Run the object prefilter on its labeled images, print the report
+def report_object(dataset_dir, o):
+    obj_id = o[CFG_obj_id_key]
+    images = labeled_images(dataset_dir, obj_id)
+    if len(images) == 0:
+        print(f"{obj_id}: no labeled images in {dataset_dir}")
+        return
+    prefilters = {} # one per channel (some keep the channel background)
+    pos = []
+    neg = []
+    start = time.time()
+    for chan, img_path, positive in images:
+        if chan not in prefilters:
+            prefilters[chan] = new_prefilter(o)
+        # decoded at the same scale as in the orchestrator
+        img = cv2.imread(img_path, cv2.IMREAD_REDUCED_COLOR_2)
+        if img is None:
+            continue
+        score = prefilters[chan].score(img, {})
+        (pos if positive else neg).append(score)
+    elapsed = time.time() - start
+    thresh = list(prefilters.values())[0].thresh
+    pos = np.array(pos)
+    neg = np.array(neg)
+    recall = (pos >= thresh).mean() if len(pos) > 0 else float('nan')
+    neg_pass = (neg >= thresh).mean() if len(neg) > 0 else float('nan')
+    print(f"{obj_id} ({o[CFG_obj_prefilter_key]}, threshold {thresh}): {len(pos)} positive, {len(neg)} negative images, "
+          f"recall {recall:.3f}, fires on {neg_pass:.3f} of negatives, {elapsed * 1000 / (len(pos) + len(neg)):.1f}ms per image")
+    for target in BENCH_recall_targets:
+        if len(pos) == 0:
+            break
+        # the highest threshold keeping the target recall
+        t = float(np.sort(pos)[int(np.floor((1.0 - target) * len(pos)))])
+        neg_t = (neg >= t).mean() if len(neg) > 0 else float('nan')
+        print(f"    recall {(pos >= t).mean():.3f}: threshold {t:.4g}, fires on {neg_t:.3f} of negatives")
+
+if __name__ == "__main__":
+    dataset_dir = sys.argv[1] if len(sys.argv) > 1 else f"{DATA_DIR}/{CFG_dset_svc_name}"
+    prefilter = sys.argv[2] if len(sys.argv) > 2 else None
+    if prefilter is not None and prefilter not in PREFILTERS.keys():
+        print(f"Usage: python {sys.argv[0]} [dataset_dir] [{'|'.join(PREFILTERS.keys())}]")
+        exit(1)
+    with open(OBJ_CONFIG, "r") as file:
+        objects = json.load(file).get(CFG_obj_objects_key, [])
+    for o in objects:
+        if prefilter is not None:
+            o = {k: v for k, v in o.items() if k != CFG_obj_prefilter_thresh_key or o.get(CFG_obj_prefilter_key) == prefilter}
+            o[CFG_obj_prefilter_key] = prefilter
+        if CFG_obj_prefilter_key in o.keys():
+            report_object(dataset_dir, o)
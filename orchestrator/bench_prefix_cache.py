@@ -0,0 +1,220 @@
+# This is a development tool for the project. It measures the time to the first
+# token (TTFT) of the detection and location requests w/ the old prompt layout
+# (the object text before the image, the location asked in a new request w/
+# the image) vs the current one (the system prompt and the image first, the
+# location asked in the follow-up turn). The servers caching the prompt prefix
+# (vLLM w/ --enable-prefix-caching, Ollama keeping the context) should only
+# encode the image once per frame w/ the current layout. The model endpoint
+# is taken from model.json, or the --mock option starts a local OpenAI compatible
+# mock server simulating the prefix caching (the TTFT grows w/ the number of the
+# prompt tokens not found in its cache).
+# Usage: python orchestrator/bench_prefix_cache.py <image.jpg> [frames] [--mock]
+import os
+import sys
+import time
+import json
+import base64
+import asyncio
+import hashlib
+import threading
+import cv2
+import numpy as np
+from aiohttp import web
+
+# Pull in shared variables (file names, JSON object names, ...) and the the model interface classes
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.abspath("."))
+from shared_settings import *
+from model_interfaces import *
+from bench_model_dispatch import load_model
+
+# Objects to look for in each frame
+BENCH_objects = ["a person", "a car", "a dog", "a package"]
+
+# Mock server parameters: the prompt tokens an image takes, the prefix cache
+# block size (in tokens) and the prompt processing time per token
+MOCK_port = 5099
+MOCK_image_tokens = 1600
+MOCK_block_tokens = 16
+MOCK_token_time = 0.0002
+
+# Mock server prefix cache (the hashes of the cached token blocks)
+MOCK_cache = set()
+
+# Turn the chat messages into the list of the "tokens" (the image becomes
+# MOCK_image_tokens tokens derived from the hash of its data, placed where the
+# <|image|> token is in the message text, or where the image is in the message)
+def mock_tokens(messages):
+    tokens = []
+    for m in messages:
+        tokens.append(f"<{m['role']}>")
+        content = m['content']
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        images = [hashlib.md5(c['image_url']['url'].encode()).hexdigest() for c in content if c['type'] != 'text']
+        inline = any(['<|image|>' in c['text'] for c in content if c['type'] == 'text'])
+        for c in content:
+            if c['type'] == 'text':
+                for word in c['text'].replace('<|image|>', ' <|image|> ').split():
+                    if word == '<|image|>' and len(images) > 0:
+                        tokens.extend([f"{images[0]}:{idx}" for idx in range(MOCK_image_tokens)])
+                    else:
+                        tokens.append(word)
+            elif not inline:
+                img_hash = hashlib.md5(c['image_url']['url'].encode()).hexdigest()
+                tokens.extend([f"{img_hash}:{idx}" for idx in range(MOCK_image_tokens)])
+    return tokens
+
+# Count the prompt tokens found in the mock prefix cache and add the prompt to the cache
+def mock_cached_tokens(tokens):
+    cached = 0
+    prefix_hash = hashlib.md5()
+    for idx in range(0, len(tokens) - MOCK_block_tokens + 1, MOCK_block_tokens):
+        prefix_hash.update(" ".join(tokens[idx:idx + MOCK_block_tokens]).encode())
+        block = prefix_hash.hexdigest()
+        if block in MOCK_cache and cached == idx:
+            cached += MOCK_block_tokens
+        MOCK_cache.add(block)
+    return cached
+
+# Mock chat completions endpoint (streaming only)
+async def mock_chat(request):
+    js = await request.json()
+    tokens = mock_tokens(js['messages'])
+    await asyncio.sleep((len(tokens) - mock_cached_tokens(tokens)) * MOCK_token_time)
+    question = js['messages'][-1]['content']
+    question = question if isinstance(question, str) else " ".join([c.get('text', '') for c in question])
+    question = question.split("<|start_header_id|>user<|end_header_id|>")[-1] # the last turn of the token text
+    answer = "Yes." if "Is there" in question else "In the middle of the image."
+    rsp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await rsp.prepare(request)
+    for word in answer.split():
+        chunk = {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": "mock",
+                 "choices": [{"index": 0, "delta": {"role": "assistant", "content": word + " "}, "finish_reason": None}]}
+        await rsp.write(f"data: {json.dumps(chunk)}\n\n".encode())
+    await rsp.write(b"data: [DONE]\n\n")
+    return rsp
+
+# Mock models list endpoint
+async def mock_models(request):
+    return web.json_response({"object": "list", "data": [{"id": "mock", "object": "model", "created": 0, "owned_by": "mock"}]})
+
+# Start the mock server in its own thread
+def start_mock():
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.add_routes([web.post('/v1/chat/completions', mock_chat), web.get('/v1/models', mock_models)])
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', MOCK_port).start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+# Generate the frames (the image w/ a different patch in each, so the server can't
+# reuse the image encoding from the previous frame)
+def gen_frames(image_path, count):
+    img = cv2.imread(image_path)
+    if img is None:
+        raise Exception(f"error, unable to read {image_path}")
+    frames = []
+    for idx in range(count):
+        frame = img.copy()
+        cv2.rectangle(frame, (0, 0), (32, 32), (idx * 37 % 256, idx * 91 % 256, idx * 13 % 256), -1)
+        frames.append(base64.b64encode(cv2.imencode('.jpg', frame)[1].tobytes()).decode())
+    return frames
+
+# Old request layout (the prompt text before the image)
+def old_layout(request):
+    for m in request["messages"]:
+        if isinstance(m["content"], list):
+            m["content"] = sorted(m["content"], key=lambda c: c["type"] != "text")
+            for c in m["content"]:
+                if c["type"] == "text" and "<|image|>" in c["text"]:
+                    c["text"] = c["text"].replace("<|image|>", "").replace("<|eot_id|><|start_header_id|>assistant", "<|image|><|eot_id|><|start_header_id|>assistant", 1)
+    return request
+
+# Location prompt of the old layout (asked in a new conversation w/ the image)
+def old_locate_prompt(model, obj_desc, image_desc):
+    prompt = model.gen_locate_prompt(obj_desc, image_desc)
+    if not hasattr(model, 'gen_prompt_prefix'):
+        return prompt
+    # the token text follow-up turn w/o the end of the previous turn
+    return model.gen_prompt_prefix() + prompt[prompt.find("<|end_header_id|>") + len("<|end_header_id|>"):]
+
+# Follow-up request (the vLLM interface makes its own, w/ the token text)
+def followup_request(model, request, answer, prompt, max_tokens):
+    if hasattr(model, 'gen_followup_request'):
+        return model.gen_followup_request(request, answer, prompt, max_tokens)
+    return gen_followup_request(request, answer, prompt, max_tokens)
+
+# Send the streaming chat completion request, returns the TTFT and the answer
+def stream_request(model, request):
+    start = time.time()
+    ttft = None
+    answer = ""
+    for chunk in model.client.chat.completions.create(**request, stream=True):
+        if chunk.choices and chunk.choices[0].delta.content:
+            if ttft is None:
+                ttft = time.time() - start
+            answer += chunk.choices[0].delta.content
+    return (ttft if ttft is not None else time.time() - start), answer
+
+# Run the detection and location requests for all the objects in the frames
+# w/ the chat completions API, returns the detection and location TTFT lists
+def bench_openai(model, frames, followup):
+    detect = []
+    locate = []
+    for cam, image_data in enumerate(frames):
+        image_desc = f"camera {cam}"
+        for obj_desc in BENCH_objects:
+            request = model.gen_request(model.gen_detect_prompt(obj_desc, image_desc), image_data, 'jpeg', 8)
+            request = request if followup else old_layout(request)
+            ttft, answer = stream_request(model, request)
+            detect.append(ttft)
+            if followup:
+                request = followup_request(model, request, answer, model.gen_locate_prompt(obj_desc, image_desc), 32)
+            else:
+                request = old_layout(model.gen_request(old_locate_prompt(model, obj_desc, image_desc), image_data, 'jpeg', 32))
+            ttft, answer = stream_request(model, request)
+            locate.append(ttft)
+    return detect, locate
+
+# Run the detection and location requests w/ the Ollama generate API, returns
+# the detection and location prompt evaluation time lists
+def bench_ollama(model, frames, followup):
+    detect = []
+    locate = []
+    options = {'temperature': 0.0, "template": None}
+    for cam, image_data in enumerate(frames):
+        image_desc = f"camera {cam}"
+        for obj_desc in BENCH_objects:
+            rsp = model.client.generate(model=model.model_to_use, prompt=model.gen_detect_prompt(obj_desc, image_desc),
+                                        images=[image_data], options=options)
+            detect.append(rsp.prompt_eval_duration / 1e9)
+            if followup:
+                rsp = model.client.generate(model=model.model_to_use, prompt=model.gen_locate_prompt(obj_desc, image_desc),
+                                            context=rsp.context, options=options)
+            else:
+                prompt = old_locate_prompt(model, obj_desc, image_desc)
+                rsp = model.client.generate(model=model.model_to_use, prompt=prompt, images=[image_data], options=options)
+            locate.append(rsp.prompt_eval_duration / 1e9)
+    return detect, locate
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    if len(args) < 1:
+        print(f"Usage: python {sys.argv[0]} <image.jpg> [frames] [--mock]")
+        exit(1)
+    count = int(args[1]) if len(args) > 1 else 8
+    if '--mock' in sys.argv:
+        start_mock()
+        model = VLLMLlama32Interface(api_base=f"http://127.0.0.1:{MOCK_port}/v1")
+    else:
+        model = load_model()
+    bench = bench_openai if hasattr(model, 'gen_request') else bench_ollama
+    what = "TTFT" if bench == bench_openai else "prompt eval"
+    # Different frames for each run, so the second run can't reuse the first run's cache
+    frames = gen_frames(args[0], count * 2)
+    for name, followup, run_frames in (("old layout", False, frames[:count]), ("image first + follow-up", True, frames[count:])):
+        detect, locate = bench(model, run_frames, followup)
+        print(f"{name}: {what} detect avg {np.mean(detect) * 1000:.1f}ms (p50 {np.median(detect) * 1000:.1f}ms), "
+              f"locate avg {np.mean(locate) * 1000:.1f}ms (p50 {np.median(locate) * 1000:.1f}ms)")
@@ -0,0 +1,72 @@
+# Detection result cache for the orchestrator. Static scenes produce nearly
+# identical frames for hours, so the detection results (the (res, loc_msg)
+# tuples) are kept for a while and reused for the look-alike frames of the
+# same channel instead of asking the model again. The frames are compared by
+# their perceptual hashes (see frame_hash.py, the imager puts the hash in the
+# frame metadata, the orchestrator calculates it for the frames w/o it). The
+# cache entries are grouped by (channel, object description, model), the frame
+# hash within the Hamming distance tolerance from the cached one is a hit. The
+# cache is bounded (the least recently used entries go first) and the entries
+# expire after the TTL.
+import time
+import threading
+from collections import OrderedDict
+
+class DetectCache:
+    def __init__(self, ttl, max_dist, max_size):
+        self.ttl = ttl
+        self.max_dist = max_dist
+        self.max_size = max(1, max_size)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # (group, hash) -> (time, result), in LRU order
+        self.groups = {}             # group -> dict of the hashes cached for the group (as ints)
+        self.hits = 0   # total number of the lookups that found the result
+        self.misses = 0 # total number of the lookups that did not
+
+    # Remove the entry (the lock must be held)
+    def remove(self, key):
+        del self.entries[key]
+        group, phash = key
+        hashes = self.groups[group]
+        del hashes[phash]
+        if len(hashes) == 0:
+            del self.groups[group]
+
+    # Look up the detection result for the object on the channel frame w/ the hash,
+    # returns the result tuple or None if not cached
+    def get(self, chan, obj_desc, model, phash):
+        if self.ttl <= 0 or phash is None:
+            return None
+        group = (chan, obj_desc, model)
+        now = time.time()
+        with self.lock:
+            found = None
+            hashes = self.groups.get(group, {})
+            value = int(phash, 16)
+            for h, h_value in list(hashes.items()):
+                key = (group, h)
+                if now - self.entries[key][0] > self.ttl:
+                    self.remove(key)
+                    continue
+                if found is None and bin(value ^ h_value).count('1') <= self.max_dist:
+                    found = key
+            if found is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(found)
+            self.hits += 1
+            return self.entries[found][1]
+
+    # Store the detection result for the object on the channel frame w/ the hash
+    def put(self, chan, obj_desc, model, phash, result):
+        if self.ttl <= 0 or phash is None:
+            return
+        group = (chan, obj_desc, model)
+        key = (group, phash)
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (time.time(), result)
+            self.groups.setdefault(group, {})[phash] = int(phash, 16)
+            while len(self.entries) > self.max_size:
+                self.remove(next(iter(self.entries)))
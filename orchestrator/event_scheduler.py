@@ -0,0 +1,92 @@
+# Deadline scheduler for the orchestrator. The service event files are aged
+# out exactly when due, not when the next frame of the channel happens to
+# arrive (the channel might be turned off, or its camera dead, and the stale
+# events would stay reported forever). The timers are kept in a heap ordered
+# by the deadline and run by the scheduler thread. Each timer has a key, the
+# timer scheduled w/ the key of the pending one replaces it (the replaced
+# heap entries are skipped when they come up, or dropped when the heap is
+# compacted).
+import sys
+import time
+import heapq
+import itertools
+import threading
+
+SCHED_compact_min = 64 # don't bother compacting the heap w/ fewer stale entries
+
+class EventScheduler:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.heap = []    # (deadline, seq, key) tuples, including the replaced and cancelled timers
+        self.timers = {}  # key -> (deadline, seq, callback) of the pending timers
+        self.seq = itertools.count()
+        self.running = True
+        # metrics (for the current reporting interval)
+        self.fired = 0       # timers run
+        self.late_max = 0.0  # max delay of the timer runs past their deadlines (seconds)
+        self.thread = threading.Thread(target=self.run, name="orch-timers", daemon=True)
+        self.thread.start()
+
+    # Run the callback at the deadline (time.time() seconds) in the scheduler thread,
+    # replaces the pending timer w/ the same key
+    def schedule(self, key, deadline, callback):
+        with self.cond:
+            seq = next(self.seq)
+            self.timers[key] = (deadline, seq, callback)
+            heapq.heappush(self.heap, (deadline, seq, key))
+            if len(self.heap) > 2 * len(self.timers) + SCHED_compact_min:
+                self.heap = [(t[0], t[1], k) for k, t in self.timers.items()]
+                heapq.heapify(self.heap)
+            if self.heap[0][1] == seq:
+                self.cond.notify_all()
+
+    # Cancel the pending timer (if any)
+    def cancel(self, key):
+        with self.cond:
+            self.timers.pop(key, None)
+
+    # Stop the scheduler thread, the pending timers are dropped
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.timers = {}
+            self.heap = []
+            self.cond.notify_all()
+
+    # Check if the heap entry is the pending timer (the lock must be held)
+    def is_pending(self, entry):
+        timer = self.timers.get(entry[2])
+        return timer is not None and timer[1] == entry[1]
+
+    # Scheduler thread, runs the timers when due
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running:
+                    while len(self.heap) > 0 and not self.is_pending(self.heap[0]):
+                        heapq.heappop(self.heap)
+                    if len(self.heap) == 0:
+                        self.cond.wait()
+                        continue
+                    delay = self.heap[0][0] - time.time()
+                    if delay <= 0:
+                        break
+                    self.cond.wait(delay)
+                if not self.running:
+                    return
+                deadline, seq, key = heapq.heappop(self.heap)
+                callback = self.timers.pop(key)[2]
+                self.fired += 1
+                self.late_max = max(self.late_max, time.time() - deadline)
+            try:
+                callback()
+            except Exception as e:
+                print(f"{sys._getframe().f_code.co_name}: timer {key} error: {e}")
+
+    # Report the metrics for the interval and reset them
+    def report_metrics(self, interval):
+        with self.cond:
+            print(f"Event timers in {int(interval)}sec: {self.fired} run, max {self.late_max:.2f}sec late, "
+                  f"{len(self.timers)} pending")
+            self.fired = 0
+            self.late_max = 0.0
@@ -2,8 +2,11 @@
 # It's purpose it to collect a large number of the images 
 # captured by the imager for evaluating the model objects 
 # detection capabilities. 
-# Warning: it's the image consumer, do not run at the same time
-#          with the orchestrator script.
+# Warning: for the channels passing the images through image.json
+#          files (frame_ipc set to "file") it's the image consumer, do
+#          not run at the same time with the orchestrator script. The
+#          channels using the shared memory frame ring can be read by
+#          any number of consumers.
 import os
 import sys
 import time
@@ -16,6 +19,7 @@ from dotenv import load_dotenv
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.append(parent_dir)
 from shared_settings import *
+from frame_ring import *
 
 # Figure the path to the data folders depending on where we run
 DATA_DIR = ''
@@ -30,6 +34,9 @@ IMGDIR = f"{IPC_DIR}/{IMG_dir}"
 # Will also need some location where to keep the archive
 DATASET_DIR = f"{DATA_DIR}/dataset"
 
+# Frame ring readers (instances of FrameRingReader, keyed by channel folder name)
+RINGS = {}
+
 # Atomic rename and load of the image data
 def read_image_json(img_json_fname):
     img_json_tmp_fname = img_json_fname + ".rd.tmp"
@@ -54,6 +61,16 @@ def read_image_json(img_json_fname):
         return None
     return js
 
+# Save the image data in the dataset folder
+def save_image(chan_id, img_iter, data):
+    # If capturing every 3sec, 20/min, 1200/hour, 28800/24h
+    # ~50KB each 1440000KB, ~1.3GB per each channel
+    dst_file_dir = f"{DATASET_DIR}/{chan_id}"
+    dst_file = f"{dst_file_dir}/{img_iter:05}.jpg"
+    os.makedirs(dst_file_dir, exist_ok=True)
+    Path(dst_file).write_bytes(data)
+    return dst_file
+
 # Main loop (called w/ some fraction of the IMG_poll_int_ms frequency)
 def main_loop(iteration):
     # Loop over the channel folders 
@@ -61,7 +78,18 @@ def main_loop(iteration):
         chan_dir = f"{IMGDIR}/{chan}"
         if chan.startswith('.') or not os.path.isdir(chan_dir):
             continue
-        img_json_fname = f"{chan_dir}/image.json"
+
+        # Try the frame ring first, write straight from the shared memory
+        if not chan in RINGS:
+            RINGS[chan] = FrameRingReader(f"{chan_dir}/{IMG_ring_file_name}")
+        frame = RINGS[chan].read_next()
+        if frame is not None:
+            dst_file = save_image(frame.meta.get(IMG_chan_key, chan), frame.iter, frame.data)
+            if not frame.is_valid(): # overwritten while saving
+                os.unlink(dst_file)
+            continue
+
+        img_json_fname = f"{chan_dir}/{IMG_json_file_name}"
         js = read_image_json(img_json_fname)
         if js is None:
             continue
@@ -71,13 +99,7 @@ def main_loop(iteration):
         data = base64.b64decode(js[IMG_data_key])
         #epoch_sec = js[IMG_time_key]
         img_iter = js[IMG_iter_key]
-
-        # If capturing every 3sec, 20/min, 1200/hour, 28800/24h
-        # ~50KB each 1440000KB, ~1.3GB per each channel
-        dst_file_dir = f"{DATASET_DIR}/{chan_id}"
-        dst_file = f"{dst_file_dir}/{img_iter:05}.jpg"
-        os.makedirs(dst_file_dir, exist_ok=True)
-        Path(dst_file).write_bytes(data)
+        save_image(chan_id, img_iter, data)
     return
 
 # Run the main loop
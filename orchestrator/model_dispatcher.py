@@ -0,0 +1,443 @@
+# Model request dispatcher for the orchestrator. Runs an asyncio event loop in its own
+# thread and keeps up to max_inflight locate requests in flight to each model endpoint
+# (so the servers batching the requests, e.g. vLLM, are kept busy). The channel workers
+# submit all the requests for a frame at once and get the results for the frame back.
+# The model interfaces w/o the async methods (e.g. locate_async()) are called in the thread pool.
+# The requests waiting for a free slot are scheduled by priority (the alert service objects
+# first, then location, then dataset) and by deadline (earliest first). The requests past
+# their deadline are dropped, and when too many are waiting the lowest priority (and, within
+# it, the oldest) ones are shed. Both are counted per priority in the metrics.
+# The dispatcher can balance the requests across several model endpoints (a model interface
+# instance for each, so each keeps its connections). A request goes to the endpoint w/ the
+# lowest (requests in flight + 1) * (average request time).
+# Each endpoint has a circuit breaker: it opens (the endpoint is taken out of the rotation)
+# after several consecutive failed requests or a failed periodic health probe. When the
+# endpoint passes a probe again, the breaker goes half open and lets a single request
+# through, it closes if that request succeeds and opens again if not (the probe only tells
+# the server is up, not that it can serve the requests). The requests time out after the
+# multiple of the endpoint's p95 request time, the failed ones are retried (on another
+# endpoint if there is one). The rate limited endpoints are paused for the time the server
+# asks for. While the circuits of all the endpoints are open the requests go to the fallback
+# model (if configured) or are rejected right away.
+import os
+import sys
+import time
+import heapq
+import asyncio
+import threading
+from collections import deque
+
+# Pull in shared variables (file names, JSON object names, ...)
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.abspath("."))
+from shared_settings import *
+from model_interfaces import ModelRateLimited
+
+# Request priorities (lower goes first)
+DISPATCH_prio_alert = 0
+DISPATCH_prio_location = 1
+DISPATCH_prio_dataset = 2
+DISPATCH_prio_names = ["alert", "location", "dataset"]
+# Endpoint health checking
+DISPATCH_probe_int = 5         # how often to probe the endpoints (seconds)
+DISPATCH_probe_timeout = 5     # probe timeout (seconds)
+DISPATCH_open_failures = 3     # consecutive request failures opening the endpoint circuit breaker
+DISPATCH_latency_alpha = 0.2   # request time moving average update rate
+# Request timeouts and retries
+DISPATCH_timeout_default = 120 # request timeout until there are enough request times to go by (seconds)
+DISPATCH_timeout_min = 10      # min request timeout (seconds)
+DISPATCH_timeout_factor = 3    # request timeout is this times the p95 request time
+DISPATCH_timeout_samples = 100 # number of the recent request times kept per endpoint
+DISPATCH_timeout_min_samples = 20 # min number of the request times for the adaptive timeout
+DISPATCH_max_retries = 1       # max number of times a failed request is retried
+
+# The request was dropped by the scheduler (expired or shed), not failed by the model
+class DispatchDropped(Exception):
+    pass
+
+# Request waiting for the endpoint slot
+class DispatchWaiter:
+    def __init__(self, priority, deadline, seq, future, method, exclude=None):
+        self.priority = priority
+        self.deadline = deadline # epoch time (float('inf') if none)
+        self.seq = seq
+        self.future = future
+        self.method = method   # model interface method to call
+        self.exclude = exclude # endpoint to avoid (the retried request failed on it)
+        self.queued_time = time.time()
+
+    def __lt__(self, other):
+        return (self.priority, self.deadline, self.seq) < (other.priority, other.deadline, other.seq)
+
+# Model endpoint (the model interface instance talking to it) and its state
+class DispatchEndpoint:
+    def __init__(self, model, fallback=False):
+        self.model = model
+        self.api_base = getattr(model, 'api_base', None)
+        self.fallback = fallback # only used while the circuits of all the primary endpoints are open
+        self.inflight = 0    # number of the requests in flight
+        self.latency = 0.0   # moving average of the request time (seconds, 0 until known)
+        self.times = deque(maxlen=DISPATCH_timeout_samples) # recent request times (seconds)
+        self.failures = 0    # number of the consecutive failures
+        self.open = False    # circuit breaker is open (the endpoint is out of the rotation)
+        self.half_open = False # the open circuit breaker lets a trial request through (passed the health probe)
+        self.paused_until = 0.0 # rate limited, no requests until this time (event loop time)
+        self.m_sent = 0      # requests sent in the metrics interval
+        self.m_failed = 0    # requests failed in the metrics interval
+        self.m_timeouts = 0  # requests timed out in the metrics interval
+        self.m_retries = 0   # requests retried after failing here in the metrics interval
+        self.m_opened = 0    # times the circuit breaker opened in the metrics interval
+
+    # Request timeout (seconds), the multiple of the recent p95 request time
+    def timeout(self):
+        if len(self.times) < DISPATCH_timeout_min_samples:
+            return DISPATCH_timeout_default
+        times = sorted(self.times)
+        return max(DISPATCH_timeout_min, DISPATCH_timeout_factor * times[int(0.95 * (len(times) - 1))])
+
+    # Check if the requests can go to the endpoint, its circuit breaker is closed, or half
+    # open w/ no trial request in flight yet
+    def usable(self):
+        return not self.open or (self.half_open and self.inflight == 0)
+
+    # Circuit breaker state name (for the metrics)
+    def breaker_state(self):
+        return 'closed' if not self.open else ('half-open' if self.half_open else 'OPEN')
+
+class ModelDispatcher:
+    # model is the model interface instance or the list of them (one for each endpoint),
+    # fallback is the same for the fallback model (None if none)
+    def __init__(self, model, max_inflight=CFG_DEF_model_inflight, max_queue=CFG_DEF_model_queue, fallback=None):
+        self.endpoints = [DispatchEndpoint(m) for m in (model if isinstance(model, list) else [model])]
+        if fallback is not None:
+            self.endpoints += [DispatchEndpoint(m, True) for m in (fallback if isinstance(fallback, list) else [fallback])]
+        self.model = self.endpoints[0].model
+        self.max_inflight = max(1, max_inflight)
+        self.max_queue = max(0, max_queue)
+        self.queue = []  # heap of the requests waiting for a free endpoint slot (DispatchWaiter)
+        self.seq = 0
+        self.lock = threading.Lock() # protects the metrics (reported from the orchestrator thread)
+        self.reset_metrics()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="model-dispatch", daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.health_loop(), self.loop)
+
+    def __del__(self):
+        self.stop()
+
+    # Stop the event loop (the requests in flight are cancelled, their callers get the error) and
+    # drop the model interfaces. The loop, its tasks and the endpoints reference each other, so w/o
+    # that the interfaces would only be destroyed (e.g. unloading the Ollama model) whenever the
+    # garbage collector gets to them, possibly after the replacement model is loaded.
+    def stop(self):
+        if self.loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.cancel_all(), self.loop).result(timeout=5)
+        except Exception as e:
+            print(f"{sys._getframe().f_code.co_name}: error cancelling model requests: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+        if self.thread.is_alive():
+            print(f"{sys._getframe().f_code.co_name}: model dispatcher thread did not stop")
+        else:
+            self.loop.close()
+        self.loop = None
+        self.endpoints = []
+        self.model = None
+
+    # Change the max number of the requests in flight to each endpoint and waiting
+    # (applies to the requests from now on)
+    def reconfigure(self, max_inflight, max_queue):
+        self.max_inflight = max(1, max_inflight)
+        self.max_queue = max(0, max_queue)
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.dispatch_waiters)
+
+    # Cancel all the requests in flight (runs in the event loop)
+    async def cancel_all(self):
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Reset the per-priority metrics (the lock must be held or not needed)
+    def reset_metrics(self):
+        count = len(DISPATCH_prio_names)
+        self.m_done = [0] * count     # requests sent to the model
+        self.m_expired = [0] * count  # requests dropped past their deadline
+        self.m_shed = [0] * count     # requests shed because of too many waiting
+        self.m_rejected = [0] * count # requests rejected because all the circuit breakers are open
+        self.m_wait_sum = [0.0] * count # sum of the time the sent requests waited for a slot (seconds)
+        self.m_wait_max = [0.0] * count # max time a sent request waited for a slot (seconds)
+
+    # Report the per-priority metrics for the interval and reset them
+    def report_metrics(self, interval):
+        with self.lock:
+            stats = []
+            for p, name in enumerate(DISPATCH_prio_names):
+                if self.m_done[p] + self.m_expired[p] + self.m_shed[p] + self.m_rejected[p] == 0:
+                    continue
+                wait_avg = self.m_wait_sum[p] / self.m_done[p] if self.m_done[p] > 0 else 0.0
+                stats.append(f"{name} {self.m_done[p]} sent, {self.m_expired[p]} expired, {self.m_shed[p]} shed, "
+                             f"{self.m_rejected[p]} rejected, wait avg {wait_avg:.2f}sec, max {self.m_wait_max[p]:.2f}sec")
+            self.reset_metrics()
+            eps = []
+            for ep in self.endpoints:
+                eps.append(f"{ep.api_base}{' (fallback)' if ep.fallback else ''} breaker {ep.breaker_state()}"
+                           f"{' (opened ' + str(ep.m_opened) + 'x)' if ep.m_opened > 0 else ''}, {ep.m_sent} sent, "
+                           f"{ep.m_failed} failed, {ep.m_timeouts} timed out, {ep.m_retries} retried, {ep.inflight} in flight, "
+                           f"avg {ep.latency:.2f}sec, timeout {ep.timeout():.1f}sec")
+                ep.m_sent = ep.m_failed = ep.m_timeouts = ep.m_retries = ep.m_opened = 0
+        print(f"Model requests in {int(interval)}sec: {'; '.join(stats) if len(stats) > 0 else 'none'}; {len(self.queue)} waiting now")
+        print(f"Model endpoints: {'; '.join(eps)}")
+
+    # Drop the waiting request w/ the exception, counting it in the metric list (runs in the event loop)
+    def drop_waiter(self, w, metric, reason):
+        if not w.future.done():
+            w.future.set_exception(DispatchDropped(f"request {reason}"))
+        with self.lock:
+            metric[w.priority] += 1
+
+    # Check if there is an endpoint w/ the circuit closed the request for the method can go to
+    # (or half open, the requests wait for the outcome of its trial request)
+    def can_call(self, method):
+        return any([(not ep.open or ep.half_open) and hasattr(ep.model, method) for ep in self.endpoints])
+
+    # Pick the endpoint for the next request for the method (None if no free slots). The fallback
+    # endpoints are only used while the circuits of all the primary ones are open (a half open
+    # primary endpoint gets the trial request, the rest go to the fallback). The exclude
+    # endpoint (the retried request failed on) is skipped if there is another one to go to
+    # (runs in the event loop).
+    def pick_endpoint(self, method, exclude=None):
+        now = self.loop.time()
+        usable = [ep for ep in self.endpoints if ep.usable() and hasattr(ep.model, method)]
+        candidates = [ep for ep in usable if not ep.fallback]
+        if len(candidates) == 0:
+            candidates = usable
+        if exclude is not None and any([ep is not exclude for ep in candidates]):
+            candidates = [ep for ep in candidates if ep is not exclude]
+        free = [ep for ep in candidates if ep.inflight < self.max_inflight and ep.paused_until <= now]
+        if len(free) == 0:
+            return None
+        return min(free, key=lambda ep: ((ep.inflight + 1) * ep.latency, ep.inflight))
+
+    # Wait for a free endpoint slot for the request for the method (runs in the event loop),
+    # returns the endpoint (other than exclude if possible, see pick_endpoint()). Raises
+    # DispatchDropped if the request expired, was shed while waiting or there is no endpoint
+    # w/ the circuit closed to send it to.
+    async def acquire(self, priority, deadline, method, exclude=None):
+        queue = self.queue
+        start = time.time()
+        if deadline <= start:
+            with self.lock:
+                self.m_expired[priority] += 1
+            raise DispatchDropped("request expired")
+        if not self.can_call(method):
+            with self.lock:
+                self.m_rejected[priority] += 1
+            raise DispatchDropped("request rejected, model circuit breaker is open")
+        ep = self.pick_endpoint(method, exclude) if len(queue) == 0 else None
+        if ep is not None:
+            ep.inflight += 1
+        else:
+            self.seq += 1
+            w = DispatchWaiter(priority, deadline, self.seq, self.loop.create_future(), method, exclude)
+            heapq.heappush(queue, w)
+            if deadline != float('inf'):
+                self.loop.call_later(deadline - start, self.expire_waiter, w)
+            # too many waiting, shed the lowest priority and, within it, the oldest request
+            if len(queue) > self.max_queue:
+                victim = max(queue, key=lambda x: (x.priority, -x.queued_time))
+                queue.remove(victim)
+                heapq.heapify(queue)
+                self.drop_waiter(victim, self.m_shed, "shed")
+            try:
+                ep = await w.future # the endpoint slot is handed over by dispatch_waiters()
+            except asyncio.CancelledError:
+                if w in queue:
+                    queue.remove(w)
+                    heapq.heapify(queue)
+                elif w.future.done() and not w.future.cancelled() and w.future.exception() is None:
+                    self.release(w.future.result()) # cancelled after getting the slot, pass it on
+                raise
+        wait = time.time() - start
+        with self.lock:
+            self.m_done[priority] += 1
+            self.m_wait_sum[priority] += wait
+            self.m_wait_max[priority] = max(self.m_wait_max[priority], wait)
+        return ep
+
+    # Drop the request if it is still waiting at its deadline (runs in the event loop)
+    def expire_waiter(self, w):
+        if w.future.done() or not w in self.queue:
+            return
+        self.queue.remove(w)
+        heapq.heapify(self.queue)
+        self.drop_waiter(w, self.m_expired, "expired")
+
+    # Hand the free endpoint slots over to the waiting requests that are still within
+    # their deadlines, reject the ones no endpoint can take (runs in the event loop)
+    def dispatch_waiters(self):
+        now = time.time()
+        while len(self.queue) > 0:
+            w = self.queue[0]
+            if w.future.done(): # the caller was cancelled
+                heapq.heappop(self.queue)
+                continue
+            if w.deadline <= now:
+                heapq.heappop(self.queue)
+                self.drop_waiter(w, self.m_expired, "expired")
+                continue
+            if not self.can_call(w.method):
+                heapq.heappop(self.queue)
+                self.drop_waiter(w, self.m_rejected, "rejected, model circuit breaker is open")
+                continue
+            ep = self.pick_endpoint(w.method, w.exclude)
+            if ep is None:
+                return
+            heapq.heappop(self.queue)
+            ep.inflight += 1
+            w.future.set_result(ep)
+
+    # Free the endpoint slot (runs in the event loop)
+    def release(self, ep):
+        ep.inflight -= 1
+        self.dispatch_waiters()
+
+    # Update the endpoint state w/ the request outcome, the request time (None if failed)
+    # (runs in the event loop)
+    def request_done(self, ep, elapsed, error=None):
+        with self.lock:
+            ep.m_sent += 1
+            if elapsed is not None:
+                ep.failures = 0
+                ep.times.append(elapsed)
+                ep.latency = elapsed if ep.latency == 0.0 else ep.latency + DISPATCH_latency_alpha * (elapsed - ep.latency)
+            else:
+                ep.m_failed += 1
+                ep.failures += 1
+                if isinstance(error, asyncio.TimeoutError):
+                    ep.m_timeouts += 1
+        if ep.open and ep.half_open:
+            if elapsed is not None:
+                self.close_circuit(ep, "passed the trial request")
+            else:
+                self.open_circuit(ep, f"failed the trial request: {repr(error)}")
+        elif not ep.open and ep.failures >= DISPATCH_open_failures:
+            self.open_circuit(ep, f"failed {ep.failures} requests: {repr(error)}")
+
+    # Open the endpoint circuit breaker (runs in the event loop)
+    def open_circuit(self, ep, reason):
+        print(f"{sys._getframe().f_code.co_name}: {ep.api_base} {reason}, circuit breaker open")
+        with self.lock:
+            ep.open = True
+            ep.half_open = False
+            ep.m_opened += 1
+        self.dispatch_waiters() # the waiting requests might have nowhere to go now
+
+    # Close the endpoint circuit breaker (runs in the event loop)
+    def close_circuit(self, ep, reason):
+        print(f"{sys._getframe().f_code.co_name}: {ep.api_base} {reason}, circuit breaker closed")
+        with self.lock:
+            ep.open = False
+            ep.half_open = False
+            ep.failures = 0
+        self.dispatch_waiters()
+
+    # Pause the rate limited endpoint (runs in the event loop)
+    def pause_endpoint(self, ep, delay):
+        print(f"{sys._getframe().f_code.co_name}: {ep.api_base} rate limited, pausing for {delay} seconds")
+        ep.paused_until = max(ep.paused_until, self.loop.time() + delay)
+        self.loop.call_later(delay, self.dispatch_waiters)
+
+    # Probe the endpoints periodically, open the circuit breakers of the failing ones and
+    # half open them for the recovered ones (runs in the event loop)
+    async def health_loop(self):
+        while True:
+            await asyncio.sleep(DISPATCH_probe_int)
+            results = await asyncio.gather(*[asyncio.wait_for(ep.model.health_async(), DISPATCH_probe_timeout)
+                                             for ep in self.endpoints if hasattr(ep.model, 'health_async')], return_exceptions=True)
+            for ep, r in zip([ep for ep in self.endpoints if hasattr(ep.model, 'health_async')], results):
+                if isinstance(r, Exception) and (not ep.open or ep.half_open):
+                    self.open_circuit(ep, f"failed health probe: {repr(r)}")
+                elif not isinstance(r, Exception) and ep.open and not ep.half_open:
+                    print(f"{sys._getframe().f_code.co_name}: {ep.api_base} passed health probe, circuit breaker half open")
+                    with self.lock:
+                        ep.half_open = True
+            self.dispatch_waiters()
+
+    # Call the model interface method on the endpoint (its async variant if available) w/ the
+    # endpoint's request timeout. Note, the blocking methods called in the thread pool can't be
+    # interrupted, the timeout only stops waiting for them.
+    async def call_endpoint(self, ep, method, args):
+        if hasattr(ep.model, f"{method}_async"):
+            return await asyncio.wait_for(getattr(ep.model, f"{method}_async")(*args), ep.timeout())
+        return await asyncio.wait_for(self.loop.run_in_executor(None, getattr(ep.model, method), *args), ep.timeout())
+
+    # Call the model interface method w/ the args when an endpoint has a free slot, retry
+    # if failed (on another endpoint if there is one)
+    async def call_model(self, method, args, priority=DISPATCH_prio_location, deadline=None):
+        deadline = float('inf') if deadline is None else deadline
+        ep = None
+        for attempt in range(DISPATCH_max_retries + 1):
+            ep = await self.acquire(priority, deadline, method, ep)
+            start = time.time()
+            error = None
+            try:
+                res = await self.call_endpoint(ep, method, args)
+                if method == 'locate' and res[1] is None:
+                    # locate() reports the request errors w/ no answer
+                    self.request_done(ep, None, "no answer")
+                else:
+                    self.request_done(ep, time.time() - start)
+                    return res
+            except asyncio.CancelledError:
+                raise
+            except ModelRateLimited as e:
+                self.pause_endpoint(ep, e.retry_after)
+                error = e
+            except Exception as e:
+                self.request_done(ep, None, e)
+                error = e
+            finally:
+                self.release(ep)
+            if attempt < DISPATCH_max_retries:
+                with self.lock:
+                    ep.m_retries += 1
+        if error is not None:
+            raise error
+        return res
+
+    # Run the locate requests concurrently, the exceptions are returned in place of the results
+    async def locate_gather(self, requests, priority, deadline):
+        return await asyncio.gather(*[self.call_model('locate', r, priority, deadline) for r in requests], return_exceptions=True)
+
+    # Submit the list of the locate requests, each is a tuple w/ the locate() arguments (image_data,
+    # obj_desc, image_desc), w/ the priority and the deadline (epoch time, None if no deadline).
+    # Returns the future for the list of the results (the (res, loc_msg) tuples or the exceptions).
+    def submit_all(self, requests, priority=DISPATCH_prio_location, deadline=None):
+        if self.loop is None:
+            raise Exception("error, model dispatcher is stopped")
+        return asyncio.run_coroutine_threadsafe(self.locate_gather(requests, priority, deadline), self.loop)
+
+    # Run the list of the locate requests (see submit_all()), blocks until all are done
+    def locate_all(self, requests, priority=DISPATCH_prio_location, deadline=None):
+        return self.submit_all(requests, priority, deadline).result()
+
+    # Check if the model interface can detect multiple objects in a single request
+    def has_multi(self):
+        return all([hasattr(ep.model, 'locate_multi') for ep in self.endpoints if not ep.fallback])
+
+    # Submit the multi-object locate request, a tuple w/ the locate_multi() arguments (image_data,
+    # obj_descs, image_desc), w/ the priority and the deadline. Returns the future for the list of
+    # the (res, loc_msg) tuples.
+    def submit_multi(self, request, priority=DISPATCH_prio_location, deadline=None):
+        if self.loop is None:
+            raise Exception("error, model dispatcher is stopped")
+        return asyncio.run_coroutine_threadsafe(self.call_model('locate_multi', request, priority, deadline), self.loop)
+
+    # Run the multi-object locate request (see submit_multi()), blocks until done
+    def locate_multi(self, request, priority=DISPATCH_prio_location, deadline=None):
+        return self.submit_multi(request, priority, deadline).result()
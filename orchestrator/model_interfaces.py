@@ -1,9 +1,98 @@
 # This file is for classes defining model interfaces for intracting w/ ML models
 # Note: the model interface here should be just that, the interface, the model shold be served elsewhere
+# Each interface has the blocking locate() method and its asyncio variant locate_async() (used by
+# the orchestrator's model dispatcher for keeping several requests in flight, see model_dispatcher.py).
+# The locate_multi() (and locate_multi_async()) methods detect a list of objects in a single request
+# asking for the JSON answer (w/ the structured output decoding where the backend supports it).
+# The prompts start w/ the system prompt and the image (same for all the objects and the requests
+# about the frame), the object specific text goes after them, so the servers caching the prompt
+# prefix (vLLM automatic prefix caching, Ollama context) do not have to re-encode the image. The
+# location is asked about in the follow-up turn of the detection conversation.
+# The async variants do not wait out the endpoint rate limits, they raise ModelRateLimited
+# for the dispatcher to pause the endpoint and retry the request (possibly elsewhere).
 import ollama
 import openai
 import time
 import os
+import json
+
+# System prompt shared by all the requests (part of the cached prompt prefix)
+LOCATOR_system_prompt = "You are a helpful, concise assistant for locating objects in an image"
+
+# Timeout for the blocking Ollama client requests (seconds), the dispatcher applies
+# its own adaptive timeouts to the async ones
+MODEL_ollama_timeout = 300
+
+# Default Ollama keep alive policy, keep the model loaded for as long as the server runs (it
+# is unloaded when the interface is destroyed, e.g. when the model settings change)
+MODEL_ollama_keep_alive = -1
+
+# The model endpoint rate limited the request, retry after retry_after seconds
+class ModelRateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"rate limited, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+# Get the delay to wait before retrying the request if the model endpoint rate limited it (None otherwise)
+def rate_limit_delay(e):
+    if getattr(e, 'code', None) == 'rate_limit_exceeded':
+        return float(e.response.headers.get('retry-after', 1))  # Default to 1 second if not specified
+    return None
+
+# JSON schema of the answer for the multi-object detection (the objects are referred to by their numbers)
+def gen_multi_schema(do_location):
+    item = {
+        "type": "object",
+        "properties": {"id": {"type": "integer"}, "present": {"type": "boolean"}},
+        "required": ["id", "present"],
+        "additionalProperties": False,
+    }
+    if do_location:
+        item["properties"]["location"] = {"type": "string"}
+        item["required"].append("location")
+    return {
+        "type": "object",
+        "properties": {"objects": {"type": "array", "items": item}},
+        "required": ["objects"],
+        "additionalProperties": False,
+    }
+
+# The question part of the multi-object detection prompt
+def gen_multi_question(obj_descs, image_desc, do_location):
+    question = f"For each of the numbered objects below tell if it is present in this image of the {image_desc}"
+    if do_location:
+        question += ", and if it is, describe its location in one sentence"
+    entry = '{"id": <number>, "present": true or false' + (', "location": "<location>"' if do_location else '') + '}'
+    question += f'. Answer in JSON with the "objects" list of {entry} entries, one for each object.\n'
+    question += "\n".join([f"{idx + 1}. {desc}" for idx, desc in enumerate(obj_descs)])
+    return question
+
+# Parse the multi-object detection answer, returns the list of the locate() result tuples for the objects
+def parse_multi_answer(answer, count, do_location):
+    try:
+        js = json.loads(answer[answer.find('{'):answer.rfind('}') + 1])
+        entries = js["objects"]
+    except Exception as e:
+        raise Exception(f"error, unable to parse the model answer \"{answer[:100]}\": {e}")
+    results = [(False, "") for idx in range(count)]
+    for o in entries:
+        try:
+            idx = int(o["id"]) - 1
+        except:
+            continue
+        if idx >= 0 and idx < count and o.get("present") is True:
+            results[idx] = (True, str(o.get("location", "")).lower().strip('\r\n\t ') if do_location else "")
+    return results
+
+# Follow-up chat completion request (the next turn of the conversation in the request)
+def gen_followup_request(request, answer, prompt, max_tokens):
+    request = dict(request)
+    request["messages"] = request["messages"] + [
+        {"role": "assistant", "content": answer},
+        {"role": "user", "content": [{"type": "text", "text": prompt}]},
+    ]
+    request["max_completion_tokens"] = max_tokens
+    return request
 
 # This interface is primarily for using in the UI auto-labeling of the collected images
 # for fine tuning. The UI pulls the OpenAI API key from the .env file OPENAI_API_KEY variable
@@ -14,6 +103,7 @@ class OpenAiGenericInterface:
         self.model_to_use = model_to_use
         cur_api_key = api_key if len(api_key) > 0 else os.getenv('OPENAI_API_KEY', 'NONE')
         self.client = openai.OpenAI(api_key=cur_api_key, base_url=api_base)
+        self.aclient = openai.AsyncOpenAI(api_key=cur_api_key, base_url=api_base, max_retries=0) # the dispatcher retries
         print(f"Using model: {self.model_to_use} with API base: {self.api_base}")
 
     def __del__(self):
@@ -38,42 +128,50 @@ class OpenAiGenericInterface:
         )
         return prompt
 
+    # Location question (the follow-up to the detection question)
     def gen_locate_prompt(self, obj_desc, image_desc):
         prompt = (
-            f"In one sentence describe the location of {obj_desc} in this image of the {image_desc}."
+            f"In one sentence describe the location of {obj_desc} in this image."
         )
         return prompt
 
+    # Chat completion request parameters for the prompt and image (image first for the prefix caching)
+    def gen_request(self, prompt, image_data, image_format, max_tokens):
+        return {
+            "model": self.model_to_use,
+            "temperature": 1.0,
+            "max_completion_tokens": max_tokens,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "image_url", "image_url": {"url": f"data:image/{image_format};base64,{image_data}"}},
+                        {"type": "text", "text": prompt},
+                    ],
+                }
+            ],
+        }
+
     def locate(self, image_data, obj_desc, image_desc, image_format='jpeg', do_location = True):
-        prompt = self.gen_detect_prompt(obj_desc, image_desc)
         ret = False
         msg = None
         
         # Detection phase
+        request = self.gen_request(self.gen_detect_prompt(obj_desc, image_desc), image_data, image_format, 2000)
         for attempt in range(3):  # Allow up to 3 retries
             try:
-                rsp = self.client.chat.completions.create(
-                    model=self.model_to_use,
-                    temperature=1.0,
-                    max_completion_tokens=2000,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": prompt},
-                                {"type": "image_url", "image_url": {"url": f"data:image/{image_format};base64,{image_data}"}},
-                            ],
-                        }
-                    ],
-                )
+                rsp = self.client.chat.completions.create(**request)
                 #print(f"Detection:\n-----------\n{rsp}\n------------\n")
-                if 'yes' not in rsp.choices[0].message.content.lower() or not do_location:
+                answer = rsp.choices[0].message.content
+                if 'yes' not in answer.lower():
                     msg = ""
                     return ret, msg
+                if not do_location:
+                    return True, ""
                 break  # Success, exit retry loop
             except openai.OpenAIError as e:
-                if e.code == 'rate_limit_exceeded':
-                    retry_after = float(e.response.headers.get('retry-after', 1))  # Default to 1 second if not specified
+                retry_after = rate_limit_delay(e)
+                if retry_after is not None:
                     print(f"Rate limit exceeded in detection phase. Retrying after {retry_after} seconds...")
                     time.sleep(retry_after)
                     continue
@@ -83,32 +181,19 @@ class OpenAiGenericInterface:
 
         ret = True
         msg = ""
-        prompt = self.gen_locate_prompt(obj_desc, image_desc)
         
-        # Location phase
+        # Location phase (follow-up turn reusing the cached image prefix)
+        request = gen_followup_request(request, answer, self.gen_locate_prompt(obj_desc, image_desc), 4000)
         for attempt in range(3):  # Allow up to 3 retries
             try:
-                rsp = self.client.chat.completions.create(
-                    model=self.model_to_use,
-                    temperature=1.0,
-                    max_completion_tokens=4000,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": prompt},
-                                {"type": "image_url", "image_url": {"url": f"data:image/{image_format};base64,{image_data}"}},
-                            ]
-                        }
-                    ],
-                )
+                rsp = self.client.chat.completions.create(**request)
                 if rsp:
                     #print(f"Location:\n-----------\n{rsp}\n------------\n")
                     msg = rsp.choices[0].message.content.lower().strip('\r\n\t ')
                 break  # Success, exit retry loop
             except openai.OpenAIError as e:
-                if e.code == 'rate_limit_exceeded':
-                    retry_after = float(e.response.headers.get('retry-after', 1))  # Default to 1 second if not specified
+                retry_after = rate_limit_delay(e)
+                if retry_after is not None:
                     print(f"Rate limit exceeded in location phase. Retrying after {retry_after} seconds...")
                     time.sleep(retry_after)
                     continue
@@ -118,11 +203,91 @@ class OpenAiGenericInterface:
 
         return ret, msg
 
+    # Async variant of locate() (raises ModelRateLimited instead of waiting out the rate limits)
+    async def locate_async(self, image_data, obj_desc, image_desc, image_format='jpeg', do_location = True):
+        ret = False
+        msg = None
+        
+        # Detection phase
+        request = self.gen_request(self.gen_detect_prompt(obj_desc, image_desc), image_data, image_format, 2000)
+        try:
+            rsp = await self.aclient.chat.completions.create(**request)
+            answer = rsp.choices[0].message.content
+            if 'yes' not in answer.lower():
+                msg = ""
+                return ret, msg
+            if not do_location:
+                return True, ""
+        except openai.OpenAIError as e:
+            retry_after = rate_limit_delay(e)
+            if retry_after is not None:
+                raise ModelRateLimited(retry_after)
+            print(f"Exception querying VLLM {self.model_to_use} in detection phase: {e}")
+            return ret, msg
+
+        ret = True
+        msg = ""
+        
+        # Location phase (follow-up turn reusing the cached image prefix)
+        request = gen_followup_request(request, answer, self.gen_locate_prompt(obj_desc, image_desc), 4000)
+        try:
+            rsp = await self.aclient.chat.completions.create(**request)
+            if rsp:
+                msg = rsp.choices[0].message.content.lower().strip('\r\n\t ')
+        except openai.OpenAIError as e:
+            retry_after = rate_limit_delay(e)
+            if retry_after is not None:
+                raise ModelRateLimited(retry_after)
+            print(f"Exception querying VLLM {self.model_to_use} in location phase: {e}")
+
+        return ret, msg
+
+    # Multi-object detection request (w/ the JSON schema response format)
+    def gen_multi_request(self, image_data, obj_descs, image_desc, image_format, do_location):
+        request = self.gen_request(gen_multi_question(obj_descs, image_desc, do_location), image_data, image_format, 4000)
+        request["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "detections", "schema": gen_multi_schema(do_location), "strict": True},
+        }
+        return request
+
+    # Detect the list of objects in a single request, returns the list of the locate() results
+    def locate_multi(self, image_data, obj_descs, image_desc, image_format='jpeg', do_location = True):
+        request = self.gen_multi_request(image_data, obj_descs, image_desc, image_format, do_location)
+        for attempt in range(3):  # Allow up to 3 retries
+            try:
+                rsp = self.client.chat.completions.create(**request)
+                return parse_multi_answer(rsp.choices[0].message.content, len(obj_descs), do_location)
+            except openai.OpenAIError as e:
+                retry_after = rate_limit_delay(e)
+                if retry_after is None:
+                    raise
+                print(f"Rate limit exceeded in multi-object detection. Retrying after {retry_after} seconds...")
+                time.sleep(retry_after)
+        raise Exception(f"error, {self.model_to_use} rate limit retries exhausted")
+
+    # Async variant of locate_multi()
+    async def locate_multi_async(self, image_data, obj_descs, image_desc, image_format='jpeg', do_location = True):
+        request = self.gen_multi_request(image_data, obj_descs, image_desc, image_format, do_location)
+        try:
+            rsp = await self.aclient.chat.completions.create(**request)
+        except openai.OpenAIError as e:
+            retry_after = rate_limit_delay(e)
+            if retry_after is None:
+                raise
+            raise ModelRateLimited(retry_after)
+        return parse_multi_answer(rsp.choices[0].message.content, len(obj_descs), do_location)
+
+    # Check the endpoint is up (raises if not), used by the dispatcher health probes
+    async def health_async(self):
+        await self.aclient.models.list()
+
 class VLLMLlama32Interface:
     def __init__(self, model_to_use='auto', api_key='', api_base='http://localhost:5050/v1'):
         self.api_base = api_base
         cur_api_key = api_key if len(api_key) > 0 else os.getenv('VLLM_API_KEY', 'NONE')
         self.client = openai.OpenAI(api_key=cur_api_key, base_url=api_base)
+        self.aclient = openai.AsyncOpenAI(api_key=cur_api_key, base_url=api_base, max_retries=0) # the dispatcher retries
         try:
             if model_to_use is None or model_to_use == 'auto':
                 models = self.client.models.list()
@@ -150,27 +315,60 @@ class VLLMLlama32Interface:
             "api_key": '',
         }
 
+    # The prompts are the complete model token text, passed in the custom "watchman" role message
+    # (the served chat template, see llm/watchman_sft_16bit_chat_tpl.jinja, uses its text as is).
+    # Prompt prefix w/ the system prompt and the image (same for all the prompts)
+    def gen_prompt_prefix(self):
+        return f"<|begin_of_text|><|start_header_id|>system<|end_header_id|>{LOCATOR_system_prompt}<|eot_id|>" + \
+                "<|start_header_id|>user<|end_header_id|><|image|>"
+
     def gen_detect_prompt(self, obj_desc, image_desc):
-        prompt = (
-            "<|begin_of_text|><|start_header_id|>system<|end_header_id|>"
-            "You are a helpful, concise assistant for locating objects in an image<|eot_id|>"
-            f"<|start_header_id|>user<|end_header_id|><|image|>Is there {obj_desc} "
-            f"in this image of the {image_desc}? Answer strictly Yes or No.<|eot_id|>"
-            "<|start_header_id|>assistant<|end_header_id|>"
-        )
+        prompt = self.gen_prompt_prefix() + \
+                f"Is there {obj_desc} in this image of the {image_desc}? Answer strictly Yes or No.<|eot_id|>" + \
+                "<|start_header_id|>assistant<|end_header_id|>"
         return prompt
 
+    # Location prompt (the follow-up turn appended to the detection conversation)
     def gen_locate_prompt(self, obj_desc, image_desc):
-        prompt = (
-            "<|begin_of_text|><|start_header_id|>system<|end_header_id|>"
-            "You are a helpful, concise assistant for locating objects in an image<|eot_id|>"
-            f"<|start_header_id|>user<|end_header_id|><|image|>What's the **Location** "
-            f"of {obj_desc} in this image of the {image_desc}? "
-            "Answer in one sentence describing the **Location**.<|eot_id|>"
-            "<|start_header_id|>assistant<|end_header_id|>"
-        )
+        prompt = "<|eot_id|><|start_header_id|>user<|end_header_id|>" + \
+                f"What's the **Location** of {obj_desc} in this image? " + \
+                "Answer in one sentence describing the **Location**.<|eot_id|>" + \
+                "<|start_header_id|>assistant<|end_header_id|>"
         return prompt
 
+    def gen_multi_prompt(self, obj_descs, image_desc, do_location):
+        prompt = self.gen_prompt_prefix() + \
+                f"{gen_multi_question(obj_descs, image_desc, do_location)}<|eot_id|>" + \
+                "<|start_header_id|>assistant<|end_header_id|>"
+        return prompt
+
+    # Chat completion request parameters for the prompt and image
+    def gen_request(self, prompt, image_data, image_format, max_tokens):
+        return {
+            "model": self.model_to_use,
+            "messages": [
+                {
+                    "role": "watchman",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {"type": "image_url", "image_url": {"url": f"data:image/{image_format};base64,{image_data}"}},
+                    ]
+                }
+            ],
+            "temperature": 0.0,
+            "max_completion_tokens": max_tokens,
+            "stop": '.',
+        }
+
+    # Follow-up request (the answer and the follow-up prompt appended to the request prompt text,
+    # so the prompt prefix w/ the image is the same as in the request)
+    def gen_followup_request(self, request, answer, prompt, max_tokens):
+        request = dict(request)
+        content = request["messages"][0]["content"]
+        request["messages"] = [{"role": "watchman", "content": [{"type": "text", "text": content[0]["text"] + answer + prompt}] + content[1:]}]
+        request["max_completion_tokens"] = max_tokens
+        return request
+
     def locate(self, image_data, obj_desc, image_desc, image_format='jpeg', do_location = True):
         prompt = self.gen_detect_prompt(obj_desc, image_desc)
         ret = False
@@ -181,24 +379,14 @@ class VLLMLlama32Interface:
                 for m in models:
                     self.model_to_use = m.id
                     break
-            rsp = self.client.chat.completions.create(
-                model=self.model_to_use,
-                messages=[
-                    {
-                        "role": "watchman",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {"type": "image_url", "image_url": {"url": f"data:image/{image_format};base64,{image_data}"}},
-                        ]
-                    }
-                ],
-                temperature=0.0,
-                max_completion_tokens=8,
-                stop='.',
-            )
-            if 'yes' not in rsp.choices[0].message.content.lower() or not do_location:
+            request = self.gen_request(prompt, image_data, image_format, 8)
+            rsp = self.client.chat.completions.create(**request)
+            answer = rsp.choices[0].message.content
+            if 'yes' not in answer.lower():
                 msg = ""
                 return ret, msg
+            if not do_location:
+                return True, ""
         except Exception as e:
             print(f"Exception querying VLLM {self.model_to_use}: {e}")
             return ret, msg
@@ -207,36 +395,96 @@ class VLLMLlama32Interface:
         msg = ""
         prompt = self.gen_locate_prompt(obj_desc, image_desc)
         try:
-            rsp = self.client.chat.completions.create(
-                model=self.model_to_use,
-                messages=[
-                    {
-                        "role": "watchman",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {"type": "image_url", "image_url": {"url": f"data:image/{image_format};base64,{image_data}"}},
-                        ]
-                    }
-                ],
-                temperature=0.0,
-                max_completion_tokens=32,
-                stop='.',
-            )
+            request = self.gen_followup_request(request, answer, prompt, 32)
+            rsp = self.client.chat.completions.create(**request)
+            if rsp:
+                msg = rsp.choices[0].message.content.lower().strip('\r\n\t ')
+        except:
+            pass
+        return ret, msg
+
+    # Async variant of locate()
+    async def locate_async(self, image_data, obj_desc, image_desc, image_format='jpeg', do_location = True):
+        prompt = self.gen_detect_prompt(obj_desc, image_desc)
+        ret = False
+        msg = None
+        try:
+            if self.model_to_use is None:
+                models = await self.aclient.models.list()
+                for m in models.data:
+                    self.model_to_use = m.id
+                    break
+            request = self.gen_request(prompt, image_data, image_format, 8)
+            rsp = await self.aclient.chat.completions.create(**request)
+            answer = rsp.choices[0].message.content
+            if 'yes' not in answer.lower():
+                msg = ""
+                return ret, msg
+            if not do_location:
+                return True, ""
+        except Exception as e:
+            print(f"Exception querying VLLM {self.model_to_use}: {e}")
+            return ret, msg
+
+        ret = True
+        msg = ""
+        prompt = self.gen_locate_prompt(obj_desc, image_desc)
+        try:
+            request = self.gen_followup_request(request, answer, prompt, 32)
+            rsp = await self.aclient.chat.completions.create(**request)
             if rsp:
                 msg = rsp.choices[0].message.content.lower().strip('\r\n\t ')
         except:
             pass
         return ret, msg
 
+    # Multi-object detection request (w/ the vLLM guided JSON decoding)
+    def gen_multi_request(self, image_data, obj_descs, image_desc, image_format, do_location):
+        prompt = self.gen_multi_prompt(obj_descs, image_desc, do_location)
+        request = self.gen_request(prompt, image_data, image_format, 64 * len(obj_descs) if do_location else 16 * len(obj_descs))
+        request["stop"] = None # the JSON answer has the dots in it
+        request["extra_body"] = {"guided_json": gen_multi_schema(do_location)}
+        return request
+
+    # Detect the list of objects in a single request, returns the list of the locate() results
+    def locate_multi(self, image_data, obj_descs, image_desc, image_format='jpeg', do_location = True):
+        if self.model_to_use is None:
+            for m in self.client.models.list():
+                self.model_to_use = m.id
+                break
+        rsp = self.client.chat.completions.create(**self.gen_multi_request(image_data, obj_descs, image_desc, image_format, do_location))
+        return parse_multi_answer(rsp.choices[0].message.content, len(obj_descs), do_location)
+
+    # Async variant of locate_multi()
+    async def locate_multi_async(self, image_data, obj_descs, image_desc, image_format='jpeg', do_location = True):
+        if self.model_to_use is None:
+            models = await self.aclient.models.list()
+            for m in models.data:
+                self.model_to_use = m.id
+                break
+        rsp = await self.aclient.chat.completions.create(**self.gen_multi_request(image_data, obj_descs, image_desc, image_format, do_location))
+        return parse_multi_answer(rsp.choices[0].message.content, len(obj_descs), do_location)
+
+    # Check the endpoint is up (raises if not), used by the dispatcher health probes
+    async def health_async(self):
+        await self.aclient.models.list()
+
 class OllamaLlama32Interface:
-    def __init__(self, model_to_use='llama3.2-vision:11b-instruct-fp16', api_base='http://localhost:11434'):
+    # keep_alive: how long the server keeps the model loaded after a request (seconds or duration
+    # string, e.g. "30m", negative - for as long as the server runs)
+    def __init__(self, model_to_use='llama3.2-vision:11b-instruct-fp16', api_base='http://localhost:11434', keep_alive=MODEL_ollama_keep_alive):
         self.model_to_use = model_to_use
+        self.api_base = api_base
+        self.keep_alive = keep_alive
         self.client = None
+        self.aclient = ollama.AsyncClient(host=api_base)
         try:
-            self.client = ollama.Client(host=api_base)
+            self.client = ollama.Client(host=api_base, timeout=MODEL_ollama_timeout)
+            # load the model (w/ the keep alive policy) so the first frames do not wait for it
             rsp = self.client.chat(
                 model = self.model_to_use,
                 messages = [],
+                keep_alive = self.keep_alive,
             )
             print(f"Model: {rsp.model}, result:{rsp.done_reason}")
         except Exception as e:
@@ -265,19 +513,32 @@ class OllamaLlama32Interface:
         return {
                "model_to_use": 'llama3.2-vision:11b-instruct-fp16',
                "api_base": 'http://localhost:11434',
+               "keep_alive": MODEL_ollama_keep_alive,
         }
 
+    # Prompt prefix w/ the system prompt and the image (same for all the prompts)
+    def gen_prompt_prefix(self):
+        return f"<|begin_of_text|><|start_header_id|>system<|end_header_id|>{LOCATOR_system_prompt}<|eot_id|>" + \
+                "<|start_header_id|>user<|end_header_id|><|image|>"
+
     # Detector prompt generator
     def gen_detect_prompt(self, obj_desc, image_desc):
-        prompt = "<|begin_of_text|><|start_header_id|>system<|end_header_id|>You are a helpful, concise assistant for locating objects in an image<|eot_id|>" + \
-                f"<|start_header_id|>user<|end_header_id|><|image|>Is there {obj_desc} in this image of the {image_desc}? Answer strictly Yes or No.<|eot_id|>" + \
+        prompt = self.gen_prompt_prefix() + \
+                f"Is there {obj_desc} in this image of the {image_desc}? Answer strictly Yes or No.<|eot_id|>" + \
                 "<|start_header_id|>assistant<|end_header_id|>"
         return prompt
 
-    # Location prompt generator
+    # Location prompt generator (the follow-up turn, the detection context is passed w/ it)
     def gen_locate_prompt(self, obj_desc, image_desc):
-        prompt = "<|begin_of_text|><|start_header_id|>system<|end_header_id|>You are a helpful, concise assistant for locating objects in an image<|eot_id|>" + \
-                f"<|start_header_id|>user<|end_header_id|><|image|>What's the **Location** of {obj_desc} in this image of the {image_desc}? Answer strictly with its **Location**.<|eot_id|>" + \
+        prompt = "<|eot_id|><|start_header_id|>user<|end_header_id|>" + \
+                f"What's the **Location** of {obj_desc} in this image? Answer strictly with its **Location**.<|eot_id|>" + \
+                "<|start_header_id|>assistant<|end_header_id|>"
+        return prompt
+
+    # Multi-object detection prompt generator
+    def gen_multi_prompt(self, obj_descs, image_desc, do_location):
+        prompt = self.gen_prompt_prefix() + \
+                f"{gen_multi_question(obj_descs, image_desc, do_location)}<|eot_id|>" + \
                 "<|start_header_id|>assistant<|end_header_id|>"
         return prompt
 
@@ -291,6 +552,7 @@ class OllamaLlama32Interface:
         prompt = self.gen_detect_prompt(obj_desc, image_desc)
         rsp = self.client.generate(
             model=self.model_to_use,
+            keep_alive=self.keep_alive,
             prompt=prompt,
             images=[image_data],
             options={'temperature': 0.0, "template": None},
@@ -300,20 +562,88 @@ class OllamaLlama32Interface:
         if not rsp.done:
             return ret, msg
         msg = ""
-        if not "yes" in rsp.response.lower() or not do_location:
+        if not "yes" in rsp.response.lower():
             return ret, msg
+        if not do_location:
+            return True, msg
         prompt = self.gen_locate_prompt(obj_desc, image_desc)
         rsp = self.client.generate(
             model=self.model_to_use,
+            keep_alive=self.keep_alive,
+            prompt=prompt,
+            context=rsp.context,
+            options={'temperature': 0.0, "template": None},
+        )
+        if rsp.done:
+            ret = True
+            msg = rsp.response.lower().strip('\r\n\t ')
+        return ret, msg
+
+    # Async variant of locate()
+    async def locate_async(self, image_data, obj_desc, image_desc, do_location = True):
+        prompt = self.gen_detect_prompt(obj_desc, image_desc)
+        rsp = await self.aclient.generate(
+            model=self.model_to_use,
+            keep_alive=self.keep_alive,
             prompt=prompt,
             images=[image_data],
             options={'temperature': 0.0, "template": None},
         )
+        ret = False
+        msg = None
+        if not rsp.done:
+            return ret, msg
+        msg = ""
+        if not "yes" in rsp.response.lower():
+            return ret, msg
+        if not do_location:
+            return True, msg
+        prompt = self.gen_locate_prompt(obj_desc, image_desc)
+        rsp = await self.aclient.generate(
+            model=self.model_to_use,
+            keep_alive=self.keep_alive,
+            prompt=prompt,
+            context=rsp.context,
+            options={'temperature': 0.0, "template": None},
+        )
         if rsp.done:
             ret = True
             msg = rsp.response.lower().strip('\r\n\t ')
         return ret, msg
 
+    # Detect the list of objects in a single request (w/ the structured output format),
+    # returns the list of the locate() results
+    def locate_multi(self, image_data, obj_descs, image_desc, do_location = True):
+        rsp = self.client.generate(
+            model=self.model_to_use,
+            keep_alive=self.keep_alive,
+            prompt=self.gen_multi_prompt(obj_descs, image_desc, do_location),
+            images=[image_data],
+            format=gen_multi_schema(do_location),
+            options={'temperature': 0.0, "template": None},
+        )
+        if not rsp.done:
+            raise Exception(f"error, {self.model_to_use} generation is not done: {rsp.done_reason}")
+        return parse_multi_answer(rsp.response, len(obj_descs), do_location)
+
+    # Async variant of locate_multi()
+    async def locate_multi_async(self, image_data, obj_descs, image_desc, do_location = True):
+        rsp = await self.aclient.generate(
+            model=self.model_to_use,
+            keep_alive=self.keep_alive,
+            prompt=self.gen_multi_prompt(obj_descs, image_desc, do_location),
+            images=[image_data],
+            format=gen_multi_schema(do_location),
+            options={'temperature': 0.0, "template": None},
+        )
+        if not rsp.done:
+            raise Exception(f"error, {self.model_to_use} generation is not done: {rsp.done_reason}")
+        return parse_multi_answer(rsp.response, len(obj_descs), do_location)
+
+    # Check the endpoint is up (raises if not), used by the dispatcher health probes
+    async def health_async(self):
+        await self.aclient.list()
+
 class OllamaSimpleInterface(OllamaLlama32Interface):
     @staticmethod
     def model_name():
@@ -322,6 +652,15 @@ class OllamaSimpleInterface(OllamaLlama32Interface):
     def locate(self, image_data, obj_desc, image_desc, do_location=False):
         return super().locate(image_data, obj_desc, image_desc, do_location)
 
+    async def locate_async(self, image_data, obj_desc, image_desc, do_location=False):
+        return await super().locate_async(image_data, obj_desc, image_desc, do_location)
+
+    def locate_multi(self, image_data, obj_descs, image_desc, do_location=False):
+        return super().locate_multi(image_data, obj_descs, image_desc, do_location)
+
+    async def locate_multi_async(self, image_data, obj_descs, image_desc, do_location=False):
+        return await super().locate_multi_async(image_data, obj_descs, image_desc, do_location)
+
 # add your class name and class object mappping here
 MODELS = {
     OllamaSimpleInterface.model_name(): OllamaSimpleInterface,
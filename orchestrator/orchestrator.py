@@ -5,8 +5,19 @@
 # the verbal message is generated from the config template
 # and saved along w/ the other service event info in files
 # under the events folder.
-# For now, it's single threaded, but for performance it has
-# to run a thread or fork for each image source channel.
+# Each image source channel is handled by its own worker thread,
+# the main loop only reads the new frames and hands them over to
+# the channel workers (the latest frame wins if a worker is busy),
+# so a slow channel does not delay the others.
+# The detection results are cached for the look-alike frames of the
+# channel (see detect_cache.py), so the static scenes do not cost the
+# model calls on every frame. The objects can have a cheap local prefilter
+# (see prefilter.py), the model is asked about them only when it fires.
+# The service events are aged out by the deadline scheduler (see event_scheduler.py),
+# so the stale events are removed on time even if no frames come from the channel.
+# The main loop is woken up by the file change (inotify) events: the new
+# frames, the service and channel on/off toggles and the config changes (see
+# OrchWakeup). It polls if the files can't be watched.
 import os
 import sys
 import time
@@ -14,15 +25,31 @@ import re
 import json
 import base64
 import shutil
+import threading
+import concurrent.futures
+import cv2
+import numpy as np
 from pathlib import Path
 from dotenv import load_dotenv
 from jsonschema import validate
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
 
 # Pull in shared variables (file names, JSON object names, ...) and the the model interface classes
 sys.path.append(os.path.dirname(__file__))
 sys.path.append(os.path.abspath("."))
 from shared_settings import *
+from frame_ring import *
+from frame_hash import *
 from model_interfaces import *
+from model_dispatcher import *
+from detect_cache import *
+from prefilter import *
+from event_scheduler import *
 
 # Figure the path to the data folders depending on where we run
 DATA_DIR = ''
@@ -44,8 +71,33 @@ MODEL_CONFIG = f"{CFGDIR}/{CFG_model}"
 CFG = {}
 # Channel runners dictionary (instances of ChannelOrchestrator, keyed by channel ID)
 CRUN = {}
+# Frame ring readers of the channel runners stopped by the config change, handed over to the
+# new channel runners, so they continue after the last frame seen (keyed by channel ID)
+RING_READERS = {}
 # Model interface class instance for communicating w/ the configured ML model
 MODEL = None
+# Model request dispatcher (keeps several requests in flight to the model endpoint)
+DISPATCHER = None
+# Detection result cache (flushed when the model is re-created)
+DETECT_CACHE = None
+# Deadline scheduler ageing out the service events
+SCHEDULER = None
+# How often to report the per-channel frame age metrics (seconds)
+ORCH_metrics_int = 60
+# How long to wait for a channel worker to finish when stopping it (seconds)
+ORCH_worker_stop_timeout = 5
+# How often to do the full main loop pass (config, channels, on/off toggles) when woken
+# up by the file change events, in case some are missed (seconds)
+ORCH_rescan_int = 5
+# When the frame age metrics were last reported
+METRICS_TIME = time.time()
+# Config keys changing which requires re-creating the model interfaces (reloading the model)
+MODEL_iface_keys = [CFG_obj_model_key, CFG_obj_model_name_key, CFG_obj_model_url_key, CFG_obj_model_tkn_key,
+                    CFG_obj_model_keep_alive_key, CFG_obj_model_fb_key, CFG_obj_model_fb_name_key,
+                    CFG_obj_model_fb_url_key, CFG_obj_model_fb_tkn_key]
+# Config keys of the model dispatcher and the detection cache (applied w/o reloading the model)
+MODEL_dispatch_keys = [CFG_obj_model_inflight_key, CFG_obj_model_queue_key]
+MODEL_cache_keys = [CFG_obj_model_cache_ttl_key, CFG_obj_model_cache_dist_key, CFG_obj_model_cache_size_key]
 
 # Write json to a file using atomic rename
 def json_atomic_write(js, json_tmp_file_pname, json_file_pname):
@@ -62,16 +114,6 @@ def json_atomic_write(js, json_tmp_file_pname, json_file_pname):
         print(f"{sys._getframe().f_code.co_name}: unable to write {json_tmp_file_pname}")
     return res
 
-# Gets the number of seconds since the file was last modified (-1 if error)
-def get_modified_time_ago(filepath):
-    try: 
-        modification_time = os.path.getmtime(filepath)
-        current_time = time.time()
-        time_difference = current_time - modification_time
-    except:
-        time_difference = -1
-    return time_difference
-
 # Check config, returns None if nothing new, or new config dictionary
 # if the config was updated and has to be re-applied.
 def read_config():
@@ -138,88 +180,423 @@ def read_image_json(img_json_fname):
         return None
     return js
 
+# Create the model interface instances, one for each endpoint URL (the URL can be the list of the
+# endpoints to balance the requests across, or None for the interface default)
+def new_models(model_if, params, urls):
+    models = []
+    for url in (urls if isinstance(urls, list) else [urls]):
+        if url is not None:
+            params['api_base'] = url
+        models.append(MODELS[model_if](**params))
+    return models
+
+# Check if any of the config keys differ between the old and the new config
+def cfg_changed(old_cfg, new_cfg, keys):
+    return any([old_cfg.get(k) != new_cfg.get(k) for k in keys])
+
+# Get the model dispatcher parameters (max requests in flight and waiting) from the config
+def dispatch_params():
+    try:
+        inflight = int(CFG[CFG_obj_model_inflight_key])
+    except ValueError:
+        print(f"{sys._getframe().f_code.co_name}: cannot convert {CFG_obj_model_inflight_key} to int \"{CFG[CFG_obj_model_inflight_key]}\"")
+        inflight = CFG_DEF_model_inflight
+    try:
+        max_queue = int(CFG[CFG_obj_model_queue_key])
+    except ValueError:
+        print(f"{sys._getframe().f_code.co_name}: cannot convert {CFG_obj_model_queue_key} to int \"{CFG[CFG_obj_model_queue_key]}\"")
+        max_queue = CFG_DEF_model_queue
+    return inflight, max_queue
+
+# Create the model interfaces and the dispatcher for them according to the config (the old
+# ones must be gone, so the model servers unload the old model first)
+def create_model():
+    global MODEL
+    global DISPATCHER
+    params = {}
+    if CFG_obj_model_name_key in CFG.keys():
+        params['model_to_use'] = CFG[CFG_obj_model_name_key]
+    if CFG_obj_model_tkn_key in CFG.keys():
+        params['api_key'] = CFG[CFG_obj_model_tkn_key]
+    if CFG_obj_model_keep_alive_key in CFG.keys() and 'keep_alive' in MODELS[CFG[CFG_obj_model_key]].model_parameters():
+        params['keep_alive'] = CFG[CFG_obj_model_keep_alive_key]
+    models = new_models(CFG[CFG_obj_model_key], params, CFG.get(CFG_obj_model_url_key))
+    MODEL = models[0]
+    fallback = None
+    if CFG.get(CFG_obj_model_fb_key) in MODELS.keys():
+        params = {}
+        if CFG_obj_model_fb_name_key in CFG.keys():
+            params['model_to_use'] = CFG[CFG_obj_model_fb_name_key]
+        if CFG_obj_model_fb_tkn_key in CFG.keys():
+            params['api_key'] = CFG[CFG_obj_model_fb_tkn_key]
+        try:
+            fallback = new_models(CFG[CFG_obj_model_fb_key], params, CFG.get(CFG_obj_model_fb_url_key))
+        except Exception as e:
+            print(f"{sys._getframe().f_code.co_name}: error creating the fallback model interface: {e}")
+    elif CFG_obj_model_fb_key in CFG.keys():
+        print(f"{sys._getframe().f_code.co_name}: no \"{CFG[CFG_obj_model_fb_key]}\" fallback model interface found")
+    inflight, max_queue = dispatch_params()
+    DISPATCHER = ModelDispatcher(models, inflight, max_queue, fallback)
+
+# Get the service name and the file kind from the object events folder file name (None if not a service file)
+def parse_svc_file_name(fname):
+    m = re.match(r'^(.+?)(\.json|\.jpg|\.off|_done\.json|_cap_negative\.flag)(\.tmp)?$', fname)
+    return (m.group(1), m.group(2)) if m is not None and fname != EVT_obj_file_name else None
+
+# Service config w/o the keys that do not make its events stale (the default off state only
+# applies to the new folders, the skipped channels are handled for each frame)
+def svc_event_cfg(s):
+    return {k: v for k, v in s.items() if k not in [CFG_osvc_def_off_key, CFG_osvc_skip_chan_key]}
+
+# Bring the events folder in line w/ the new objects config (old_objects is the previous objects
+# config, None on start). Only the stale files are removed: the folders of the objects no longer
+# configured, the files of the services gone, and the events of the changed objects and services
+# (all the events on start). The .off service flags and the alert mute state (alert_done.json) of
+# the remaining services are kept. The services added to the existing folders get their .off flags
+# if configured to be off by default. The obj.json files are updated by the channel workers.
+def reconcile_events(old_objects, new_objects):
+    old = {o[CFG_obj_id_key]: o for o in old_objects} if old_objects is not None else {}
+    new = {o[CFG_obj_id_key]: o for o in new_objects}
+    try:
+        chans = [ch for ch in os.listdir(EVTDIR) if not ch.startswith('.')]
+    except Exception as e:
+        print(f"{sys._getframe().f_code.co_name}: unable to list {EVTDIR}: {e}")
+        return
+    for ch in chans:
+        try:
+            obj_ids = [obj_id for obj_id in os.listdir(f"{EVTDIR}/{ch}") if not obj_id.startswith('.')]
+        except:
+            continue
+        for obj_id in obj_ids:
+            obj_dir = f"{EVTDIR}/{ch}/{obj_id}"
+            o = new.get(obj_id)
+            if o is None:
+                shutil.rmtree(obj_dir, ignore_errors=True)
+                continue
+            old_o = old.get(obj_id)
+            if old_o == o:
+                continue
+            svcs = {s[CFG_osvc_name_key]: s for s in o[CFG_obj_svcs_key]}
+            old_svcs = {s[CFG_osvc_name_key]: s for s in old_o[CFG_obj_svcs_key]} if old_o is not None else {}
+            obj_changed = old_o is None or old_o[CFG_obj_names_key] != o[CFG_obj_names_key] or \
+                          old_o[CFG_obj_desc_key] != o[CFG_obj_desc_key]
+            try:
+                files = os.listdir(obj_dir)
+            except:
+                continue
+            for fname in files:
+                svc_file = parse_svc_file_name(fname)
+                if svc_file is None:
+                    continue
+                svc, kind = svc_file
+                if svc in svcs.keys():
+                    if kind not in ['.json', '.jpg']:
+                        continue
+                    if not obj_changed and svc in old_svcs.keys() and svc_event_cfg(old_svcs[svc]) == svc_event_cfg(svcs[svc]):
+                        continue
+                try: os.unlink(f"{obj_dir}/{fname}")
+                except: pass
+            if old_o is None:
+                continue
+            for svc, s in svcs.items():
+                if svc not in old_svcs.keys() and s[CFG_osvc_def_off_key]:
+                    try: open(f"{obj_dir}/{svc}.off", 'w').close()
+                    except: pass
+
 # Read and apply objects of iterest config if new or changed. Do nothing and return False if no changes.
-# If config changed, re-instantiate the ML model interface, remove all the existent entries in the events
-# folder, and destroy all the ChannelOrchestrator instances, then update the global CFG dictionary and
-# return True.
+# If config changed, destroy all the ChannelOrchestrator instances (keeping their frame ring readers
+# for the new ones, so the last frame seen is not processed again), update the global CFG dictionary,
+# reconcile the events folder w/ it (see reconcile_events()) and return True. The ML model interfaces
+# are only re-instantiated if the model settings changed (the objects config changes do not reload
+# the model).
 def read_and_apply_config():
     global CFG
     global CRUN
+    global RING_READERS
     global MODEL
     global MODELS
+    global DISPATCHER
+    global DETECT_CACHE
 
     new_cfg = read_config()
     if not new_cfg:
         return False
-    for c_runner in CRUN:
-        del c_runner # TBD: channel runners should run in individual threads or processes
+    for c_runner in CRUN.values():
+        c_runner.stop()
+    RING_READERS = {chan: c_runner.ring for chan, c_runner in CRUN.items()}
     CRUN = {}
+    old_cfg = CFG
     CFG = new_cfg
 
-    # Remove all the old events folder (if there) and create a new one for the new config
-    shutil.rmtree(EVTDIR, ignore_errors=True)
-    os.makedirs(EVTDIR, exist_ok=True)
-
     # Some sanity checking and defaults handling for top level config keys
     if not CFG_obj_model_key in CFG.keys():
         CFG[CFG_obj_model_key] = 'ollama-simple'
-    if not MODEL is None:
-        del MODEL
-    if CFG[CFG_obj_model_key] in MODELS.keys():
-        params = {}
-        if CFG_obj_model_name_key in CFG.keys():
-            params['model_to_use'] = CFG[CFG_obj_model_name_key]
-        if CFG_obj_model_url_key in CFG.keys():
-            params['api_base'] = CFG[CFG_obj_model_url_key]
-        if CFG_obj_model_tkn_key in CFG.keys():
-            params['api_key'] = CFG[CFG_obj_model_tkn_key]
-        MODEL = MODELS[CFG[CFG_obj_model_key]](**params)
-    else: # no matching model interface, can't do anything
+    if not CFG_obj_model_min_q_key in CFG.keys():
+        CFG[CFG_obj_model_min_q_key] = 0.0
+    if not CFG_obj_model_inflight_key in CFG.keys():
+        CFG[CFG_obj_model_inflight_key] = CFG_DEF_model_inflight
+    if not CFG_obj_model_multi_key in CFG.keys():
+        CFG[CFG_obj_model_multi_key] = False
+    if not CFG_obj_model_queue_key in CFG.keys():
+        CFG[CFG_obj_model_queue_key] = CFG_DEF_model_queue
+    if not CFG_obj_model_deadline_key in CFG.keys():
+        CFG[CFG_obj_model_deadline_key] = CFG_DEF_model_deadline
+    if not CFG_obj_model_cache_ttl_key in CFG.keys():
+        CFG[CFG_obj_model_cache_ttl_key] = CFG_DEF_model_cache_ttl
+    if not CFG_obj_model_cache_dist_key in CFG.keys():
+        CFG[CFG_obj_model_cache_dist_key] = CFG_DEF_model_cache_dist
+    if not CFG_obj_model_cache_size_key in CFG.keys():
+        CFG[CFG_obj_model_cache_size_key] = CFG_DEF_model_cache_size
+    if not CFG[CFG_obj_model_key] in MODELS.keys(): # no matching model interface, can't do anything
         print(f"{sys._getframe().f_code.co_name}: no \"{CFG[CFG_obj_model_key]}\" model interface found")
+        if not DISPATCHER is None:
+            DISPATCHER.stop()
+        DISPATCHER = None
+        MODEL = None
+        DETECT_CACHE = None
         CFG[CFG_obj_objects_key] = []
-        return True
+    else:
+        if DISPATCHER is None or cfg_changed(old_cfg, CFG, MODEL_iface_keys):
+            if not DISPATCHER is None:
+                DISPATCHER.stop()
+            DISPATCHER = None
+            MODEL = None
+            DETECT_CACHE = None
+            create_model()
+        elif cfg_changed(old_cfg, CFG, MODEL_dispatch_keys):
+            DISPATCHER.reconfigure(*dispatch_params())
+        if DETECT_CACHE is None or cfg_changed(old_cfg, CFG, MODEL_cache_keys):
+            DETECT_CACHE = None
+            try:
+                DETECT_CACHE = DetectCache(float(CFG[CFG_obj_model_cache_ttl_key]), int(CFG[CFG_obj_model_cache_dist_key]),
+                                           int(CFG[CFG_obj_model_cache_size_key]))
+            except ValueError as e:
+                print(f"{sys._getframe().f_code.co_name}: bad detection cache config, caching is off: {e}")
 
-    if not CFG_obj_objects_key in CFG.keys() or not isinstance(CFG[CFG_obj_objects_key], list):
-        CFG[CFG_obj_objects_key] = []
-        return True
-    
-    orig_objects = CFG[CFG_obj_objects_key]
-    objects = []
-    for idx, o in enumerate(orig_objects):
-        try:
-            validate(instance=o, schema=CFG_obj_schema)
-            objects.append(o)
-        except Exception as e:
-            print(f"{sys._getframe().f_code.co_name}: error in JSON for object {idx}: {e}")
-    CFG[CFG_obj_objects_key] = objects
+        if not CFG_obj_objects_key in CFG.keys() or not isinstance(CFG[CFG_obj_objects_key], list):
+            CFG[CFG_obj_objects_key] = []
+        else:
+            orig_objects = CFG[CFG_obj_objects_key]
+            objects = []
+            for idx, o in enumerate(orig_objects):
+                try:
+                    validate(instance=o, schema=CFG_obj_schema)
+                    objects.append(o)
+                except Exception as e:
+                    print(f"{sys._getframe().f_code.co_name}: error in JSON for object {idx}: {e}")
+            CFG[CFG_obj_objects_key] = objects
+
+    # Keep the events folder state (.off flags, alert mute times) that the config change did not make stale
+    os.makedirs(EVTDIR, exist_ok=True)
+    reconcile_events(old_cfg.get(CFG_obj_objects_key) if len(old_cfg) > 0 else None, CFG[CFG_obj_objects_key])
     return True
 
+# Channel frame read from the imager (handed over to the channel worker)
+class ChannelFrame:
+    def __init__(self, chan_id, chan_name, img_data, img_time, img_iter, img_meta, img_base64 = None):
+        self.chan_id = chan_id
+        self.chan_name = chan_name
+        self.img_data = img_data
+        self.img_base64 = base64.b64encode(img_data).decode() if img_base64 is None else img_base64
+        self.img_time = img_time
+        self.img_iter = img_iter
+        self.img_meta = img_meta # change score, motion boxes, quality, ...
+
 class ChannelOrchestrator:
-    def __init__(self, chan):
+    def __init__(self, chan, ring = None):
         self.chan = chan
+        self.ring = FrameRingReader(f"{IMGDIR}/{chan}/{IMG_ring_file_name}") if ring is None else ring
+        self.low_quality = False # True while skipping the frames below the quality floor
+        self.cond = threading.Condition()
+        self.frame = None    # the latest frame waiting for the worker (queue of depth 1)
+        self.running = True
+        # frame age metrics (for the current reporting interval)
+        self.frames_in = 0       # frames read from the imager
+        self.frames_dropped = 0  # frames replaced by the newer ones before the worker got to them
+        self.frames_done = 0     # frames processed by the worker
+        self.age_sum = 0.0       # sum of the frame ages (capture to done, seconds)
+        self.age_max = 0.0       # max frame age (seconds)
+        self.wait_sum = 0.0      # sum of the time frames waited for the worker (seconds)
+        self.cache_hits = 0      # object detections answered from the detection cache
+        self.cache_misses = 0    # object detections the model was asked about
+        self.prefilter_skips = 0 # object detections skipped because the prefilter did not fire
+        self.superseded = 0      # model requests cancelled because a newer frame was waiting
+        self.prefilters = {}     # object prefilters (tuples w/ the object config and the prefilter), keyed by object ID
+        self.prefilter_time = {} # when the model was last asked about the object w/ the prefilter, keyed by object ID
+        self.pf_img = None       # the current frame decoded for the prefilters (when needed)
+        # The events folder state of the channel is kept in memory, so the frames are processed w/o
+        # probing the files. It is loaded on start, updated by the worker as it writes the files and
+        # the service .off flags are reloaded on their change notifications (see load_off_state()).
+        # The event files are aged out by the scheduler (the worker writes them, the scheduler and
+        # the main loop remove, the files and evt_time are updated holding evt_lock).
+        self.obj_files = {}      # content of the object json files known to be up to date, keyed by object ID
+        self.svc_cfg = {}        # the service configs, keyed by (object ID, service)
+        self.svc_off = set()     # (object ID, service) tuples of the services turned off (w/ the .off files)
+        self.evt_time = {}       # when the service event files were written, keyed by (object ID, service)
+        self.evt_data = {}       # content (w/o the time) of the service event files written, keyed by (object ID, service)
+        self.evt_lock = threading.Lock()
+        self.img_off = False     # True if the imager channel is turned off (w/ the image.off file)
+        self.load_state()
+        self.worker = threading.Thread(target=self.worker_loop, name=f"orch-{chan}", daemon=True)
+        self.worker.start()
+
+    # Load the channel events folder state (on start, before the worker is running)
+    def load_state(self):
+        self.img_off = os.path.exists(f"{IMGDIR}/{self.chan}/{IMG_off_file_name}")
+        for o in CFG[CFG_obj_objects_key]:
+            obj_id = o[CFG_obj_id_key]
+            obj_dir = f"{EVTDIR}/{self.chan}/{obj_id}"
+            try:
+                with open(f"{obj_dir}/{EVT_obj_file_name}", "r") as f:
+                    self.obj_files[obj_id] = json.load(f)
+            except FileNotFoundError:
+                pass
+            except:
+                self.obj_files[obj_id] = None # the folder is there, but the file has to be rewritten
+            for s in o[CFG_obj_svcs_key]:
+                self.svc_cfg[(obj_id, s[CFG_osvc_name_key])] = s
+                try: evt_time = os.path.getmtime(f"{obj_dir}/{s[CFG_osvc_name_key]}.json")
+                except: continue
+                with self.evt_lock:
+                    self.event_written(obj_id, s[CFG_osvc_name_key], evt_time)
+        self.load_off_state()
+
+    # Reload the service .off flags of the channel (called from the main loop when they change)
+    def load_off_state(self):
+        svc_off = set()
+        for o in CFG[CFG_obj_objects_key]:
+            obj_id = o[CFG_obj_id_key]
+            try: files = os.listdir(f"{EVTDIR}/{self.chan}/{obj_id}")
+            except: continue
+            svc_off.update([(obj_id, f[:-len('.off')]) for f in files if f.endswith('.off')])
+        with self.cond:
+            self.svc_off = svc_off
+        # the events of the services turned off (or skipped on the channel) go right away
+        with self.evt_lock:
+            keys = list(self.evt_time.keys())
+        for obj_id, svc in keys:
+            if (obj_id, svc) in svc_off or self.chan in self.svc_cfg[(obj_id, svc)].get(CFG_osvc_skip_chan_key, []):
+                self.remove_event(obj_id, svc)
 
-    # Read image data from the channel, return True if successful
+    # Record the service event file written at evt_time and schedule its age out (evt_lock must be held)
+    def event_written(self, obj_id, svc, evt_time):
+        self.evt_time[(obj_id, svc)] = evt_time
+        SCHEDULER.schedule((self.chan, obj_id, svc), evt_time + self.svc_cfg[(obj_id, svc)][CFG_osvc_age_out_key],
+                           lambda: self.remove_event(obj_id, svc, evt_time))
+
+    # Remove the service event file (if it was written). If evt_time is given (the age out), the file
+    # is only removed if it was not rewritten since.
+    def remove_event(self, obj_id, svc, evt_time=None):
+        with self.evt_lock:
+            cur_evt_time = self.evt_time.get((obj_id, svc))
+            if cur_evt_time is None or (evt_time is not None and cur_evt_time != evt_time):
+                return
+            del self.evt_time[(obj_id, svc)]
+            self.evt_data.pop((obj_id, svc), None)
+            SCHEDULER.cancel((self.chan, obj_id, svc))
+            try: os.unlink(f"{EVTDIR}/{self.chan}/{obj_id}/{svc}.json")
+            except: pass
+
+    # Stop the channel worker. The worker stuck in a model call is abandoned (it won't
+    # write anything after it returns).
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.frame = None
+            self.cond.notify_all()
+        if self.worker is not threading.current_thread():
+            self.worker.join(timeout=ORCH_worker_stop_timeout)
+        # the next channel orchestrator reloads the events and their age out
+        with self.evt_lock:
+            for obj_id, svc in self.evt_time.keys():
+                SCHEDULER.cancel((self.chan, obj_id, svc))
+
+    # Hand the frame over to the worker, replacing the one not yet picked up
+    def put_frame(self, frame):
+        with self.cond:
+            if self.frame is not None:
+                self.frames_dropped += 1
+            self.frame = frame
+            self.frames_in += 1
+            self.frame_put_time = time.time()
+            self.cond.notify_all()
+
+    # Channel worker thread, processes the latest frame when available
+    def worker_loop(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.frame is not None or not self.running)
+                if not self.running:
+                    return
+                frame = self.frame
+                self.frame = None
+                wait_time = time.time() - self.frame_put_time
+            try:
+                self.process_frame(frame)
+            except Exception as e:
+                print(f"{sys._getframe().f_code.co_name}: channel {self.chan}, unexpected error: {e}")
+            with self.cond:
+                age = time.time() - frame.img_time
+                self.frames_done += 1
+                self.age_sum += age
+                self.age_max = max(self.age_max, age)
+                self.wait_sum += wait_time
+
+    # Report the frame age metrics for the interval and reset them
+    def report_metrics(self, interval):
+        with self.cond:
+            done = self.frames_done
+            age_avg = self.age_sum / done if done > 0 else 0.0
+            wait_avg = self.wait_sum / done if done > 0 else 0.0
+            print(f"Channel {self.chan} in {int(interval)}sec: frames {self.frames_in} in, {done} done, {self.frames_dropped} dropped, "
+                  f"age avg {age_avg:.2f}sec, max {self.age_max:.2f}sec, queue wait avg {wait_avg:.2f}sec, "
+                  f"cache {self.cache_hits} hits, {self.cache_misses} misses, prefilter {self.prefilter_skips} skipped, "
+                  f"{self.superseded} model jobs superseded")
+            self.frames_in = self.frames_dropped = self.frames_done = 0
+            self.cache_hits = self.cache_misses = self.prefilter_skips = self.superseded = 0
+            self.age_sum = self.age_max = self.wait_sum = 0.0
+
+    # Read the latest image from the channel frame ring, return ChannelFrame or None
+    def read_image_ring(self):
+        frame = self.ring.read_next()
+        if frame is None:
+            return None
+        try:
+            chan_id = frame.meta[IMG_chan_key]
+            if not chan_id == self.chan:
+                print(f"{sys._getframe().f_code.co_name}: error, channel folder name and ID mismatch: id: {chan_id}, chan dir: {self.chan}")
+            chan_name = frame.meta[IMG_name_key]
+        except:
+            print(f"{sys._getframe().f_code.co_name}: malformed frame metadata in {self.ring.path}")
+            return None
+        # the frame data is used long after the imager might reuse the ring slot, so take a copy
+        img_data = frame.copy_data()
+        if img_data is None:
+            return None
+        return ChannelFrame(chan_id, chan_name, img_data, frame.time, frame.iter, frame.meta)
+
+    # Read image data from the channel, return ChannelFrame or None if nothing new
     def read_image_data(self):
         chan = self.chan
+        frame = self.read_image_ring()
+        if frame is not None:
+            return frame
         chan_dir = f"{IMGDIR}/{chan}"
         img_json_fname = f"{chan_dir}/{IMG_json_file_name}"
         image_js = read_image_json(img_json_fname)
         if image_js is None:
-            return False
+            return None
         # Get image data
         try:
-            self.chan_id = image_js[IMG_chan_key]
-            if not self.chan_id == self.chan:
-                print(f"{sys._getframe().f_code.co_name}: error, channel folder name and ID mismatch: id: {self.chan_id}, chan dir: {self.chan}")
-            self.chan_name = image_js[IMG_name_key]
-            self.img_base64 = image_js[IMG_data_key]
-            self.img_data = base64.b64decode(image_js[IMG_data_key])
-            self.img_time = image_js[IMG_time_key]
-            self.img_iter = image_js[IMG_iter_key]
+            chan_id = image_js[IMG_chan_key]
+            if not chan_id == self.chan:
+                print(f"{sys._getframe().f_code.co_name}: error, channel folder name and ID mismatch: id: {chan_id}, chan dir: {self.chan}")
+            img_meta = {k: v for k, v in image_js.items() if k != IMG_data_key}
+            return ChannelFrame(chan_id, image_js[IMG_name_key], base64.b64decode(image_js[IMG_data_key]),
+                                image_js[IMG_time_key], image_js[IMG_iter_key], img_meta, image_js[IMG_data_key])
         except:
             print(f"{sys._getframe().f_code.co_name}: malformed {img_json_fname}")
-            return False
-        return True
+            return None
 
     # Handle capturing images and results into a dataset for fine-tuning.
     # The positives go straight to the dataset folder.
@@ -288,36 +665,161 @@ class ChannelOrchestrator:
     def loop_run_update(self, obj_js, e_list):
         obj_id = obj_js[EVT_obj_id_key]
         obj_dir =  f"{EVTDIR}/{self.chan}/{obj_id}"
+        img_file = None # the frame image written for the object
         for e in e_list:
             # For debugging, and fine tuning it might be useful to capture the images and inference results.
             # There's a special sevice "dataset" created for that purpose
             if e[EVT_osvc_key] == CFG_dset_svc_name:
-                self.dataset_capture(obj_dir, obj_id, e)
+                with self.evt_lock:
+                    self.dataset_capture(obj_dir, obj_id, e)
+                    # the negative is kept in the events folder until the next positive
+                    if e[EVT_msg_key] is None:
+                        self.event_written(obj_id, e[EVT_osvc_key], time.time())
+                    elif self.evt_time.pop((obj_id, e[EVT_osvc_key]), None) is not None:
+                        SCHEDULER.cancel((self.chan, obj_id, e[EVT_osvc_key]))
                 continue
-            # Make the event JSON file
-            obj_svc_file = f"{obj_dir}/{e[EVT_osvc_key]}.json"
+            # Make the event JSON file. If it's the same event as in the file (but the time), the file
+            # is only touched (its mtime tells when the event was last seen). The file consumed (the
+            # announcer renames the alerts) is rewritten.
+            svc = e[EVT_osvc_key]
+            obj_svc_file = f"{obj_dir}/{svc}.json"
             obj_svc_tmp_file = f"{obj_svc_file}.tmp"
-            json_atomic_write(e, obj_svc_tmp_file, obj_svc_file)
-            # It's helpful when the image is here too
-            obj_svc_img_file = f"{obj_dir}/{e[EVT_osvc_key]}.jpg"
-            Path(obj_svc_img_file).write_bytes(self.img_data)
+            evt_data = {k: v for k, v in e.items() if k != EVT_in_time_key}
+            with self.evt_lock:
+                written = False
+                if self.evt_data.get((obj_id, svc)) == evt_data:
+                    try:
+                        os.utime(obj_svc_file)
+                        written = True
+                    except OSError:
+                        pass
+                if not written and json_atomic_write(e, obj_svc_tmp_file, obj_svc_file):
+                    self.evt_data[(obj_id, svc)] = evt_data
+                    written = True
+                if written:
+                    self.event_written(obj_id, svc, time.time())
+            # It's helpful when the image is here too. The frame is written once for the object and
+            # hard linked as the image of each service.
+            if img_file is None:
+                img_file = f"{obj_dir}/{IMG_file_name}.tmp"
+                Path(img_file).write_bytes(self.img_data)
+            obj_svc_img_file = f"{obj_dir}/{svc}.jpg"
+            try:
+                os.link(img_file, f"{obj_svc_img_file}.tmp")
+                os.rename(f"{obj_svc_img_file}.tmp", obj_svc_img_file)
+            except OSError:
+                # no hard links on the volume (or a stale temp file)
+                try: os.unlink(f"{obj_svc_img_file}.tmp")
+                except: pass
+                Path(obj_svc_img_file).write_bytes(self.img_data)
+        if img_file is not None:
+            try: os.unlink(img_file)
+            except: pass
         return e_list
 
-    # Run detection on one of the objects in the channel image, and generate messages for reporting
-    def loop_run_inference(self, obj_js, e_list):
-        if MODEL is None:
-            return []
-        obj_name = obj_js[EVT_obj_names_key][0]
-        obj_desc = obj_js[EVT_obj_desc_key]
+    # Get the model request priority for the object from its enabled services
+    def object_priority(self, e_list):
+        svcs = [e[EVT_osvc_key] for e in e_list]
+        if CFG_alrt_svc_name in svcs:
+            return DISPATCH_prio_alert
+        if CFG_loc_svc_name in svcs:
+            return DISPATCH_prio_location
+        return DISPATCH_prio_dataset
+
+    # Start detection of the objects in the channel image (all at once through the model dispatcher).
+    # Takes the list of (obj_js, e_list) tuples and their model request priority, returns the job
+    # to pass to loop_run_inference_collect().
+    def loop_run_inference_submit(self, pending, priority):
+        if MODEL is None or DISPATCHER is None:
+            return None
+        # The objects detected on a look-alike frame recently are answered from the cache
+        # (unless the imager saw something moving, the small objects barely change the hash)
+        cache = DETECT_CACHE
+        phash = None
+        model_id = f"{MODEL.model_name()}:{getattr(MODEL, 'model_to_use', '')}"
+        results = [None for p in pending]
+        if cache is not None and cache.ttl > 0:
+            phash = self.img_meta.get(IMG_phash_key) or jpeg_dhash(self.img_data)
+            if len(self.img_meta.get(IMG_motion_key, [])) == 0:
+                results = [cache.get(self.chan, obj_js[EVT_obj_desc_key], model_id, phash) for obj_js, e_list in pending]
+        misses = [idx for idx, r in enumerate(results) if r is None]
+        with self.cond:
+            self.cache_hits += len(pending) - len(misses)
+            self.cache_misses += len(misses)
         # technically, it makes sense to have processing tuned for each service, but for efficiency
         # we do inference for the object described by obj_desc once, then use message templates to
         # tweak the results to the purpose of the specific service.
-        try: 
-            res, loc_msg = MODEL.locate(self.img_base64, obj_desc, self.chan_name)
-            #res, loc_msg = MODEL.locate(self.img_data, obj_desc, self.chan_name)
+        # When configured, all the objects are detected in a single request (w/ the JSON answer)
+        # The requests not sent to the model by the deadline are dropped (the next frame is likely here).
+        deadline = self.img_time + CFG[CFG_obj_model_deadline_key]
+        future = None
+        try:
+            if len(misses) == 0:
+                pass
+            elif CFG[CFG_obj_model_multi_key] and len(misses) > 1 and DISPATCHER.has_multi():
+                obj_descs = [pending[idx][0][EVT_obj_desc_key] for idx in misses]
+                future = DISPATCHER.submit_multi((self.img_base64, obj_descs, self.chan_name), priority, deadline)
+            else:
+                requests = [(self.img_base64, pending[idx][0][EVT_obj_desc_key], self.chan_name) for idx in misses]
+                future = DISPATCHER.submit_all(requests, priority, deadline)
+        except Exception as e:
+            print(f"{sys._getframe().f_code.co_name}: {MODEL.model_name()} error:", e)
+            return None
+        return (results, misses, future, priority, cache, model_id, phash)
+
+    # Wait for the model requests future. The requests below the alert priority are cancelled
+    # (and DispatchDropped raised) if a newer frame of the channel is waiting, so they do not
+    # hold up the alerts of the newer frame.
+    def wait_model(self, future, priority):
+        future.add_done_callback(lambda f: self.notify())
+        with self.cond:
+            self.cond.wait_for(lambda: future.done() or not self.running or (priority != DISPATCH_prio_alert and self.frame is not None))
+            if not future.done():
+                self.superseded += 1
+        if not future.done():
+            future.cancel()
+            raise DispatchDropped("request superseded")
+        return future.result()
+
+    # Wake up the worker waiting in wait_model()
+    def notify(self):
+        with self.cond:
+            self.cond.notify_all()
+
+    # Wait for the detection job started by loop_run_inference_submit() to complete.
+    # Returns the list of the updated event lists.
+    def loop_run_inference_collect(self, pending, job):
+        if job is None:
+            return [[] for obj_js, e_list in pending]
+        results, misses, future, priority, cache, model_id, phash = job
+        try:
+            if future is not None:
+                for idx, r in zip(misses, self.wait_model(future, priority)):
+                    results[idx] = r
+        except (DispatchDropped, concurrent.futures.CancelledError):
+            return [[] for obj_js, e_list in pending] # expired, shed or superseded, counted in the metrics
         except Exception as e:
             print(f"{sys._getframe().f_code.co_name}: {MODEL.model_name()} error:", e)
-            return []
+            return [[] for obj_js, e_list in pending]
+        # Keep the model answers for the look-alike frames to come
+        if cache is not None:
+            for idx in misses:
+                if not isinstance(results[idx], Exception):
+                    cache.put(self.chan, pending[idx][0][EVT_obj_desc_key], model_id, phash, results[idx])
+        e_lists = []
+        for (obj_js, e_list), result in zip(pending, results):
+            if isinstance(result, Exception):
+                if not isinstance(result, DispatchDropped):
+                    print(f"{sys._getframe().f_code.co_name}: {MODEL.model_name()} error:", result)
+                e_lists.append([])
+                continue
+            res, loc_msg = result
+            e_lists.append(self.loop_run_result(obj_js, e_list, res, loc_msg))
+        return e_lists
+
+    # Generate messages for reporting from the detection result for one of the objects
+    def loop_run_result(self, obj_js, e_list, res, loc_msg):
+        obj_name = obj_js[EVT_obj_names_key][0]
         # if object is not detected, we still report to the dataset service (when it's configured)
         if not res:
             for e in e_list:
@@ -353,32 +855,34 @@ class ChannelOrchestrator:
         # Object events directory
         obj_dir =  f"{EVTDIR}/{self.chan}/{obj_id}"
         obj_file = f"{obj_dir}/{EVT_obj_file_name}"
-        init_obj_folder = False
-        if not os.path.exists(obj_file):
-            os.makedirs(obj_dir, exist_ok=True)
-            # Create obect json file for the folder
+        init_obj_folder = not obj_id in self.obj_files
+        if init_obj_folder or self.obj_files[obj_id] != obj_js:
+            # Create the object json file for the new folder, or rewrite it (it's kept across
+            # the config changes) if the content differs
+            if init_obj_folder:
+                os.makedirs(obj_dir, exist_ok=True)
             if not json_atomic_write(obj_js, f"{obj_file}.tmp", obj_file):
                 return obj_js, [] # Do not process anything until we can create the proper file tree
-            init_obj_folder = True
+            self.obj_files[obj_id] = obj_js
         # For new folder need to populate the folder w/ <svc>.off files for CFG_osvc_def_off_key option
         if init_obj_folder:
+            svc_off = set()
             for s in obj_svcs:
                 if s[CFG_osvc_def_off_key]:
                     obj_svc_off_file = f"{obj_dir}/{s[CFG_osvc_name_key]}.off"
                     open(obj_svc_off_file, 'w').close()
-        # Handle skipping channels, ageing out and turning off services. Create event list to work with.
+                    svc_off.add((obj_id, s[CFG_osvc_name_key]))
+            with self.cond:
+                self.svc_off = self.svc_off | svc_off
+        # Handle skipping channels and turning off services (their events are removed when the .off
+        # flags are loaded, the events are aged out by the scheduler). Create event list to work with.
         e_list = []
         for s in obj_svcs:
-            obj_svc_file = f"{obj_dir}/{s[CFG_osvc_name_key]}.json"
-            obj_svc_off_file = f"{obj_dir}/{s[CFG_osvc_name_key]}.off"
+            svc = s[CFG_osvc_name_key]
             skip_chan_list = [] if not CFG_osvc_skip_chan_key in s.keys() else s[CFG_osvc_skip_chan_key]
-            if os.path.exists(obj_svc_off_file) or self.chan_id in skip_chan_list:
-                try: os.unlink(obj_svc_file)
-                except: pass
+            if (obj_id, svc) in self.svc_off or self.chan_id in skip_chan_list:
+                self.remove_event(obj_id, svc)
                 continue
-            if get_modified_time_ago(obj_svc_file) >= s[CFG_osvc_age_out_key]:
-                try: os.unlink(obj_svc_file)
-                except: pass
             evt = {
                 EVT_osvc_key: s[CFG_osvc_name_key],
                 EVT_c_name_key: self.chan_name,
@@ -390,61 +894,125 @@ class ChannelOrchestrator:
             e_list.append(evt)
         return obj_js, e_list
 
+    # Check the object prefilter (if configured) on the current frame, returns False if
+    # the model should not be asked about the object (the prefilter did not fire and
+    # it's not yet time for the keep-alive sample)
+    def prefilter_pass(self, o):
+        if not CFG_obj_prefilter_key in o.keys():
+            return True
+        obj_id = o[CFG_obj_id_key]
+        now = time.time()
+        fired = True
+        try:
+            pf = self.prefilters.get(obj_id)
+            if pf is None or pf[0] != o:
+                pf = (o, new_prefilter(o))
+                self.prefilters[obj_id] = pf
+            if self.pf_img is None:
+                self.pf_img = cv2.imdecode(np.frombuffer(self.img_data, dtype="uint8"), cv2.IMREAD_REDUCED_COLOR_2)
+            if self.pf_img is not None:
+                fired = pf[1].score(self.pf_img, self.img_meta) >= pf[1].thresh
+        except Exception as e:
+            print(f"{sys._getframe().f_code.co_name}: channel {self.chan}, object {obj_id} prefilter error: {e}")
+        if not fired and now - self.prefilter_time.get(obj_id, 0) < o.get(CFG_obj_prefilter_keepalive_key, CFG_DEF_prefilter_keepalive):
+            with self.cond:
+                self.prefilter_skips += 1
+            return False
+        self.prefilter_time[obj_id] = now
+        return True
+
     # Run a check if there is anything active on the channel, return false if not
     def is_object_watched(self, o):
         obj_id = o[CFG_obj_id_key]
         obj_svcs = o[CFG_obj_svcs_key]
-        # Object events directory
-        obj_dir = f"{EVTDIR}/{self.chan}/{obj_id}"
         # Check for any service being enabled.
         enabled_services = False
         for s in obj_svcs:
-            obj_svc_off_file = f"{obj_dir}/{s[CFG_osvc_name_key]}.off"
             # Is this channel in the skip list for the object service or the service is off?
-            if not self.chan in s.get(CFG_osvc_skip_chan_key, []) and not os.path.exists(obj_svc_off_file):
+            if not self.chan in s.get(CFG_osvc_skip_chan_key, []) and not (obj_id, s[CFG_osvc_name_key]) in self.svc_off:
                 enabled_services = True
                 break
         return enabled_services
 
-    # Handle channel (called from main loop to process each channel),
-    # it should run in its own thread or process eventually
-    def loop_run(self):
+    # Handle channel (called from main loop for each channel), the frame processing
+    # is done by the channel worker thread. The imager channel on/off state is only
+    # checked on the full main loop pass.
+    def loop_run(self, full=True):
         global CFG
-        # get list of objects to go over (conformity to schema already verified)
+        if full:
+            # get list of objects to go over (conformity to schema already verified)
+            objects = CFG[CFG_obj_objects_key]
+            # handle disabling imager channels that are not being watched now
+            watched_count = 0
+            for o in objects:
+                watched_count += 1 if self.is_object_watched(o) else 0
+            off_file_pathname = f"{IMGDIR}/{self.chan}/{IMG_off_file_name}"
+            if watched_count <= 0:
+                if not self.img_off:
+                    print(f"{sys._getframe().f_code.co_name}: turning channel {self.chan} off, nothing to watch for now")
+                    open(off_file_pathname, 'w').close()
+                    self.img_off = True
+            else:
+                if self.img_off:
+                    print(f"{sys._getframe().f_code.co_name}: turning channel {self.chan} on now")
+                    try: os.unlink(off_file_pathname)
+                    except: pass
+                    self.img_off = False
+        # read the new image and pass it to the channel worker
+        frame = self.read_image_data()
+        if frame is not None:
+            self.put_frame(frame)
+        return
+
+    # Process the channel frame (runs in the channel worker thread)
+    def process_frame(self, frame):
         objects = CFG[CFG_obj_objects_key]
-        # handle disabling imager channels that are not being watched now
-        watched_count = 0
-        for o in objects:
-            watched_count += 1 if self.is_object_watched(o) else 0
-        off_file_pathname = f"{IMGDIR}/{self.chan}/{IMG_off_file_name}"
-        if watched_count <= 0:
-            if not os.path.exists(off_file_pathname):
-                print(f"{sys._getframe().f_code.co_name}: turning channel {self.chan} off, nothing to watch for now")
-                open(off_file_pathname, 'w').close()
-        else:
-            if os.path.exists(off_file_pathname):
-                print(f"{sys._getframe().f_code.co_name}: turning channel {self.chan} on now")
-                try: os.unlink(off_file_pathname)
-                except: pass
-        # read image JSON
-        if not self.read_image_data():
+        self.chan_id = frame.chan_id
+        self.chan_name = frame.chan_name
+        self.img_data = frame.img_data
+        self.img_base64 = frame.img_base64
+        self.img_time = frame.img_time
+        self.img_iter = frame.img_iter
+        self.img_meta = frame.img_meta
+        # Do not waste the model calls on the frames too poor (blurred, over/underexposed) to tell anything
+        quality = self.img_meta.get(IMG_quality_key)
+        if quality is not None and quality < CFG[CFG_obj_model_min_q_key]:
+            if not self.low_quality:
+                print(f"{sys._getframe().f_code.co_name}: channel {self.chan} frame quality {quality} is below {CFG[CFG_obj_model_min_q_key]}, skipping")
+            self.low_quality = True
             return
-        # Go over the objects of interest, ask ML model about them in the image
-        # and if discovered anything interesting update the event files
+        self.low_quality = False
+        # Go over the objects of interest, ask ML model about them in the image (if their
+        # prefilters fire) and if discovered anything interesting update the event files
+        self.pf_img = None
+        pending = []
         for o in objects:
             obj_js, e_list = self.loop_run_handle_object(o)
-            if len(e_list) == 0:
-                continue
-            e_list = self.loop_run_inference(obj_js, e_list)
-            if len(e_list) == 0:
-                continue
-            self.loop_run_update(obj_js, e_list)
+            if len(e_list) > 0 and self.prefilter_pass(o):
+                pending.append((obj_js, e_list))
+        if len(pending) == 0:
+            return
+        # The objects are detected in the groups by their services priority (alert, location,
+        # dataset), all the groups are submitted at once and the results handled in the priority
+        # order, so the alerts do not wait for the rest. When the objects are detected in a single
+        # request, there is one such request per group (sent w/ the priority of the group).
+        groups = {}
+        for obj_js, e_list in pending:
+            groups.setdefault(self.object_priority(e_list), []).append((obj_js, e_list))
+        jobs = [(group, self.loop_run_inference_submit(group, prio)) for prio, group in sorted(groups.items())]
+        for group, job in jobs:
+            e_lists = self.loop_run_inference_collect(group, job)
+            for (obj_js, orig_e_list), e_list in zip(group, e_lists):
+                if len(e_list) == 0 or not self.running:
+                    continue
+                self.loop_run_update(obj_js, e_list)
         return
 
-# Main loop (called w/ ORCH_poll_int_ms interval)
-def main_loop(iteration):
-    # Read objects of interest config, if new, remove all the existent event entries
-    # and ChannelOrchestrator instances
+# Full main loop pass, the config, the channels and their frames. The service .off flags
+# of the channels in off_chans (all if None) are reloaded.
+def main_loop_full(off_chans=None):
+    # Read objects of interest config, if new, re-create the ChannelOrchestrator instances
+    # and remove the event entries made stale by the changes
     read_and_apply_config()
 
     # Make the lists of input (imager) and output (events) channels
@@ -453,10 +1021,11 @@ def main_loop(iteration):
     # Remove event channels that are no longer present in sources
     for ch in evt_chans:
         if ch not in img_chans:
-            crun_ch_ids = CRUN.keys()
-            if ch in crun_ch_ids:
-                del CRUN[ch]
             shutil.rmtree(f"{EVTDIR}/{ch}", ignore_errors=True)
+    # Stop the workers of the channels that are gone
+    for ch in list(CRUN.keys()):
+        if ch not in img_chans:
+            CRUN.pop(ch).stop()
 
     # Note, that there might be problems with racing conditions between channel updates
     #       propagating through the imager and the objects config read here. They have
@@ -466,18 +1035,132 @@ def main_loop(iteration):
     crun_ch_ids = CRUN.keys()
     for ch in img_chans:
         if not ch in crun_ch_ids:
-            CRUN[ch] = ChannelOrchestrator(ch)
+            CRUN[ch] = ChannelOrchestrator(ch, RING_READERS.pop(ch, None))
+        elif off_chans is None or ch in off_chans:
+            CRUN[ch].load_off_state()
         co = CRUN[ch]
         co.loop_run()
+    # drop the frame ring readers left from the channels that are gone
+    RING_READERS.clear()
+
+# Main loop, does the full pass (chans is None) or only reads the new frames of the channels
+# in the chans list. The full pass reloads the service .off flags of the channels in off_chans
+# (all if None).
+def main_loop(chans=None, off_chans=None):
+    global METRICS_TIME
+    if chans is not None:
+        for ch in chans:
+            co = CRUN.get(ch)
+            if co is not None:
+                co.loop_run(False)
+    else:
+        main_loop_full(off_chans)
+
+    # Report the per-channel frame age metrics
+    now = time.time()
+    if now - METRICS_TIME >= ORCH_metrics_int:
+        for co in CRUN.values():
+            co.report_metrics(now - METRICS_TIME)
+        if DISPATCHER is not None:
+            DISPATCHER.report_metrics(now - METRICS_TIME)
+        SCHEDULER.report_metrics(now - METRICS_TIME)
+        METRICS_TIME = now
     return
 
-# Run the main loop
-iteration = 0
+# File change watcher (w/ inotify on Linux) waking up the main loop on the new frames in the
+# channel rings (or image.json files), the service .off and the channel image.off toggles
+# and the config file changes. The channels w/ the new frames are collected, so the main
+# loop only reads their frames, the rest of the changes request the full pass (the channels
+# w/ the service .off toggles are collected too, to reload only their flags).
+class OrchWakeup(FileSystemEventHandler):
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chans = set() # channels w/ the new frames
+        self.full = True   # full main loop pass requested
+        self.off_chans = set() # channels w/ the service .off toggles
+        self.observer = None
+        self.imgdir = os.path.abspath(IMGDIR)
+        self.evtdir = os.path.abspath(EVTDIR)
+        if Observer is None:
+            print(f"{sys._getframe().f_code.co_name}: watchdog is not installed, polling")
+            return
+        try:
+            observer = Observer()
+            for path in [self.imgdir, self.evtdir]:
+                os.makedirs(path, exist_ok=True)
+                observer.schedule(self, path, recursive=True)
+            observer.schedule(self, os.path.abspath(CFGDIR), recursive=False)
+            observer.start()
+            self.observer = observer
+        except Exception as e:
+            print(f"{sys._getframe().f_code.co_name}: unable to watch the files, polling: {e}")
+
+    # Classify the file change event (runs in the watcher thread)
+    def on_any_event(self, event):
+        if event.event_type in ['opened', 'closed_no_write']:
+            return
+        path = event.dest_path if event.event_type == 'moved' else event.src_path
+        name = os.path.basename(path)
+        chan = None
+        off_chan = None
+        full = False
+        if path.startswith(self.imgdir + '/'):
+            rel = path[len(self.imgdir) + 1:].split('/')
+            if event.is_directory:
+                full = len(rel) == 1 and event.event_type != 'modified' # channel added or removed
+            elif len(rel) == 2 and name in [IMG_ring_file_name, IMG_json_file_name] and event.event_type != 'deleted':
+                chan = rel[0]
+            elif name == IMG_off_file_name:
+                full = True
+        elif path.startswith(self.evtdir + '/'):
+            if name.endswith('.off'):
+                full = True
+                off_chan = path[len(self.evtdir) + 1:].split('/')[0]
+        else:
+            full = name in [CFG_objects, CFG_model]
+        if chan is None and not full:
+            return
+        with self.cond:
+            if chan is not None:
+                self.chans.add(chan)
+            if off_chan is not None:
+                self.off_chans.add(off_chan)
+            self.full = self.full or full
+            self.cond.notify_all()
+
+    # Wait for the changes up to timeout seconds, returns the full pass flag, the set of
+    # the channels w/ the new frames and the set of the channels w/ the service .off toggles
+    def wait(self, timeout):
+        with self.cond:
+            self.cond.wait_for(lambda: self.full or len(self.chans) > 0, timeout)
+            full = self.full
+            chans = self.chans
+            off_chans = self.off_chans
+            self.full = False
+            self.chans = set()
+            self.off_chans = set()
+        return full, chans, off_chans
+
+# Run the main loop, woken up by the file changes (the full pass reloading all the service
+# .off flags is done at least every ORCH_rescan_int seconds) or, if can't watch them, w/
+# IMG_poll_int_ms interval
+SCHEDULER = EventScheduler()
+wakeup = OrchWakeup()
+last_full = 0.0
 loop_interval = int(IMG_poll_int_ms / 1)
 while True:
+    if wakeup.observer is not None:
+        full, chans, off_chans = wakeup.wait(max(0.0, last_full + ORCH_rescan_int - time.time()))
+        if time.time() - last_full >= ORCH_rescan_int:
+            last_full = time.time()
+            main_loop()
+        elif full:
+            main_loop(off_chans=off_chans)
+        else:
+            main_loop(chans)
+        continue
     start_time_ms = int(time.time() * 1000)
-    main_loop(iteration)
-    iteration += 1
+    main_loop()
     end_time_ms = int(time.time() * 1000)
     if start_time_ms + loop_interval > end_time_ms:
         time.sleep((start_time_ms + loop_interval - end_time_ms) / 1000.0)
@@ -0,0 +1,133 @@
+# Cheap local (CPU only) prefilters for the orchestrator. Most of the frames on
+# most of the cameras have none of the objects of interest, so an object can
+# be configured to have a prefilter checking the frame first, and the model
+# is only asked about the object when the prefilter fires (or when it's time
+# for the keep-alive sample, see the orchestrator).
+# The prefilters:
+#  - "hog": OpenCV HOG people detector, the score is the max detection weight
+#  - "blob": the size of the largest changed area (the imager motion boxes, or
+#    the background subtraction here for the frames w/o them), the score is the
+#    area as the fraction of the frame
+#  - "onnx": small object detector (YOLOv5/v8 export) run by ONNX Runtime (if
+#    installed), the score is the max confidence for the configured classes
+# A prefilter that can't run (e.g. no onnxruntime or model file) always fires.
+import os
+import sys
+import cv2
+import numpy as np
+from shared_settings import *
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+PREFILTER_hog_width = 640   # width of the frame used for the HOG people detector
+PREFILTER_blob_width = 160  # width of the frame used for the background subtraction
+PREFILTER_blob_history = 100 # number of the frames in the background subtraction model
+
+class HogPrefilter:
+    def __init__(self, thresh=0.3, **kwargs):
+        self.thresh = thresh
+        self.hog = None
+        if not hasattr(cv2, 'HOGDescriptor'):
+            print(f"{sys._getframe().f_code.co_name}: no HOG detector in OpenCV {cv2.__version__}, the prefilter always fires")
+            return
+        self.hog = cv2.HOGDescriptor()
+        self.hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+
+    @staticmethod
+    def prefilter_name():
+        return "hog"
+
+    # Score the BGR frame (the metadata from the imager is not used)
+    def score(self, img, meta):
+        if self.hog is None:
+            return float('inf')
+        h, w = img.shape[:2]
+        if w > PREFILTER_hog_width:
+            img = cv2.resize(img, (PREFILTER_hog_width, max(1, h * PREFILTER_hog_width // w)), interpolation=cv2.INTER_AREA)
+        rects, weights = self.hog.detectMultiScale(img, winStride=(8, 8), padding=(8, 8), scale=1.05)
+        return float(np.max(weights)) if len(weights) > 0 else 0.0
+
+class BlobPrefilter:
+    def __init__(self, thresh=0.005, **kwargs):
+        self.thresh = thresh
+        self.bg = None # background subtractor (only for the frames w/o the imager motion boxes)
+
+    @staticmethod
+    def prefilter_name():
+        return "blob"
+
+    # Score the BGR frame, use the imager motion boxes if available
+    def score(self, img, meta):
+        if IMG_motion_key in meta:
+            return max([b[2] * b[3] for b in meta[IMG_motion_key]], default=0.0)
+        h, w = img.shape[:2]
+        small = cv2.resize(img, (PREFILTER_blob_width, max(1, h * PREFILTER_blob_width // w)), interpolation=cv2.INTER_AREA)
+        if self.bg is None:
+            self.bg = cv2.createBackgroundSubtractorMOG2(history=PREFILTER_blob_history, detectShadows=False)
+        mask = self.bg.apply(small)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return max([cv2.contourArea(c) for c in contours], default=0.0) / mask.size
+
+class OnnxPrefilter:
+    def __init__(self, thresh=0.25, model=None, classes=None, **kwargs):
+        self.thresh = thresh
+        self.classes = classes
+        self.session = None
+        if onnxruntime is None:
+            print(f"{sys._getframe().f_code.co_name}: onnxruntime is not installed, the prefilter always fires")
+            return
+        if model is None or not os.path.exists(model):
+            print(f"{sys._getframe().f_code.co_name}: no ONNX model file \"{model}\", the prefilter always fires")
+            return
+        try:
+            self.session = onnxruntime.InferenceSession(model, providers=['CPUExecutionProvider'])
+            self.input = self.session.get_inputs()[0]
+            shape = self.input.shape
+            self.size = (shape[3], shape[2]) if isinstance(shape[2], int) and isinstance(shape[3], int) else (640, 640)
+        except Exception as e:
+            print(f"{sys._getframe().f_code.co_name}: error loading \"{model}\", the prefilter always fires: {e}")
+            self.session = None
+
+    @staticmethod
+    def prefilter_name():
+        return "onnx"
+
+    # Score the BGR frame (the metadata from the imager is not used)
+    def score(self, img, meta):
+        if self.session is None:
+            return float('inf')
+        blob = cv2.dnn.blobFromImage(img, 1.0 / 255, self.size, swapRB=True).astype(np.float32)
+        out = self.session.run(None, {self.input.name: blob})[0][0]
+        if out.shape[0] < out.shape[1]:
+            # YOLOv8: (4 + classes) x boxes
+            scores = out[4:, :].T
+        else:
+            # YOLOv5: boxes x (5 + classes), the class scores are scaled by the objectness
+            scores = out[:, 5:] * out[:, 4:5]
+        if self.classes is not None:
+            scores = scores[:, [c for c in self.classes if c < scores.shape[1]]]
+        return float(scores.max()) if scores.size > 0 else 0.0
+
+# add your prefilter class name and class object mapping here
+PREFILTERS = {
+    HogPrefilter.prefilter_name(): HogPrefilter,
+    BlobPrefilter.prefilter_name(): BlobPrefilter,
+    OnnxPrefilter.prefilter_name(): OnnxPrefilter,
+}
+
+# Create the prefilter configured for the object of interest (None if not configured)
+def new_prefilter(o):
+    name = o.get(CFG_obj_prefilter_key)
+    if name is None:
+        return None
+    params = {}
+    if CFG_obj_prefilter_thresh_key in o.keys():
+        params['thresh'] = o[CFG_obj_prefilter_thresh_key]
+    if CFG_obj_prefilter_model_key in o.keys():
+        params['model'] = o[CFG_obj_prefilter_model_key]
+    if CFG_obj_prefilter_classes_key in o.keys():
+        params['classes'] = o[CFG_obj_prefilter_classes_key]
+    return PREFILTERS[name](**params)
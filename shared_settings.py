@@ -19,14 +19,45 @@ CFG_chan_img_h_key = "height"    # channel image height in pixels
 CFG_chan_img_w_key = "width"     # channel image width in pixels
 CFG_chan_img_q_key = "quality"   # channel image quality (in %, images are saved as JPEG)
 CFG_chan_rtsp_bf_retries_key = "rtsp_bf_retries" # how many retries if detected RTSP delivering a bad frame
-CFG_chan_rtsp_bf_thesh_key =   "rtsp_bf_thresh"  # RTSP bad frame sensetivity threshold (default 0.2, higer - more frames are considered bad)
+CFG_chan_rtsp_bf_thesh_key =   "rtsp_bf_thresh"  # RTSP bad frame sensetivity threshold of the legacy bottom rows similarity check (optional, off if not set, higer - more frames are considered bad)
+CFG_chan_rtsp_bf_score_key =   "rtsp_bf_score"   # RTSP bad frame score threshold, fraction of the frame that looks broken (default 0.1, lower - more frames are considered bad)
+CFG_chan_rtsp_mode_key = "rtsp_mode"  # RTSP capture mode: "grabber" (background thread keeps the stream drained, default) or "seek"
+CFG_chan_rtsp_decode_key = "rtsp_decode" # RTSP decoder work: "all" (default), "keyframes", "nonref" (skip non-reference frames) or "lowres"
+CFG_chan_http_mode_key = "http_mode" # HTTP/s capture mode: "snapshot" (request an image each update, default) or "mjpeg" (keep the stream open)
+CFG_chan_http_timeout_key = "http_timeout" # HTTP/s request (or MJPEG stream read) timeout in seconds (default 10)
+CFG_chan_motion_thresh_key = "motion_thresh" # min change score (0.0-1.0) to publish the image (default 0.0, publish all images)
+CFG_chan_motion_keepalive_key = "motion_keepalive" # publish an image at least this often (seconds) even if no change (default 60)
+CFG_chan_best_of_key = "best_of"  # number of frames to grab for each update, the best quality one is published (RTSP and MJPEG, default 1)
+CFG_chan_frame_ipc_key = "frame_ipc" # how the frames are passed to the consumers: "ring" (shared memory, default) or "file" (image.json)
+CFG_engine_key = "engine"        # (top level) capture engine: "fork" (process per channel, default) or "threads" (single process)
+CFG_engine_workers_key = "engine_workers" # (top level) size of the "threads" capture engine thread pool
+CFG_DEF_engine_workers = 8       # default size of the capture engine thread pool
 CFG_DEF_upd_int = 5              # default update interval for channels (in number of IMG_poll_int_ms intervals)
 # Models' config
 CFG_model_version_key = "version_mod" # config update counter (for detecting changes in models_cfg.json, must differ from the CFG_obj_version_key)
 CFG_obj_model_key = "model"           # ML model interface ID string (see in the code, default "ollama-simple")
 CFG_obj_model_name_key = "model_name" # model name to pass to the model interface (optional, see in the code, default varies)
-CFG_obj_model_url_key = "model_url"   # URL to pass to the model interface (optional, see in the code, default varies)
+CFG_obj_model_url_key = "model_url"   # URL to pass to the model interface, or the list of the URLs to balance the requests across (optional, see in the code, default varies)
 CFG_obj_model_tkn_key = "model_tkn"   # token or key to pass to the model interface (optional, see in the code, default varies)
+CFG_obj_model_min_q_key = "model_min_quality" # skip inference on the frames w/ quality score below this (optional, 0.0-1.0, default 0.0 - off)
+CFG_obj_model_inflight_key = "model_inflight" # max number of requests in flight to each model endpoint (optional, default CFG_DEF_model_inflight)
+CFG_DEF_model_inflight = 4            # default max number of requests in flight to the model endpoint
+CFG_obj_model_queue_key = "model_queue" # max number of requests waiting for the model endpoint, the lowest priority ones are shed above it (optional, default CFG_DEF_model_queue)
+CFG_DEF_model_queue = 32               # default max number of requests waiting for the model endpoint
+CFG_obj_model_deadline_key = "model_deadline" # drop the model requests not sent this many seconds after the frame capture (optional, default CFG_DEF_model_deadline)
+CFG_DEF_model_deadline = 10            # default model request deadline (seconds after the frame capture)
+CFG_obj_model_multi_key = "model_multi" # true to detect all the objects on the frame in a single request w/ JSON answer (optional, default false)
+CFG_obj_model_cache_ttl_key = "model_cache_ttl" # seconds to reuse the detection results for the look-alike frames of the channel (optional, default CFG_DEF_model_cache_ttl, 0 - off)
+CFG_DEF_model_cache_ttl = 30           # default time to keep the detection results in the cache (seconds)
+CFG_obj_model_cache_dist_key = "model_cache_dist" # max Hamming distance between the frame hashes (0-256) for the frames to look alike (optional, default CFG_DEF_model_cache_dist)
+CFG_DEF_model_cache_dist = 8           # default max Hamming distance between the look-alike frame hashes
+CFG_obj_model_cache_size_key = "model_cache_size" # max number of the detection results in the cache (optional, default CFG_DEF_model_cache_size)
+CFG_DEF_model_cache_size = 1024        # default max number of the detection results in the cache
+CFG_obj_model_keep_alive_key = "model_keep_alive" # how long the model server keeps the model loaded after a request, seconds or duration string (optional, Ollama only, default -1 - for as long as the server runs)
+CFG_obj_model_fb_key = "model_fallback" # fallback ML model interface ID used while the circuit breakers of all the model endpoints are open (optional, default none)
+CFG_obj_model_fb_name_key = "model_fallback_name" # model name to pass to the fallback model interface (optional, see in the code, default varies)
+CFG_obj_model_fb_url_key = "model_fallback_url"   # URL (or the list of the URLs) to pass to the fallback model interface (optional, see in the code, default varies)
+CFG_obj_model_fb_tkn_key = "model_fallback_tkn"   # token or key to pass to the fallback model interface (optional, see in the code, default varies)
 CFG_lbl_model_key = "lbl_model"           # ML model interface ID string for use when auto-labeling in UI (optional)
 CFG_lbl_model_name_key = "lbl_model_name" # model name to pass to the auto-labeling model interface (optional, for picking model in the backend)
 CFG_lbl_model_url_key = "lbl_model_url"   # URL to pass to the auto-labeling model interface (optional)
@@ -39,6 +70,12 @@ CFG_obj_id_key = "obj_id"        # unique ID of the object of interest (single w
 CFG_obj_names_key = "names"      # names of the object of interest (object name coming from Alexa should match one of them to get the answer)
 CFG_obj_desc_key = "desc"        # object description string suitable for identifying the object by the model (transparently passed to the model interface class)
 CFG_obj_svcs_key = "obj_svcs"    # list of services (user visible are only location and alerts for now) configured for the object of interest
+CFG_obj_prefilter_key = "prefilter" # local CPU prefilter checked before asking the model about the object (optional, "hog", "blob" or "onnx")
+CFG_obj_prefilter_thresh_key = "prefilter_thresh" # prefilter score threshold, it fires at or above (optional, default depends on the prefilter)
+CFG_obj_prefilter_keepalive_key = "prefilter_keepalive" # ask the model about the object at least this often (seconds) even if the prefilter does not fire (optional, default CFG_DEF_prefilter_keepalive)
+CFG_DEF_prefilter_keepalive = 60    # default prefilter keep-alive interval (seconds)
+CFG_obj_prefilter_model_key = "prefilter_model" # ONNX model file for the "onnx" prefilter (YOLOv5/v8 export)
+CFG_obj_prefilter_classes_key = "prefilter_classes" # list of the class numbers the "onnx" prefilter looks for (optional, default all)
 # allowed service names
 CFG_loc_svc_name = "location"    # name of the location service (used to generate name of files in the events folder)
 CFG_alrt_svc_name = "alert"      # name of the alert service (used to generate name of files in the events folder)
@@ -59,12 +96,33 @@ IMG_poll_int_ms = 1000 # how often to the imager loop is called
 IMG_json_file_name = 'image.json' # name of the JSON file w/ image data under the channel folder
 IMG_off_file_name = 'image.off'   # name of the file that stops imager from polling from channel URL
 IMG_file_name = 'image.jpg'  # where to store raw image for debugging and the data collection
+IMG_ring_file_name = 'frames.ring' # shared memory frame ring file under the channel folder (see frame_ring.py)
+IMG_ipc_ring = 'ring'  # CFG_chan_frame_ipc_key value for passing frames through the shared memory ring
+IMG_ipc_file = 'file'  # CFG_chan_frame_ipc_key value for passing frames through the image.json files (fallback)
+IMG_rtsp_grabber = 'grabber' # CFG_chan_rtsp_mode_key value for the background grabber thread mode
+IMG_rtsp_seek = 'seek' # CFG_chan_rtsp_mode_key value for the legacy seek to the end and read mode
+IMG_rtsp_decode_all = 'all'          # CFG_chan_rtsp_decode_key value for decoding every frame
+IMG_rtsp_decode_key = 'keyframes'    # CFG_chan_rtsp_decode_key value for decoding the key frames only
+IMG_rtsp_decode_nonref = 'nonref'    # CFG_chan_rtsp_decode_key value for skipping the non-reference frames
+IMG_rtsp_decode_lowres = 'lowres'    # CFG_chan_rtsp_decode_key value for decoding at reduced resolution
+IMG_http_snapshot = 'snapshot' # CFG_chan_http_mode_key value for requesting a snapshot image each update
+IMG_http_mjpeg = 'mjpeg'       # CFG_chan_http_mode_key value for reading the latest part from an MJPEG stream
+IMG_DEF_http_timeout = 10      # default HTTP/s timeout (seconds)
+IMG_http_connect_timeout = 5   # max HTTP/s connect timeout (seconds)
+IMG_engine_fork = 'fork'       # CFG_engine_key value for forking a process for each channel
+IMG_engine_threads = 'threads' # CFG_engine_key value for the single process capture engine
+IMG_hang_timeout = 30  # seconds w/o progress before the imager restarts the channel downloader
 IMG_dir = 'images'     # locaton of the imager folder
 IMG_chan_key = 'cid'   # Channel ID key
 IMG_name_key = 'name'  # Verbal description of the channel
 IMG_data_key = 'data'  # Image data (base64 encoded)
 IMG_time_key = 'time'  # will use epoch time as we will likely report differential
 IMG_iter_key = 'iter'  # iteraration number when the image is captured
+IMG_change_key = 'change' # change score (0.0-1.0, fraction of the image that differs from the channel background)
+IMG_motion_key = 'motion' # list of motion boxes [x, y, w, h] (in fractions of the image width and height)
+IMG_corrupt_key = 'corrupt' # RTSP frame corruption score (0.0-1.0, fraction of the frame that looks broken)
+IMG_quality_key = 'quality' # frame quality score (0.0-1.0, combines sharpness, exposure and corruption)
+IMG_phash_key = 'phash' # perceptual hash of the frame (hex string, 256 bit dHash, see frame_hash.py)
 
 # Orchestrator shared values
 ORCH_poll_int_ms = 500 # for alerts it might be useful to keep this low
@@ -80,7 +138,7 @@ EVT_obj_cname_key = "o_cname" # object's channel name from the config (in events
 EVT_osvc_list_key = "osvc_list"  # list of services (names) enabled (not filtered out for the obj on the channel, in events/chan/obj/obj.json)
 EVT_osvc_key = "osvc_name"  # event service name from CFG_osvc_name_key
 EVT_c_name_key = "c_name"   # event channel name (for use in speech)
-EVT_in_time_key = "in_time" # epoch time when the event was reported
+EVT_in_time_key = "in_time" # epoch time when the event was reported (the file mtime is bumped while the same event is seen)
 EVT_msg_key = "msg"         # message to play for the event
 EVT_alrt_mute_time_key = "mtime" # for alerts only, time in seconds mute after reporting
 
@@ -100,6 +158,11 @@ CFG_obj_schema = {
         CFG_obj_id_key: {"type": "string"},
         CFG_obj_names_key: {"type": "array", "items": {"type": "string"}, "minItems": 1 },
         CFG_obj_desc_key: {"type": "string"},
+        CFG_obj_prefilter_key: {"type": "string", "enum": ["hog", "blob", "onnx"]},
+        CFG_obj_prefilter_thresh_key: {"type": "number"},
+        CFG_obj_prefilter_keepalive_key: {"type": "number", "minimum": 0},
+        CFG_obj_prefilter_model_key: {"type": "string"},
+        CFG_obj_prefilter_classes_key: {"type": "array", "items": {"type": "integer", "minimum": 0}},
         CFG_obj_svcs_key: {"type": "array", "items": 
             {"type": "object", "properties": {
                 CFG_osvc_name_key: {"type": "string", "enum": [CFG_loc_svc_name, CFG_alrt_svc_name, CFG_dset_svc_name]},
@@ -0,0 +1,10 @@
+# Unit tests for the modules w/o the service dependencies (frame ring, detection
+# cache, event scheduler, model dispatcher). Run from the repo root: python -m pytest tests
+import os
+import sys
+
+# The services run w/ their own folder and the repo root (shared modules) in the path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in [ROOT, f"{ROOT}/orchestrator", f"{ROOT}/imager"]:
+    if path not in sys.path:
+        sys.path.append(path)
@@ -0,0 +1,53 @@
+import time
+from detect_cache import *
+
+HASH = "f" * 64 # 256 bit hash
+CHAN, DESC, MODEL = "porch", "a person", "vllm:llama"
+
+# Flip the low bits of the hex hash
+def flip(phash, bits):
+    return format(int(phash, 16) ^ ((1 << bits) - 1), "064x")
+
+# The look-alike frames (within the Hamming distance) hit, the others miss
+def test_hamming_hit_miss():
+    cache = DetectCache(ttl=60, max_dist=4, max_size=10)
+    cache.put(CHAN, DESC, MODEL, HASH, (True, "left"))
+    assert cache.get(CHAN, DESC, MODEL, HASH) == (True, "left")
+    assert cache.get(CHAN, DESC, MODEL, flip(HASH, 4)) == (True, "left")
+    assert cache.get(CHAN, DESC, MODEL, flip(HASH, 5)) is None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+# The results are kept per channel, object and model
+def test_groups():
+    cache = DetectCache(ttl=60, max_dist=4, max_size=10)
+    cache.put(CHAN, DESC, MODEL, HASH, (True, "left"))
+    assert cache.get("drive", DESC, MODEL, HASH) is None
+    assert cache.get(CHAN, "a cat", MODEL, HASH) is None
+    assert cache.get(CHAN, DESC, "ollama:llava", HASH) is None
+
+# The entries expire after the TTL, zero TTL turns the cache off
+def test_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    cache = DetectCache(ttl=10, max_dist=0, max_size=10)
+    cache.put(CHAN, DESC, MODEL, HASH, (False, None))
+    now[0] += 9
+    assert cache.get(CHAN, DESC, MODEL, HASH) == (False, None)
+    now[0] += 2
+    assert cache.get(CHAN, DESC, MODEL, HASH) is None
+    assert len(cache.entries) == 0 and len(cache.groups) == 0
+    off = DetectCache(ttl=0, max_dist=0, max_size=10)
+    off.put(CHAN, DESC, MODEL, HASH, (True, "left"))
+    assert off.get(CHAN, DESC, MODEL, HASH) is None
+
+# The least recently used entries go first when the cache is full
+def test_lru_bound():
+    cache = DetectCache(ttl=60, max_dist=0, max_size=2)
+    hashes = [flip(HASH, bits) for bits in (0, 8, 16)]
+    cache.put(CHAN, DESC, MODEL, hashes[0], (True, "a"))
+    cache.put(CHAN, DESC, MODEL, hashes[1], (True, "b"))
+    assert cache.get(CHAN, DESC, MODEL, hashes[0]) == (True, "a") # now the most recently used
+    cache.put(CHAN, DESC, MODEL, hashes[2], (True, "c"))
+    assert cache.get(CHAN, DESC, MODEL, hashes[1]) is None
+    assert cache.get(CHAN, DESC, MODEL, hashes[0]) == (True, "a")
+    assert cache.get(CHAN, DESC, MODEL, hashes[2]) == (True, "c")
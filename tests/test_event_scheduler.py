@@ -0,0 +1,75 @@
+import time
+import threading
+import pytest
+import event_scheduler
+from event_scheduler import *
+
+@pytest.fixture
+def scheduler():
+    sched = EventScheduler()
+    yield sched
+    sched.stop()
+
+# Collect the keys of the fired timers (w/ an event set when the expected count is reached)
+class Fired:
+    def __init__(self, count):
+        self.keys = []
+        self.count = count
+        self.done = threading.Event()
+
+    def callback(self, key):
+        def fire():
+            self.keys.append(key)
+            if len(self.keys) >= self.count:
+                self.done.set()
+        return fire
+
+# The timers run in the deadline order, not the order they were scheduled in
+def test_deadline_order(scheduler):
+    fired = Fired(3)
+    now = time.time()
+    for key, delay in [("c", 0.15), ("a", 0.05), ("b", 0.1)]:
+        scheduler.schedule(key, now + delay, fired.callback(key))
+    assert fired.done.wait(2)
+    assert fired.keys == ["a", "b", "c"]
+
+# The cancelled timer does not run
+def test_cancel(scheduler):
+    fired = Fired(1)
+    now = time.time()
+    scheduler.schedule("gone", now + 0.05, fired.callback("gone"))
+    scheduler.schedule("kept", now + 0.1, fired.callback("kept"))
+    scheduler.cancel("gone")
+    scheduler.cancel("never scheduled")
+    assert fired.done.wait(2)
+    time.sleep(0.1)
+    assert fired.keys == ["kept"]
+
+# Scheduling w/ the key of the pending timer replaces it, earlier or later
+def test_reschedule(scheduler):
+    fired = Fired(2)
+    now = time.time()
+    scheduler.schedule("later", now + 0.05, fired.callback("later-old"))
+    scheduler.schedule("later", now + 0.2, fired.callback("later"))
+    scheduler.schedule("sooner", now + 10, fired.callback("sooner-old"))
+    scheduler.schedule("sooner", now + 0.1, fired.callback("sooner"))
+    assert fired.done.wait(2)
+    time.sleep(0.1)
+    assert fired.keys == ["sooner", "later"]
+
+# The heap is compacted when the replaced timers pile up, the pending ones are kept
+def test_compaction(scheduler):
+    far = time.time() + 60
+    for i in range(event_scheduler.SCHED_compact_min * 4):
+        scheduler.schedule(i % 3, far + i, lambda: None)
+    assert len(scheduler.timers) == 3
+    assert len(scheduler.heap) <= 2 * len(scheduler.timers) + event_scheduler.SCHED_compact_min
+    assert sorted([key for deadline, seq, key in scheduler.heap if scheduler.is_pending((deadline, seq, key))]) == [0, 1, 2]
+
+# The failing callback does not stop the scheduler
+def test_callback_error(scheduler):
+    fired = Fired(1)
+    now = time.time()
+    scheduler.schedule("bad", now + 0.02, lambda: 1 / 0)
+    scheduler.schedule("good", now + 0.05, fired.callback("good"))
+    assert fired.done.wait(2)
@@ -0,0 +1,67 @@
+import struct
+from frame_ring import *
+
+# Publish a few frames, the reader gets the latest one and only the new ones after it
+def test_publish_read_latest(tmp_path):
+    path = str(tmp_path / "frames.ring")
+    writer = FrameRingWriter(path, RING_min_slot_size)
+    reader = FrameRingReader(path)
+    assert reader.read_next() is None
+    for i in range(1, 6):
+        writer.publish(b"frame%d" % i, i, {"n": i}, 100.0 + i)
+    frame = reader.read_next()
+    assert frame.seq == 5 and frame.iter == 5 and frame.time == 105.0
+    assert frame.meta == {"n": 5} and frame.copy_data() == b"frame5"
+    assert reader.read_next() is None
+    writer.publish(b"frame6", 6, {"n": 6})
+    assert reader.read_next().copy_data() == b"frame6"
+    assert reader.read_latest(after_seq=6) is None
+
+# The latest seq is stored where the header format puts it
+def test_header_layout(tmp_path):
+    path = str(tmp_path / "frames.ring")
+    writer = FrameRingWriter(path, RING_min_slot_size, slots=3)
+    writer.publish(b"x", 1)
+    writer.publish(b"y", 2)
+    with open(path, "rb") as f:
+        hdr = f.read(struct.calcsize(RING_hdr_fmt))
+    magic, version, flags, slots, slot_size, latest = struct.unpack(RING_hdr_fmt, hdr)
+    assert (magic, version, flags, slots, slot_size, latest) == (RING_magic, RING_version, 0, 3, RING_min_slot_size, 2)
+
+# The frame view turns invalid once the writer reuses its slot
+def test_overwritten_frame(tmp_path):
+    path = str(tmp_path / "frames.ring")
+    writer = FrameRingWriter(path, RING_min_slot_size, slots=2)
+    reader = FrameRingReader(path)
+    writer.publish(b"old", 1)
+    frame = reader.read_next()
+    assert frame.is_valid()
+    writer.publish(b"new1", 2)
+    writer.publish(b"new2", 3) # same slot as the first frame
+    assert not frame.is_valid()
+    assert frame.copy_data() is None
+
+# Growing the slots retires the ring file, the reader switches to the new one
+def test_retire_and_reopen(tmp_path):
+    path = str(tmp_path / "frames.ring")
+    writer = FrameRingWriter(path, RING_min_slot_size)
+    reader = FrameRingReader(path)
+    writer.publish(b"small", 1)
+    assert reader.read_next().copy_data() == b"small"
+    big = b"b" * (RING_min_slot_size + 1)
+    writer.publish(big, 2)
+    assert writer.slot_size > RING_min_slot_size
+    assert reader.is_stale()
+    frame = reader.read_next()
+    assert frame is not None and frame.copy_data() == big
+    assert reader.slot_size == writer.slot_size
+
+# Retiring the ring file w/o the writer (the imager channel removed) marks it for the readers
+def test_ring_retire(tmp_path):
+    path = str(tmp_path / "frames.ring")
+    writer = FrameRingWriter(path, RING_min_slot_size)
+    writer.publish(b"x", 1)
+    reader = FrameRingReader(path)
+    assert reader.open() and not reader.is_stale()
+    ring_retire(path)
+    assert reader.is_stale()
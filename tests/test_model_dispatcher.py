@@ -0,0 +1,151 @@
+import time
+import asyncio
+import threading
+import pytest
+import model_dispatcher
+from model_dispatcher import *
+
+# Model interface stand-in, records the objects asked about, the requests can be held
+# until the gate is set, fail or be answered right away
+class FakeModel:
+    def __init__(self, api_base="http://fake/v1"):
+        self.api_base = api_base
+        self.calls = []
+        self.fail = False
+        self.healthy = True
+        self.gate = None # threading.Event the requests wait for (None if not holding them)
+
+    # The blocking variant is only looked up by the dispatcher (the async one is called)
+    def locate(self, image_data, obj_desc, image_desc):
+        raise NotImplementedError
+
+    async def locate_async(self, image_data, obj_desc, image_desc):
+        self.calls.append(obj_desc)
+        while self.gate is not None and not self.gate.is_set():
+            await asyncio.sleep(0.01)
+        if self.fail:
+            raise Exception("model error")
+        return True, f"{obj_desc} on the left"
+
+    async def health_async(self):
+        if not self.healthy:
+            raise Exception("model is down")
+        return True
+
+# Wait for the condition to become true (checked every 10ms), fail the test on timeout
+def wait_until(check, timeout=2.0):
+    end = time.time() + timeout
+    while not check():
+        assert time.time() < end, "timed out waiting"
+        time.sleep(0.01)
+
+# Submit a single locate request for the object
+def submit(dispatcher, obj_desc, priority, deadline=None):
+    return dispatcher.submit_all([("image", obj_desc, "camera")], priority, deadline)
+
+@pytest.fixture
+def model():
+    return FakeModel()
+
+@pytest.fixture
+def blocked(model):
+    model.gate = threading.Event()
+    dispatcher = ModelDispatcher(model, max_inflight=1, max_queue=2)
+    blocker = submit(dispatcher, "blocker", DISPATCH_prio_alert)
+    wait_until(lambda: model.calls == ["blocker"])
+    yield dispatcher
+    model.gate.set()
+    blocker.result(timeout=2)
+    dispatcher.stop()
+
+# The waiting requests go by priority, then by deadline
+def test_priority_deadline_order(model, blocked):
+    blocked.max_queue = 4
+    now = time.time()
+    futures = []
+    for obj_desc, priority, deadline in [("dataset", DISPATCH_prio_dataset, now + 10), ("location late", DISPATCH_prio_location, now + 10),
+                                         ("location soon", DISPATCH_prio_location, now + 5), ("alert", DISPATCH_prio_alert, now + 10)]:
+        futures.append(submit(blocked, obj_desc, priority, deadline))
+        wait_until(lambda: len(blocked.queue) == len(futures))
+    model.gate.set()
+    for f in futures:
+        assert not isinstance(f.result(timeout=2)[0], Exception)
+    assert model.calls == ["blocker", "alert", "location soon", "location late", "dataset"]
+
+# Too many waiting, the lowest priority and, within it, the oldest requests are shed
+def test_shed_order(model, blocked):
+    futures = {}
+    for obj_desc, priority in [("dataset old", DISPATCH_prio_dataset), ("location", DISPATCH_prio_location),
+                               ("dataset new", DISPATCH_prio_dataset), ("alert", DISPATCH_prio_alert)]:
+        futures[obj_desc] = submit(blocked, obj_desc, priority)
+        wait_until(lambda: len(blocked.queue) == min(len(futures), 2))
+    for obj_desc in ["dataset old", "dataset new"]:
+        res = futures[obj_desc].result(timeout=2)[0]
+        assert isinstance(res, DispatchDropped) and "shed" in str(res)
+    model.gate.set()
+    assert futures["alert"].result(timeout=2)[0] == (True, "alert on the left")
+    assert futures["location"].result(timeout=2)[0] == (True, "location on the left")
+    assert model.calls == ["blocker", "alert", "location"]
+    assert blocked.m_shed == [0, 0, 2]
+
+# The requests still waiting at their deadline and the ones past it are dropped
+def test_deadline_expiry(model, blocked):
+    waiting = submit(blocked, "waiting", DISPATCH_prio_location, time.time() + 0.1)
+    late = submit(blocked, "late", DISPATCH_prio_location, time.time() - 1)
+    for f in [waiting, late]:
+        res = f.result(timeout=2)[0]
+        assert isinstance(res, DispatchDropped) and "expired" in str(res)
+    assert len(blocked.queue) == 0
+    assert blocked.m_expired[DISPATCH_prio_location] == 2
+    assert model.calls == ["blocker"]
+
+# The failing endpoint's circuit breaker opens and the requests are rejected right away
+def test_breaker_opens(model):
+    model.fail = True
+    dispatcher = ModelDispatcher(model, max_inflight=1, max_queue=10)
+    try:
+        ep = dispatcher.endpoints[0]
+        for i in range(DISPATCH_open_failures):
+            if ep.open:
+                break
+            assert isinstance(submit(dispatcher, f"req{i}", DISPATCH_prio_location).result(timeout=2)[0], Exception)
+        assert ep.breaker_state() == "OPEN"
+        calls = len(model.calls)
+        res = submit(dispatcher, "rejected", DISPATCH_prio_location).result(timeout=2)[0]
+        assert isinstance(res, DispatchDropped) and "rejected" in str(res)
+        assert len(model.calls) == calls
+    finally:
+        dispatcher.stop()
+
+# The passing probe only half opens the breaker, a single trial request goes through, the
+# breaker opens again if it fails and closes if it succeeds
+def test_breaker_half_open(model, monkeypatch):
+    monkeypatch.setattr(model_dispatcher, "DISPATCH_probe_int", 0.05)
+    model.fail = True
+    model.healthy = False
+    dispatcher = ModelDispatcher(model, max_inflight=2, max_queue=10)
+    try:
+        ep = dispatcher.endpoints[0]
+        wait_until(lambda: ep.breaker_state() == "OPEN")
+        model.healthy = True
+        wait_until(lambda: ep.breaker_state() == "half-open")
+        time.sleep(0.2) # more passing probes do not close it
+        assert ep.breaker_state() == "half-open"
+        # failed trial, the retry is rejected as the breaker is open again
+        assert isinstance(submit(dispatcher, "trial1", DISPATCH_prio_location).result(timeout=2)[0], Exception)
+        assert model.calls == ["trial1"]
+        wait_until(lambda: ep.breaker_state() == "half-open")
+        # the other requests wait for the trial request to succeed
+        model.fail = False
+        model.gate = threading.Event()
+        trial = submit(dispatcher, "trial2", DISPATCH_prio_location)
+        wait_until(lambda: model.calls == ["trial1", "trial2"])
+        waiting = submit(dispatcher, "waiting", DISPATCH_prio_location)
+        wait_until(lambda: len(dispatcher.queue) == 1)
+        assert model.calls == ["trial1", "trial2"]
+        model.gate.set()
+        assert trial.result(timeout=2)[0] == (True, "trial2 on the left")
+        assert waiting.result(timeout=2)[0] == (True, "waiting on the left")
+        assert ep.breaker_state() == "closed"
+    finally:
+        dispatcher.stop()
@@ -14,7 +14,8 @@ MODEL_KEY_MAP = {
     'object': {
         'model_to_use': CFG_obj_model_name_key,
         'api_base': CFG_obj_model_url_key,
-        'api_key': CFG_obj_model_tkn_key
+        'api_key': CFG_obj_model_tkn_key,
+        'keep_alive': CFG_obj_model_keep_alive_key
     },
     'label': {
         'model_to_use': CFG_lbl_model_name_key,
@@ -115,12 +116,15 @@ def configure_models_sm(key):
         
         # Conditionally show URL input
         if 'api_base' in current_obj_params:
-            st.session_state.model_config[CFG_obj_model_url_key] = st.text_input(
+            url = st.session_state.model_config.get(CFG_obj_model_url_key, "")
+            url = st.text_input(
                 "Model URL",
-                value=st.session_state.model_config.get(CFG_obj_model_url_key, ""),
-                help="Endpoint URL for the object detection model interface",
+                value=", ".join(url) if isinstance(url, list) else url,
+                help="Endpoint URL for the object detection model interface (comma separated list to balance the requests across several endpoints)",
                 key=f"obj_url_{new_obj_if}"  # Unique key based on selection
             )
+            urls = [u.strip() for u in url.split(",") if len(u.strip()) > 0]
+            st.session_state.model_config[CFG_obj_model_url_key] = urls if len(urls) > 1 else url.strip()
         
     with col2:
         # Conditionally show Model Name input
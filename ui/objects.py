@@ -57,7 +57,8 @@ def output_objects_json(objects_dict, model, new_version):
             CFG_obj_id_key: obj_id,
             CFG_obj_names_key: [x.strip() for x in obj_data['names'].split(',')],
             CFG_obj_desc_key: obj_data['desc'],
-            CFG_obj_svcs_key: active_services
+            CFG_obj_svcs_key: active_services,
+            **obj_data.get('extra', {})
         })
 
     output = {
@@ -98,7 +99,9 @@ def read_objects_json():
                 objects_dict[obj_id] = {
                     'names': ','.join(obj[CFG_obj_names_key]),
                     'desc': obj[CFG_obj_desc_key],
-                    'svcs': merged_services
+                    'svcs': merged_services,
+                    # keys not edited in the UI (e.g. the prefilter settings), saved back as they are
+                    'extra': {k: v for k, v in obj.items() if k not in [CFG_obj_id_key, CFG_obj_names_key, CFG_obj_desc_key, CFG_obj_svcs_key]}
                 }
     return objects_dict, version
 
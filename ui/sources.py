@@ -10,27 +10,32 @@ sys.path.append(os.path.abspath("."))
 
 from ui_common import *
 
+# Channel config keys managed by this UI page (the others are passed through as is)
+UI_CHAN_KEYS = [CFG_chan_id_key, CFG_chan_name_key, CFG_chan_url_key, CFG_chan_upd_int_key,
+                CFG_chan_img_w_key, CFG_chan_img_h_key, CFG_chan_img_q_key]
+
 # Create sources.json file
-def output_sources_json(channel_input, name_input, url_input, slider_input, width_input, height_input, quality_input, new_version):
+def output_sources_json(channel_input, name_input, url_input, slider_input, width_input, height_input, quality_input, new_version, extra_input=None):
     channels = list()
     for i in range(len(channel_input)):
-        channels.append(
-            {
-                CFG_chan_id_key: channel_input[i],
-                CFG_chan_name_key: name_input[i],
-                CFG_chan_url_key: url_input[i],
-                CFG_chan_upd_int_key: slider_input[i],
-                CFG_chan_img_w_key: width_input[i],
-                CFG_chan_img_h_key: height_input[i],
-                CFG_chan_img_q_key: quality_input[i]
-            }
-        )
+        channel = {
+            CFG_chan_id_key: channel_input[i],
+            CFG_chan_name_key: name_input[i],
+            CFG_chan_url_key: url_input[i],
+            CFG_chan_upd_int_key: slider_input[i],
+            CFG_chan_img_w_key: width_input[i],
+            CFG_chan_img_h_key: height_input[i],
+            CFG_chan_img_q_key: quality_input[i]
+        }
+        # keep the options set by hand in the config file (e.g. frame_ipc)
+        if extra_input is not None:
+            channel.update(extra_input[i])
+        channels.append(channel)
 
-    # Define the final JSON structure
-    output = {
-        CFG_version_key: new_version,
-        CFG_channels_key: channels
-    }
+    # Define the final JSON structure (keep the top level options set by hand, e.g. engine)
+    output = read_sources_top_level()
+    output[CFG_version_key] = new_version
+    output[CFG_channels_key] = channels
 
     # Convert the structure to a JSON string
     output_json = json.dumps(output, indent=4)
@@ -44,6 +49,17 @@ def output_sources_json(channel_input, name_input, url_input, slider_input, widt
     # Print the JSON output
     print(output_json)
 
+# Read the top level options from sources.json (everything but the version and channels)
+def read_sources_top_level():
+    output = {}
+    try:
+        with open(imgsrc_cfg_json_path, "r") as file:
+            data = json.load(file)
+        output = {k: v for k, v in data.items() if k not in [CFG_version_key, CFG_channels_key]}
+    except:
+        pass
+    return output
+
 # Add an extra source channel
 def add_channel():
     rnd = hex(random.getrandbits(64))[2:]
@@ -75,7 +91,8 @@ def read_sources_json():
                     "slider": channel[CFG_chan_upd_int_key],
                     "width": channel.get(CFG_chan_img_w_key, 1280),
                     "height": channel.get(CFG_chan_img_h_key, 720),
-                    "quality": channel.get(CFG_chan_img_q_key, 50)
+                    "quality": channel.get(CFG_chan_img_q_key, 50),
+                    "extra": {k: v for k, v in channel.items() if k not in UI_CHAN_KEYS}
                 }
     return (channels, version)
 
@@ -286,7 +303,8 @@ def configure_sources_sm(key):
             [chan["width"] for chan in st.session_state.channels.values()],
             [chan["height"] for chan in st.session_state.channels.values()],
             [chan["quality"] for chan in st.session_state.channels.values()],
-            st.session_state.sources_version
+            st.session_state.sources_version,
+            [chan.get("extra", {}) for chan in st.session_state.channels.values()]
         )
         st.session_state.app_state = "init"
         st.rerun()
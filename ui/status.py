@@ -1,5 +1,6 @@
 import streamlit as st
 import os
+import io
 import sys
 from PIL import Image, ImageDraw, ImageFont
 
@@ -8,6 +9,7 @@ sys.path.append(os.path.dirname(__file__))
 sys.path.append(os.path.abspath("."))
 
 from ui_common import *
+from frame_ring import *
 
 # System status state machine section
 def system_status_sm(key):
@@ -30,12 +32,21 @@ def system_status_sm(key):
         if st.button('Refresh'):
             st.rerun()  # Rerun the app to refresh the page
 
-    # Display channel's current image
+    # Display channel's current image (from the frame ring if the channel uses it)
     image_path = f"{IMGDIR}/{selected_channel}/{IMG_file_name}"
+    ring_path = f"{IMGDIR}/{selected_channel}/{IMG_ring_file_name}"
     try:
-        with open(image_path, "rb") as img_file:
-            img = Image.open(img_file)
+        frame = FrameRingReader(ring_path).read_latest() if os.path.exists(ring_path) else None
+        if frame is not None:
+            img = Image.open(io.BytesIO(frame.data))
+            img.load()
+            if not frame.is_valid():
+                raise Exception(f"frame overwritten while loading from {ring_path}")
             st.image(img, use_container_width=True)
+        else:
+            with open(image_path, "rb") as img_file:
+                img = Image.open(img_file)
+                st.image(img, use_container_width=True)
     except:
         # If image cannot be loaded, display the error one
         load_error_path = os.path.dirname(__file__) + "/load_error.jpg"
@@ -245,7 +245,9 @@ def scan_obj_info(obj_info, object_name, service):
         try:
             with open(evt_file_name, "r") as file:
                 evt_data = json.load(file)
-            new_event_time = evt_data[EVT_in_time_key]
+            # the file is only touched while the same event is seen again
+            new_event_time = max(evt_data[EVT_in_time_key], os.path.getmtime(evt_file_name))
+            evt_data[EVT_in_time_key] = new_event_time
         except json.JSONDecodeError as e:
             print(f"{sys._getframe().f_code.co_name}: file {evt_file_name}, JSON error on line {e.lineno}: {e.msg}")
             continue